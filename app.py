@@ -12,6 +12,9 @@
 A breakdown app which shows what in the scene is out of date.
 """
 
+import time
+
+from sgtk import TankError
 from sgtk.platform import Application
 
 
@@ -20,14 +23,39 @@ class MultiBreakdown(Application):
         """
         Called as the application is being initialized
         """
-        tk_multi_breakdown = self.import_module("tk_multi_breakdown")
-        cb = lambda: tk_multi_breakdown.show_dialog(self)
+        # nothing is imported from the app's package until the command or the
+        # API is first used, so that registering the app costs next to nothing
+        # at engine startup. The package, the frameworks and Qt are then loaded
+        # on demand.
+        self._package = None
+        cb = lambda: self._get_package().show_dialog(self)
         self.engine.register_command(
             "{}...".format(self.get_setting("display_name")),
             cb,
             {"short_name": "breakdown"},
         )
 
+    def destroy_app(self):
+        """
+        Called as the application is being destroyed
+        """
+        # nothing runs if the package was never used, don't import it just to
+        # find out
+        if self._package is not None:
+            self._package.timing.flush(self)
+            self._package.metrics.stop_exporter()
+
+    def _get_package(self):
+        """
+        Returns the tk_multi_breakdown package, which is imported on first use.
+        Timing is configured at the same time, so that the API methods are
+        timed as well when it is enabled.
+        """
+        if self._package is None:
+            self._package = self.import_module("tk_multi_breakdown")
+            self._package.timing.configure(self)
+        return self._package
+
     @property
     def context_change_allowed(self):
         """
@@ -46,11 +74,11 @@ class MultiBreakdown(Application):
         >>> e = sgtk.platform.current_engine()
         >>> e.apps["tk-multi-breakdown"].show_breakdown_dialog()
         """
-        tk_multi_breakdown = self.import_module("tk_multi_breakdown")
+        tk_multi_breakdown = self._get_package()
         fn = lambda: tk_multi_breakdown.show_dialog(self)
         self.engine.execute_in_main_thread(fn)
 
-    def analyze_scene(self):
+    def analyze_scene(self, scene_path=None, compact=False, columnar=False):
         """
         Runs the scene analysis and returns a list of scene items.
 
@@ -131,33 +159,241 @@ class MultiBreakdown(Application):
 
 
 
+        For very large scenes, compact items can be requested instead of dictionaries.
+        These are mappings with the same keys, whose field names and values
+        are interned and whose sg_data is an immutable record shared by all the items
+        referencing the same publish.
+
+        Bulk consumers can request a columnar result instead, holding parallel arrays
+        of node names, node types, template names, versions, publish ids and entities,
+        with repeated strings stored once:
+
+        columns = breakdown_app.analyze_scene(columnar=True)
+        for i in columns.find(node_type="reference", template_name="maya_asset_publish"):
+            print(columns.row(i))
+
+        See the ColumnarItems class of the tk_multi_breakdown.items module for details.
+
+        :param str scene_path: Optional path to a Maya ASCII or Nuke scene file to
+                               analyze instead of the current scene. The file is
+                               parsed without being opened in a DCC.
+        :param bool compact: If True, return BreakdownItem objects instead of
+                             dictionaries to save memory.
+        :param bool columnar: If True, return a ColumnarItems instance instead of
+                              a list.
         :returns: List of dictionaries, see above for example.
         """
-        tk_multi_breakdown = self.import_module("tk_multi_breakdown")
+        tk_multi_breakdown = self._get_package()
+        trim_sg_data = tk_multi_breakdown.breakdown.trim_sg_data
 
         # first, scan the scene and get a list of items
-        items = tk_multi_breakdown.get_breakdown_items()
+        items = tk_multi_breakdown.get_breakdown_items(scene_path)
+
+        if columnar:
+            return tk_multi_breakdown.items.ColumnarItems.from_items(items)
+
+        if compact:
+            factory = tk_multi_breakdown.items.ItemFactory(trim_sg_data)
+            # convert in place so that the dictionaries can be freed as we go
+            for (i, item) in enumerate(items):
+                items[i] = factory.create(item)
+            return items
 
         # if shotgun data is returned for an item, trim this down
         # to return a more basic listing than the one returned
-        # from get_breakdown_items:
+        # from get_breakdown_items. Items of the same publish already
+        # share their data, so only trim it once per publish.
+        trimmed_sg_data = {}
         for item in items:
 
             if item["sg_data"]:
-                new_sg_data = {}
-                new_sg_data["id"] = item["sg_data"]["id"]
-                new_sg_data["type"] = item["sg_data"]["type"]
-                new_sg_data["code"] = item["sg_data"]["code"]
-                new_sg_data["task"] = item["sg_data"]["task"]
-                new_sg_data["name"] = item["sg_data"]["name"]
-                new_sg_data["entity"] = item["sg_data"]["entity"]
-                new_sg_data["project"] = item["sg_data"]["project"]
-                new_sg_data["version_number"] = item["sg_data"]["version_number"]
-                new_sg_data["published_file_type"] = item["sg_data"][
-                    "published_file_type"
-                ]
-                item["sg_data"] = new_sg_data
+                sg_id = id(item["sg_data"])
+                if sg_id not in trimmed_sg_data:
+                    trimmed_sg_data[sg_id] = trim_sg_data(item["sg_data"])
+                item["sg_data"] = trimmed_sg_data[sg_id]
+
+        return items
+
+    def export_snapshot(self, path, scene_path=None, latest_versions=True):
+        """
+        Runs the scene analysis and writes the result to a snapshot file, so that
+        farm jobs and downstream tools can use the breakdown of the scene without
+        scanning it again, see load_snapshot().
+
+        :param str path: Path of the snapshot file to write, gzipped if it ends
+                         with .gz
+        :param str scene_path: Optional path to a scene file to analyze instead of
+                               the current scene, see analyze_scene()
+        :param bool latest_versions: If True, the highest version of each item is
+                                     computed and stored in the snapshot as well
+        :returns: Number of items written
+        """
+        tk_multi_breakdown = self._get_package()
+        version_family_key = tk_multi_breakdown.versions.version_family_key
+
+        items = self.analyze_scene(scene_path=scene_path)
+        # items of the same version family share their highest version, which
+        # is only computed once
+        latest_by_family = {}
+        for item in items:
+            latest_version = None
+            if latest_versions:
+                family_key = version_family_key(item["template"], item["fields"])
+                if family_key not in latest_by_family:
+                    try:
+                        latest_by_family[family_key] = self.compute_highest_version(
+                            item["template"], item["fields"]
+                        )
+                    except TankError as e:
+                        self.log_debug(
+                            "No version found on disk for %s: %s"
+                            % (item["node_name"], e)
+                        )
+                        latest_by_family[family_key] = None
+                latest_version = latest_by_family[family_key]
+            item["latest_version"] = latest_version
+
+        if not scene_path:
+            scene_path = tk_multi_breakdown.breakdown.get_current_scene_path(self)
+
+        return tk_multi_breakdown.snapshot.write_snapshot(path, items, scene_path)
+
+    def load_snapshot(self, path):
+        """
+        Loads a snapshot written by export_snapshot(). The items are read one at
+        a time as the snapshot is iterated over, and have the same keys as the
+        items returned by analyze_scene() plus a latest_version key, which is None
+        if the version wasn't computed or no version was found on disk:
+
+        >>> snapshot = engine.apps["tk-multi-breakdown"].load_snapshot("/tmp/lighting.jsonl.gz")
+        >>> snapshot.scene_path
+        '/shows/abc/.../lighting.v012.ma'
+        >>> for item in snapshot:
+        ...     if item["latest_version"] != item["fields"]["version"]:
+        ...         print(item["node_name"], item["template"])
+        chairRN <Sgtk TemplatePath maya_asset_publish>
+
+        The template object of an item is looked up by name in the current
+        configuration when it is first accessed, and is None if the template
+        doesn't exist. Its name is always available as item.template_name.
+
+        :param str path: Path of the snapshot file
+        :returns: A Snapshot instance to iterate over
+        :raises TankError: If the file is not a breakdown snapshot
+        """
+        tk_multi_breakdown = self._get_package()
+        return tk_multi_breakdown.snapshot.Snapshot(path, templates=self.sgtk.templates)
+
+    def find_dependent_scenes(self, publish_id=None, entity=None, template_name=None):
+        """
+        Looks up the breakdown results stored in the dependency index to find
+        which scenes use a given publish, entity or template. Scenes are added
+        to the index whenever they are analyzed with the dependency_index
+        setting enabled, or by the batch breakdown.
+
+        Exactly one of the parameters must be given. Each result is a
+        dictionary like this:
+
+        {'scene': '/shows/abc/sequences/aaa/aaa_00010/light/work/light.v012.ma',
+         'node_name': 'chairRN',
+         'node_type': 'reference',
+         'template': 'maya_asset_publish',
+         'fields': {'Asset': 'chair', 'Step': 'rig', 'name': 'chair', ...},
+         'version': 12,
+         'publish_id': 1424,
+         'entity': {'type': 'Asset', 'id': 1660}}
+
+        :param int publish_id: Id of a publish
+        :param dict entity: Entity dictionary with type and id keys
+        :param str template_name: Template name, or a glob pattern matching a
+                                  family of templates, e.g. maya_*_publish
+        :returns: List of dictionaries, see above for example.
+        """
+        if len([p for p in (publish_id, entity, template_name) if p is not None]) != 1:
+            raise TankError(
+                "Exactly one of publish_id, entity or template_name must be given."
+            )
+
+        tk_multi_breakdown = self._get_package()
+        index = tk_multi_breakdown.breakdown.get_dependency_index(self)
+
+        if publish_id is not None:
+            return index.find_by_publish(publish_id)
+        if entity is not None:
+            return index.find_by_entity(entity["type"], entity["id"])
+        return index.find_by_template(template_name)
+
+    def get_metrics(self):
+        """
+        Returns the cache and throughput metrics collected by the breakdown
+        since it was started, e.g. to feed a monitoring dashboard.
+
+        Counters and gauges are returned as numbers, and histograms as
+        dictionaries with count, sum, p50, p90 and p99 keys, the percentiles
+        being computed over the most recent observations. Two derived values
+        are also returned:
+
+        {'breakdown_publish_cache_hit_rate': 0.92,
+         'breakdown_publish_cache_hits_total': 230,
+         'breakdown_publish_cache_misses_total': 20,
+         'breakdown_scan_items_per_second': 1250.4,
+         'breakdown_sg_queries_per_breakdown': {'count': 3, 'sum': 3, 'p50': 1, ...},
+         'breakdown_sg_queries_total': 3,
+         'breakdown_version_scan_seconds': {'count': 250, 'sum': 4.1,
+                                            'p50': 0.012, 'p90': 0.031, 'p99': 0.2},
+         ...}
+
+        :returns: Dictionary of metric name -> value
+        """
+        metrics = self._get_package().metrics
+        snapshot = metrics.g_registry.snapshot()
+
+        lookups = metrics.publish_cache_hits.value + metrics.publish_cache_misses.value
+        snapshot["breakdown_publish_cache_hit_rate"] = (
+            float(metrics.publish_cache_hits.value) / lookups if lookups else None
+        )
+        return snapshot
 
+    def replay_scene(self, archive_path, speed=1.0):
+        """
+        Replays a breakdown captured in another session, e.g. on a production
+        workstation with the capture_path setting or the
+        TK_MULTI_BREAKDOWN_CAPTURE environment variable set, to profile it
+        offline.
+
+        The scene scan, the Shotgun queries and the disk lookups of the version
+        hook are answered from the archive rather than by the DCC, Shotgun and
+        the file system, each taking the time it took when it was captured. The
+        publish data cached in memory by the breakdown is discarded before and
+        after the replay, so that all the queries are replayed.
+
+        :param str archive_path: Path of the archive written by the capture
+        :param float speed: Factor applied to the captured durations, e.g. 0 to
+                            replay as fast as possible
+        :returns: List of items on the same form as analyze_scene(), with an extra
+                  latest_version key holding the version computed by the hook, or
+                  None if the hook failed
+        """
+        tk_multi_breakdown = self._get_package()
+        breakdown = tk_multi_breakdown.breakdown
+        replay = tk_multi_breakdown.replay
+
+        breakdown.g_cached_sg_publish_data.clear()
+        breakdown.g_cached_sg_publish_details.clear()
+        try:
+            with replay.replaying(archive_path, speed=speed):
+                items = breakdown.get_breakdown_items()
+                for item in items:
+                    try:
+                        item["latest_version"] = self.compute_highest_version(
+                            item["template"], item["fields"]
+                        )
+                    except Exception as e:
+                        self.log_debug("Failed to replay the version hook: %s" % e)
+                        item["latest_version"] = None
+        finally:
+            breakdown.g_cached_sg_publish_data.clear()
+            breakdown.g_cached_sg_publish_details.clear()
         return items
 
     def compute_highest_version(self, template, fields):
@@ -173,9 +409,46 @@ class MultiBreakdown(Application):
         :param fields: A complete set of fields for the template
         :returns: The highest version number found
         """
-        return self.execute_hook(
-            "hook_get_version_number", template=template, curr_fields=fields
-        )
+        timing = self._get_package().timing
+        with timing.span("compute_highest_version", template=template.name):
+            return self.execute_hook(
+                "hook_get_version_number", template=template, curr_fields=fields
+            )
+
+    def find_highest_version(self, template, fields):
+        """
+        Scans the disk for the highest version of the given template and fields,
+        without going through the get_version_number hook. This is the default
+        logic of the hook, which hook overrides can call as well:
+
+        >>> class GetVersionNumber(HookBaseClass):
+        ...     def execute(self, template, curr_fields, **kwargs):
+        ...         return self.parent.find_highest_version(template, curr_fields)
+
+        Lookups are shared through the local cache service when it is enabled,
+        and templates matching the probe_version_templates setting are searched
+        by probing for versions rather than listing them.
+
+        :param template: Template object to calculate for
+        :param fields: A complete set of fields for the template
+        :returns: The highest version number found
+        :raises TankError: If no versions were found on disk
+        """
+        tk_multi_breakdown = self._get_package()
+        versions = tk_multi_breakdown.versions
+        start = time.time()
+        try:
+            return versions.get_highest_version(
+                self.sgtk,
+                template,
+                fields,
+                service=tk_multi_breakdown.breakdown.get_cache_client(self),
+                strategy=versions.get_search_strategy(
+                    template, self.get_setting("probe_version_templates")
+                ),
+            )
+        finally:
+            tk_multi_breakdown.metrics.version_scan_seconds.observe(time.time() - start)
 
     def update_item(self, node_type, node_name, template, fields):
         """
@@ -197,4 +470,111 @@ class MultiBreakdown(Application):
         item["path"] = template.apply_fields(fields)
 
         # call out to hook
-        return self.execute_hook_method("hook_scene_operations", "update", items=[item])
+        timing = self._get_package().timing
+        with timing.span("update", items=1):
+            return self.execute_hook_method(
+                "hook_scene_operations", "update", items=[item]
+            )
+
+    def update_items(self, items, progress_callback=None):
+        """
+        Request that the breakdown updates a number of nodes with new versions.
+        The update hook is called with slices of items of the same node type,
+        as set by the update_slice_size setting, rather than with all the items
+        at once. Each slice is its own undo step, and the update stops after a
+        slice if the hook reports that the user cancelled it.
+
+        :param items: List of dictionaries with node_type, node_name, template and
+                      fields keys, as taken by update_item(), the fields holding
+                      the version to update to
+        :param progress_callback: Optional callable taking the number of items
+                                  updated so far and the total number of items,
+                                  called after each slice
+        :returns: List of the values returned by the hook, one per slice
+        """
+        tk_multi_breakdown = self._get_package()
+        executor = tk_multi_breakdown.update_executor.UpdateExecutor(self)
+        return executor.run(
+            self._get_update_hook_items(items), progress_callback=progress_callback
+        )
+
+    def update_items_async(self, items, progress_callback=None, done_callback=None):
+        """
+        Same as update_items(), but returns right away while the update runs in
+        the background, each slice being updated in the main thread so that the
+        DCC stays responsive in between. The returned handle is similar to a
+        future and can be used to follow the progress or cancel the update:
+
+        >>> handle = breakdown_app.update_items_async(items)
+        >>> handle.progress
+        (50, 500)
+        >>> handle.cancel()
+
+        Cancelling stops the update once the slice being updated is done.
+        The callbacks are called in the main thread, and the handle must not be
+        waited for from the main thread.
+
+        :param items: List of dictionaries with node_type, node_name, template and
+                      fields keys, see update_items()
+        :param progress_callback: Optional callable taking the number of items
+                                  updated so far and the total number of items
+        :param done_callback: Optional callable taking the handle, called once the
+                              update is over
+        :returns: An UpdateHandle
+        """
+        tk_multi_breakdown = self._get_package()
+        executor = tk_multi_breakdown.update_executor.UpdateExecutor(self)
+        return executor.submit(
+            self._get_update_hook_items(items),
+            progress_callback=progress_callback,
+            done_callback=done_callback,
+        )
+
+    def check_update_targets(self, items):
+        """
+        Checks the files a number of nodes would be updated to, from a pool of
+        threads as set by the preflight_workers setting, without touching the
+        scene. Single files must exist, and frame sequences must have no gaps
+        in their frame range, for each eye of stereo sequences. Items with a
+        current_fields key, holding the fields of the version currently loaded,
+        must also have all the eyes of that version, and at least its frames
+        if the preflight_require_current_frames setting is enabled.
+
+        >>> plan = breakdown_app.check_update_targets(items)
+        >>> plan.get_summary()
+        '480 items to update (12.3 GB), 15 incomplete, 5 missing'
+        >>> breakdown_app.update_items_async(
+        ...     [items[i] for i, c in enumerate(plan.checks) if c.status == "ok"]
+        ... )
+
+        :param items: List of dictionaries with node_type, node_name, template and
+                      fields keys, see update_items()
+        :returns: An UpdatePlan, with a TargetCheck per item in the same order
+        """
+        preflight = self._get_package().preflight
+        targets = []
+        for (item, hook_item) in zip(items, self._get_update_hook_items(items)):
+            hook_item["template"] = item["template"]
+            hook_item["fields"] = item["fields"]
+            hook_item["current_fields"] = item.get("current_fields")
+            targets.append(hook_item)
+        return preflight.check_targets(
+            self.sgtk,
+            targets,
+            max_workers=self.get_setting("preflight_workers")
+            or preflight.DEFAULT_WORKERS,
+            require_current_frames=self.get_setting("preflight_require_current_frames"),
+        )
+
+    def _get_update_hook_items(self, items):
+        """
+        :returns: The items on the form expected by the update hook
+        """
+        return [
+            {
+                "node": item["node_name"],
+                "type": item["node_type"],
+                "path": item["template"].apply_fields(item["fields"]),
+            }
+            for item in items
+        ]
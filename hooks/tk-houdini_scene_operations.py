@@ -19,9 +19,23 @@ class BreakdownSceneOperations(Hook):
     """
     Breakdown operations for Houdini.
 
-    This implementation handles detection of alembic node paths.
+    This implementation handles detection of all file references in the scene,
+    e.g. alembic and file SOPs, USD references and textures.
     """
 
+    # file references on nodes of these categories are outputs and are skipped
+    EXCLUDED_NODE_TYPE_CATEGORIES = ("Driver",)
+
+    # file references on nodes whose type name starts with one of these are
+    # outputs and are skipped
+    EXCLUDED_NODE_TYPE_PREFIXES = ("rop_",)
+
+    # number of parms updated between two progress reports
+    UPDATE_BATCH_SIZE = 100
+
+    # file parm of alembic SOPs, whose items are addressed by node path
+    ALEMBIC_PARM = "fileName"
+
     def scan_scene(self):
         """
         The scan scene method is executed once at startup and its purpose is
@@ -41,26 +55,99 @@ class BreakdownSceneOperations(Hook):
         Toolkit will scan the list of items, see if any of the objects matches
         any templates and try to determine if there is a more recent version
         available. Any such versions are then displayed in the UI as out of date.
+
+        Alembic SOPs are addressed by node path, as they always were, while
+        the other file references are addressed by parm path since a node can
+        hold several of them, e.g. /obj/geo1/file1/file.
         """
 
         items = []
 
-        # get a list of all regular lembic nodes in the file
-        alembic_nodes = hou.nodeType(hou.sopNodeTypeCategory(), "alembic").instances()
-
-        # return an item for each alembic node found. the breakdown app will check
-        # the paths of each looking for a template match and a newer version.
-        for alembic_node in alembic_nodes:
-
-            file_parm = alembic_node.parm("fileName")
-            file_path = os.path.normpath(file_parm.eval())
+        # evaluated paths keyed by the raw parm value, so that parms holding
+        # the same expression are only evaluated once
+        expanded_paths = {}
+
+        # list all file references in the scene in a single call. the breakdown
+        # app will check the paths of each looking for a template match and a
+        # newer version.
+        for (parm, _) in hou.fileReferences():
+
+            # references which do not belong to a parm, e.g. the hip file
+            if parm is None or self._skip_parm(parm):
+                continue
+
+            raw_value = parm.unexpandedString()
+            if self._is_node_dependent(raw_value):
+                file_path = parm.eval()
+            else:
+                file_path = expanded_paths.get(raw_value)
+                if file_path is None:
+                    file_path = parm.eval()
+                    expanded_paths[raw_value] = file_path
+
+            if not file_path:
+                continue
+
+            node = parm.node()
+            node_type = node.type().name()
+            if node_type == "alembic" and parm.name() == self.ALEMBIC_PARM:
+                node_path = node.path()
+            else:
+                node_path = parm.path()
 
             items.append(
-                {"node": alembic_node.path(), "type": "alembic", "path": file_path}
+                {
+                    "node": node_path,
+                    "type": node_type,
+                    "path": os.path.normpath(file_path),
+                }
             )
 
         return items
 
+    def _skip_parm(self, parm):
+        """
+        Checks if a file reference parm should be left out of the breakdown.
+
+        Parms that are locked, driven by an expression or by a reference to
+        another parm can't be updated, and output parms aren't inputs to the
+        scene.
+
+        :param parm: hou.Parm holding a file reference
+        :returns: True if the parm should be skipped
+        """
+        if parm.isLocked() or parm.keyframes():
+            return True
+
+        if parm.getReferencedParm() != parm:
+            return True
+
+        node_type = parm.node().type()
+        if node_type.category().name() in self.EXCLUDED_NODE_TYPE_CATEGORIES:
+            return True
+
+        return node_type.name().startswith(self.EXCLUDED_NODE_TYPE_PREFIXES)
+
+    def _is_node_dependent(self, raw_value):
+        """
+        Checks if a raw parm value may evaluate differently depending on the
+        node it is on, in which case it can't be shared between parms.
+
+        :param str raw_value: Unexpanded parm value
+        :returns: True if the value depends on the node
+        """
+        return "`" in raw_value or "$OS" in raw_value or "${OS}" in raw_value
+
+    def get_current_scene_path(self):
+        """
+        Returns the path of the current scene. This is used to record which
+        scene the breakdown items were found in.
+
+        :returns: Path to the current scene file, or None if the scene has
+                  not been saved.
+        """
+        return hou.hipFile.path()
+
     def update(self, items):
         """
         Perform replacements given a number of scene items passed from the app.
@@ -71,25 +158,74 @@ class BreakdownSceneOperations(Hook):
         The items parameter is a list of dictionaries on the same form as was
         generated by the scan_scene hook above. The path key now holds
         the that each node should be updated *to* rather than the current path.
+
+        The app may call this method several times for a single update, with
+        slices of items, in which case each call is its own undo step.
+
+        :returns: None if all the items were processed, or the list of the
+                  items processed before the user interrupted the update, so
+                  that the app stops the update.
         """
 
         engine = self.parent.engine
+        processed = []
+
+        # changes are applied with cooking deferred, in one undo block, reporting
+        # progress and allowing interruption between batches.
+        update_mode = hou.updateModeSetting()
+        hou.setUpdateMode(hou.updateMode.Manual)
+        try:
+            with hou.undos.group("Breakdown update"):
+                with hou.InterruptableOperation(
+                    "Updating %d items" % len(items), open_interrupt_dialog=True
+                ) as operation:
+                    for start in range(0, len(items), self.UPDATE_BATCH_SIZE):
+                        for item in items[start : start + self.UPDATE_BATCH_SIZE]:
+                            self._update_item(item)
+                            processed.append(item)
+
+                        done = min(start + self.UPDATE_BATCH_SIZE, len(items))
+                        operation.updateProgress(float(done) / len(items))
+        except hou.OperationInterrupted:
+            engine.log_info(
+                "Breakdown update interrupted after %d of %d items. The parms "
+                "already updated can be reverted with undo."
+                % (len(processed), len(items))
+            )
+            return processed
+        finally:
+            hou.setUpdateMode(update_mode)
 
-        # these items are to be updated. swap out the fileName parm value with the
-        # new path as supplied by the breakdown app.
-        for item in items:
-
-            node_path = item["node"]
-            node_type = item["type"]
-            file_path = item["path"]
+    def _update_item(self, item):
+        """
+        Swaps out the value of the file parm of the given item with the new
+        path as supplied by the breakdown app.
 
-            file_path = file_path.replace("\\", "/")
+        Alembic items are addressed by the path of their node, see scan_scene,
+        and are resolved as such so that a parm whose path happens to be the
+        same isn't updated instead.
 
-            # update the alembic fileName parm to the new path
-            if node_type == "alembic":
+        :param dict item: Item to update, as passed to update()
+        """
+        node_path = item["node"]
+        file_path = item["path"].replace("\\", "/")
+
+        node = hou.node(node_path) if item["type"] == "alembic" else None
+        if node is not None:
+            parm = node.parm(self.ALEMBIC_PARM)
+        else:
+            # the other file parms of alembic nodes are addressed by parm path
+            parm = hou.parm(node_path)
+
+        if parm is None:
+            # the node was renamed or deleted since the scene was scanned
+            self.parent.engine.log_warning(
+                "%s parm '%s' not found, it was not updated."
+                % (item["type"], node_path)
+            )
+            return
 
-                alembic_node = hou.node(node_path)
-                engine.log_debug(
-                    "Updating alembic node '%s' to: %s" % (node_path, file_path)
-                )
-                alembic_node.parm("fileName").set(file_path)
+        self.parent.engine.log_debug(
+            "Updating %s parm '%s' to: %s" % (item["type"], node_path, file_path)
+        )
+        parm.set(file_path)
@@ -8,11 +8,26 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+import time
+
 import sgtk
 from sgtk import Hook, TankError
 
 import mari
 
+# index of geometry version paths, keyed by project uuid, then geo name. Each
+# entry holds the set of version names the entry was built from and a
+# dictionary of version name -> publish path
+g_geometry_version_index = {}
+
+# cache the publish data we pull down for the geometry updates, keyed by path.
+# Each entry holds the time it was fetched and the publish data. The cache is
+# cleared whenever the scene is scanned, i.e. for each breakdown.
+g_cached_publish_data = {}
+
+# number of seconds publish data is reused for within a breakdown
+PUBLISH_CACHE_TTL = 300
+
 
 class MariSceneOperations(Hook):
     """
@@ -41,6 +56,9 @@ class MariSceneOperations(Hook):
         any templates and try to determine if there is a more recent version
         available. Any such versions are then displayed in the UI as out of date.
         """
+        # a new breakdown, make sure publishes made since the last one are seen
+        g_cached_publish_data.clear()
+
         if not mari.projects.current():
             # can't do anything if we don't have an open project!
             return []
@@ -49,27 +67,36 @@ class MariSceneOperations(Hook):
         mari_engine = self.parent.engine
         all_geo = mari_engine.list_geometry()
 
-        # now, for all geo, find all versions:
+        # now, for all geo, find the publish path for the current version:
         found_versions = []
         for geo in [g.get("geo") for g in all_geo]:
 
-            # get all versions for this geo:
-            all_geo_versions = mari_engine.list_geometry_versions(geo)
-
-            # now find the publish path for the current version:
-            current_version = geo.currentVersion()
-            for geo_version, path in [
-                (v["geo_version"], v.get("path")) for v in all_geo_versions
-            ]:
-                if geo_version == current_version:
-                    # found the current version :)
-                    found_versions.append(
-                        {"node": geo.name(), "type": "geo", "path": path}
-                    )
-                    break
+            version_paths = self._get_geometry_version_paths(geo)
+
+            current_version_name = geo.currentVersion().name()
+            if current_version_name in version_paths:
+                # found the current version :)
+                found_versions.append(
+                    {
+                        "node": geo.name(),
+                        "type": "geo",
+                        "path": version_paths[current_version_name],
+                    }
+                )
 
         return found_versions
 
+    def get_current_scene_path(self):
+        """
+        Returns the path of the current scene. This is used to record which
+        scene the breakdown items were found in.
+
+        :returns: Path to the current scene file, or None if the scene has
+                  not been saved.
+        """
+        # mari projects aren't stored in a scene file
+        return None
+
     def update(self, items):
         """
         Perform replacements given a number of scene items passed from the app.
@@ -104,16 +131,7 @@ class MariSceneOperations(Hook):
 
         # first pass, find the publish details for all the paths of all the items
         # we need to update:
-        all_paths = set([item["path"] for item in items])
-        try:
-            fields = ["id", "path", "version_number"]
-            found_publishes = sgtk.util.find_publish(
-                self.parent.sgtk, all_paths, fields=fields
-            )
-        except TankError as e:
-            raise TankError(
-                "Failed to query publishes from Flow Production Tracking: %s" % e
-            )
+        found_publishes = self._find_publishes(set([item["path"] for item in items]))
 
         # now we have all the info we need to update geometry:
         for item in items:
@@ -136,13 +154,11 @@ class MariSceneOperations(Hook):
 
             # check to see if this version is already loaded:
             already_loaded = False
-            all_geo_versions = mari_engine.list_geometry_versions(geo)
-            for geo_version, path in [
-                (v["geo_version"], v.get("path")) for v in all_geo_versions
-            ]:
+            version_paths = self._get_geometry_version_paths(geo)
+            for version_name, path in version_paths.items():
                 if path == publish_path:
                     # we already have this version laoded so just set it as current:
-                    geo.setCurrentVersion(geo_version.name())
+                    geo.setCurrentVersion(version_name)
                     already_loaded = True
                     break
 
@@ -152,4 +168,92 @@ class MariSceneOperations(Hook):
                     geo, sg_publish_data, options
                 )
                 if new_version:
+                    self._add_geometry_version_path(geo, new_version, publish_path)
                     geo.setCurrentVersion(new_version.name())
+
+    def _get_geometry_version_index(self):
+        """
+        Returns the geometry version index for the current project.
+
+        :returns: Dictionary of geo name -> (version names, version paths)
+        """
+        project_uuid = mari.projects.current().uuid()
+        return g_geometry_version_index.setdefault(project_uuid, {})
+
+    def _get_geometry_version_paths(self, geo):
+        """
+        Returns the publish path for each version of the given geo.
+
+        The paths are listed once and cached. The cached entry is only rebuilt
+        if the versions of the geo no longer match the cached ones, e.g. if
+        versions have been added or removed outside of the breakdown.
+
+        :param geo: The mari GeoEntity to find versions for
+        :returns: Dictionary of version name -> publish path
+        """
+        index = self._get_geometry_version_index()
+        version_names = frozenset(geo.versionNames())
+
+        entry = index.get(geo.name())
+        if entry is None or entry[0] != version_names:
+            all_geo_versions = self.parent.engine.list_geometry_versions(geo)
+            version_paths = dict(
+                (v["geo_version"].name(), v.get("path")) for v in all_geo_versions
+            )
+            entry = (version_names, version_paths)
+            index[geo.name()] = entry
+
+        return entry[1]
+
+    def _add_geometry_version_path(self, geo, geo_version, path):
+        """
+        Adds a newly loaded version to the cached index for the given geo.
+
+        :param geo: The mari GeoEntity the version was added to
+        :param geo_version: The mari GeoEntityVersion that was added
+        :param str path: The publish path of the new version
+        """
+        index = self._get_geometry_version_index()
+        (version_names, version_paths) = index.get(geo.name(), (frozenset(), {}))
+
+        version_paths = dict(version_paths)
+        version_paths[geo_version.name()] = path
+        index[geo.name()] = (version_names | set([geo_version.name()]), version_paths)
+
+    def _find_publishes(self, paths):
+        """
+        Finds the publish records for the given paths. Records are cached so
+        that they are only queried once per breakdown, for at most
+        PUBLISH_CACHE_TTL seconds.
+
+        :param paths: Paths to find publishes for
+        :returns: Dictionary of path -> publish data
+        """
+        now = time.time()
+        paths_to_fetch = [
+            p
+            for p in paths
+            if p not in g_cached_publish_data
+            or now - g_cached_publish_data[p][0] > PUBLISH_CACHE_TTL
+        ]
+        if paths_to_fetch:
+            try:
+                fields = ["id", "path", "version_number"]
+                found_publishes = sgtk.util.find_publish(
+                    self.parent.sgtk, paths_to_fetch, fields=fields
+                )
+            except TankError as e:
+                raise TankError(
+                    "Failed to query publishes from Flow Production Tracking: %s" % e
+                )
+            for p in paths_to_fetch:
+                if p in found_publishes:
+                    g_cached_publish_data[p] = (now, found_publishes[p])
+                else:
+                    g_cached_publish_data.pop(p, None)
+
+        return dict(
+            (p, g_cached_publish_data[p][1])
+            for p in paths
+            if p in g_cached_publish_data
+        )
@@ -10,6 +10,7 @@
 
 from sgtk import Hook
 import maya.cmds as cmds
+import maya.api.OpenMaya as om2
 import os
 
 
@@ -20,6 +21,11 @@ class BreakdownSceneOperations(Hook):
     This implementation handles detection of maya references and file texture nodes.
     """
 
+    # when True, file texture nodes are collected through the API iterators in a
+    # single pass rather than with two commands per node. Both code paths return
+    # the same list of items.
+    BATCHED_SCAN = True
+
     def scan_scene(self):
         """
         The scan scene method is executed once at startup and its purpose is
@@ -41,9 +47,18 @@ class BreakdownSceneOperations(Hook):
         available. Any such versions are then displayed in the UI as out of date.
         """
 
+        if self.BATCHED_SCAN:
+            return self._scan_scene_batched()
+        return self._scan_scene_per_node()
+
+    def _scan_references(self):
+        """
+        Returns an item for each top level maya reference in the scene.
+
+        :returns: List of item dictionaries with node, type and path keys.
+        """
         refs = []
 
-        # first let's look at maya references
         for ref in cmds.file(q=True, reference=True):
             node_name = cmds.referenceQuery(ref, referenceNode=True)
 
@@ -54,6 +69,18 @@ class BreakdownSceneOperations(Hook):
             ).replace("/", os.path.sep)
             refs.append({"node": node_name, "type": "reference", "path": maya_path})
 
+        return refs
+
+    def _scan_scene_per_node(self):
+        """
+        Scans the scene issuing a reference query and an attribute query
+        for every file texture node.
+
+        :returns: List of item dictionaries with node, type and path keys.
+        """
+        # first let's look at maya references
+        refs = self._scan_references()
+
         # now look at file texture nodes
         for file_node in cmds.ls(l=True, type="file"):
             # ensure this is actually part of this scene and not referenced
@@ -70,6 +97,47 @@ class BreakdownSceneOperations(Hook):
 
         return refs
 
+    def _scan_scene_batched(self):
+        """
+        Scans the scene walking all file texture nodes once through the
+        API iterators. Node names, reference membership and texture paths are
+        read from the node function set directly, avoiding a command round
+        trip per node.
+
+        :returns: List of item dictionaries with node, type and path keys.
+        """
+        # references are few compared to file nodes, so keep using the
+        # reference queries which handle copy numbers for us.
+        refs = self._scan_references()
+
+        dep_node_fn = om2.MFnDependencyNode()
+        node_iter = om2.MItDependencyNodes(om2.MFn.kFileTexture)
+        while not node_iter.isDone():
+            dep_node_fn.setObject(node_iter.thisNode())
+
+            # skip nodes embedded in another reference
+            if not dep_node_fn.isFromReferencedFile:
+                path = (
+                    dep_node_fn.findPlug("fileTextureName", False)
+                    .asString()
+                    .replace("/", os.path.sep)
+                )
+                refs.append({"node": dep_node_fn.name(), "type": "file", "path": path})
+
+            node_iter.next()
+
+        return refs
+
+    def get_current_scene_path(self):
+        """
+        Returns the path of the current scene. This is used to record which
+        scene the breakdown items were found in.
+
+        :returns: Path to the current scene file, or None if the scene has
+                  not been saved.
+        """
+        return cmds.file(query=True, sceneName=True) or None
+
     def update(self, items):
         """
         Perform replacements given a number of scene items passed from the app.
@@ -9,6 +9,7 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+import time
 import nuke
 
 import sgtk
@@ -24,6 +25,15 @@ class BreakdownSceneOperations(HookBaseClass):
     geometry nodes and camera nodes.
     """
 
+    # node classes with a file knob that the breakdown can operate on
+    NODE_CLASSES = ("Read", "ReadGeo2", "Camera2")
+
+    # when True, the contents of groups and gizmos are scanned as well
+    RECURSE_GROUPS = True
+
+    # number of items updated between two progress reports
+    PROGRESS_STEP = 50
+
     def scan_scene(self):
         """
         The scan scene method is executed once at startup and its purpose is
@@ -56,12 +66,19 @@ class BreakdownSceneOperations(HookBaseClass):
 
             for project in hiero.core.projects():
                 for clip in project.clipsBin().clips():
-                    files = clip.activeItem().mediaSource().fileinfos()
-                    for file in files:
-                        path = file.filename().replace("/", os.path.sep)
+                    active_item = clip.activeItem()
+
+                    # a clip can list the same file several times, only
+                    # return it once
+                    clip_paths = set()
+                    for file in active_item.mediaSource().fileinfos():
+                        path = self._normalize_path(file.filename())
+                        if path in clip_paths:
+                            continue
+                        clip_paths.add(path)
                         reads.append(
                             dict(
-                                node=clip.activeItem(),
+                                node=active_item,
                                 type="Clip",
                                 path=path,
                             )
@@ -71,32 +88,84 @@ class BreakdownSceneOperations(HookBaseClass):
         if self.parent.engine.hiero_enabled:
             return reads
 
-        # first let's look at the read nodes
-        for node in nuke.allNodes("Read"):
+        # walk the node graph once and dispatch on the node class
+        counts = dict((node_class, 0) for node_class in self.NODE_CLASSES)
+        timings = dict((node_class, 0.0) for node_class in self.NODE_CLASSES)
+        scan_start = time.time()
+
+        for node in self._walk_nodes(nuke.root()):
+
+            node_class = node.Class()
+            if node_class not in counts:
+                continue
 
-            node_name = node.name()
+            node_start = time.time()
 
             # note! We are getting the "abstract path", so contains
-            # %04d and %V rather than actual values.
-            path = node.knob("file").value().replace("/", os.path.sep)
+            # %04d and %V rather than actual values. Nodes inside groups
+            # are addressed by their full name, e.g. Group1.Read1. Nodes
+            # sharing a path each get an item since each has to be updated,
+            # the path is only matched against the templates once.
+            path = self._normalize_path(node.knob("file").value())
+            reads.append({"node": node.fullName(), "type": node_class, "path": path})
 
-            reads.append({"node": node_name, "type": "Read", "path": path})
+            counts[node_class] += 1
+            timings[node_class] += time.time() - node_start
 
-        # then the read geometry nodes
-        for node in nuke.allNodes("ReadGeo2"):
-            node_name = node.name()
+        self.parent.engine.log_debug(
+            "Breakdown scanned %d nodes in %.3fs: %s"
+            % (
+                sum(counts.values()),
+                time.time() - scan_start,
+                ", ".join(
+                    "%s %d (%.3fs)"
+                    % (node_class, counts[node_class], timings[node_class])
+                    for node_class in self.NODE_CLASSES
+                ),
+            )
+        )
 
-            path = node.knob("file").value().replace("/", os.path.sep)
-            reads.append({"node": node_name, "type": "ReadGeo2", "path": path})
+        return reads
 
-        # then the read camera nodes
-        for node in nuke.allNodes("Camera2"):
-            node_name = node.name()
+    def _walk_nodes(self, group):
+        """
+        Yields all nodes in the given group, descending into groups and
+        gizmos if RECURSE_GROUPS is enabled.
 
-            path = node.knob("file").value().replace("/", os.path.sep)
-            reads.append({"node": node_name, "type": "Camera2", "path": path})
+        :param group: Group node to walk, typically nuke.root()
+        """
+        for node in group.nodes():
+            yield node
+            if self.RECURSE_GROUPS and isinstance(node, nuke.Group):
+                for child in self._walk_nodes(node):
+                    yield child
 
-        return reads
+    def _normalize_path(self, path):
+        """
+        Returns the given path with platform dependent separators.
+
+        :param str path: Path as stored in the script
+        :returns: Normalized path
+        """
+        return path.replace("/", os.path.sep)
+
+    def get_current_scene_path(self):
+        """
+        Returns the path of the current scene. This is used to record which
+        scene the breakdown items were found in.
+
+        :returns: Path to the current scene file, or None if the scene has
+                  not been saved.
+        """
+        if self.parent.engine.hiero_enabled:
+            # hiero projects aren't stored in a single scene file
+            return None
+
+        path = nuke.root().name()
+        if not path or path == "Root":
+            # the script has never been saved
+            return None
+        return path.replace("/", os.path.sep)
 
     def update(self, items):
         """
@@ -108,26 +177,146 @@ class BreakdownSceneOperations(HookBaseClass):
         The items parameter is a list of dictionaries on the same form as was
         generated by the scan_scene hook above. The path key now holds
         the that each node should be updated *to* rather than the current path.
+
+        Nodes are updated as a batch within a single undo group, and clips
+        within a single undo group per project. When running with a UI, a
+        progress window is displayed which allows cancelling the update.
+        Cancelling reverts the node changes of the batch, while the clips
+        already reconnected stay updated and can be reverted with undo.
+        Nodes which no longer exist are skipped.
+
+        The app may call this method several times for a single update, with
+        slices of items, in which case each call is its own undo step.
+
+        :returns: None if all the items were processed, or the list of the
+                  items processed before the user cancelled, so that the app
+                  stops the update.
         """
         engine = self.parent.engine
 
-        node_type_list = ["Read", "ReadGeo2", "Camera2"]
+        node_items = [i for i in items if i["type"] in self.NODE_CLASSES]
+        clip_items = [i for i in items if i["type"] == "Clip"]
+        total = len(node_items) + len(clip_items)
+        if not total:
+            return
 
-        for i in items:
-            node_name = i["node"]
-            node_type = i["type"]
-            new_path = i["path"].replace(os.path.sep, "/")
+        progress = self._create_progress_task("Updating %d items" % total)
+        done = 0
+        processed = []
 
-            if node_type in node_type_list:
-                engine.log_debug(
-                    "Node %s: Updating to version %s" % (node_name, new_path)
+        try:
+            if node_items:
+                # resolve all nodes in one pass rather than one lookup per item
+                nodes_by_name = dict(
+                    (node.fullName(), node)
+                    for node in self._walk_nodes(nuke.root())
+                    if node.Class() in self.NODE_CLASSES
                 )
-                node = nuke.toNode(node_name)
-                node.knob("file").setValue(new_path)
 
-            if node_type == "Clip":
-                engine.log_debug(
-                    "Clip %s: Updating to version %s" % (node_name, new_path)
-                )
-                clip = node_name
-                clip.reconnectMedia(new_path)
+                nuke.Undo.begin("Breakdown update")
+                cancelled = False
+                try:
+                    for i in node_items:
+                        if self._is_cancelled(progress):
+                            # nothing of the batch is kept, cancelling the undo
+                            # group also closes it
+                            cancelled = True
+                            nuke.Undo.cancel()
+                            engine.log_info(
+                                "Breakdown update cancelled, the node changes "
+                                "were reverted."
+                            )
+                            return []
+
+                        node_name = i["node"]
+                        node = nodes_by_name.get(node_name) or nuke.toNode(node_name)
+                        if node is None:
+                            engine.log_warning(
+                                "Node %s not found, it was not updated." % node_name
+                            )
+                            done += 1
+                            processed.append(i)
+                            continue
+
+                        new_path = i["path"].replace(os.path.sep, "/")
+                        engine.log_debug(
+                            "Node %s: Updating to version %s" % (node_name, new_path)
+                        )
+                        node.knob("file").setValue(new_path)
+
+                        done += 1
+                        processed.append(i)
+                        self._report_progress(progress, done, total, node_name)
+                finally:
+                    if not cancelled:
+                        nuke.Undo.end()
+
+            if clip_items:
+                import hiero
+
+                projects = hiero.core.projects()
+                for project in projects:
+                    project.beginUndo("Breakdown update")
+                try:
+                    for i in clip_items:
+                        if self._is_cancelled(progress):
+                            engine.log_warning(
+                                "Breakdown update cancelled after %d of %d items. "
+                                "The clips already updated can be reverted with "
+                                "undo." % (done, total)
+                            )
+                            return processed
+
+                        clip = i["node"]
+                        new_path = i["path"].replace(os.path.sep, "/")
+                        engine.log_debug(
+                            "Clip %s: Updating to version %s" % (clip, new_path)
+                        )
+                        clip.reconnectMedia(new_path)
+
+                        done += 1
+                        processed.append(i)
+                        self._report_progress(progress, done, total, clip.name())
+                finally:
+                    for project in projects:
+                        project.endUndo()
+        finally:
+            # releasing the task closes the progress window
+            del progress
+            if nuke.GUI and not engine.hiero_enabled:
+                nuke.updateUI()
+
+    def _create_progress_task(self, message):
+        """
+        Creates a nuke progress task, if running with a nuke UI.
+
+        :param str message: Message to display
+        :returns: A nuke.ProgressTask or None
+        """
+        if not nuke.GUI or self.parent.engine.hiero_enabled:
+            return None
+        return nuke.ProgressTask(message)
+
+    def _is_cancelled(self, progress):
+        """
+        :param progress: Progress task, as returned by _create_progress_task
+        :returns: True if the user requested cancellation
+        """
+        return progress is not None and progress.isCancelled()
+
+    def _report_progress(self, progress, done, total, name):
+        """
+        Reports progress for the update. The progress task processes UI events
+        when updated, so only report at most every PROGRESS_STEP items.
+
+        :param progress: Progress task, as returned by _create_progress_task
+        :param int done: Number of items processed so far
+        :param int total: Total number of items
+        :param str name: Name of the last item processed
+        """
+        if progress is None:
+            return
+        if done % self.PROGRESS_STEP and done != total:
+            return
+        progress.setMessage(name)
+        progress.setProgress(int(100 * done / total))
@@ -8,8 +8,35 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-# Import the get_breakdown_items() method so that it can be used in the app.py.
-from .breakdown import get_breakdown_items  # noqa
+import importlib
+
+# modules exposed by the package, which are only imported when first accessed
+# so that using the API doesn't load the modules it doesn't need, e.g. the
+# cache service client or the update executor
+_SUBMODULES = (
+    "breakdown",
+    "cache_service",
+    "items",
+    "metrics",
+    "preflight",
+    "replay",
+    "single_flight",
+    "snapshot",
+    "timing",
+    "update_executor",
+    "versions",
+)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("%s.%s" % (__name__, name))
+    if name == "get_breakdown_items":
+        # used in the app.py
+        from .breakdown import get_breakdown_items
+
+        return get_breakdown_items
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 def show_dialog(app):
@@ -0,0 +1,283 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Headless breakdown of scene files.
+
+Runs the breakdown over a list of scene files without launching a DCC. Paths
+are extracted from the scene files by the scene_parsers module, matched
+against the templates, looked up as publishes and resolved to their highest
+version on disk. The scene files are processed by a pool of worker processes
+which share their publish and version caches, and one JSON object is written
+per breakdown item as soon as a scene has been processed.
+
+With tk-core and the app's python folder on the PYTHONPATH, run::
+
+    python -m tk_multi_breakdown.batch --config /path/to/config "/shows/abc/**/*.ma"
+
+Each output line looks like::
+
+    {"scene": "/shows/abc/.../lighting.v012.ma", "node": "chairRN", "type": "reference",
+     "template": "maya_asset_publish", "fields": {...}, "version": 12,
+     "latest_version": 14, "sg_data": {...}}
+
+Scenes which fail to process produce a line with a scene and an error key.
+
+The highest version is resolved with the app's default logic, as the
+hook_get_version_number hook can't be executed without an engine.
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+
+import sgtk
+from sgtk import TankError
+
+from . import breakdown
+from . import scene_parsers
+from . import versions
+from .dependency_index import DependencyIndex
+
+# toolkit instance and caches of the current worker process, set by _init_worker
+g_worker_state = {}
+
+
+def find_scene_files(patterns):
+    """
+    Expands the given list of paths and glob patterns into a list of scene
+    files. Patterns support ** to match any number of folders.
+
+    :param patterns: List of paths or glob patterns
+    :returns: Sorted list of unique scene file paths
+    """
+    scene_files = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if not matches and os.path.isfile(pattern):
+            matches = [pattern]
+        scene_files.update(os.path.abspath(m) for m in matches if os.path.isfile(m))
+    return sorted(scene_files)
+
+
+def process_scene(tk, scene_path, publish_cache, version_cache, index=None):
+    """
+    Runs the breakdown over a single scene file.
+
+    :param tk: Toolkit API instance
+    :param str scene_path: Path to the scene file
+    :param publish_cache: Dictionary like object of path -> publish data
+    :param version_cache: Dictionary like object of version family -> highest version
+    :param index: Optional DependencyIndex to store the results in
+    :returns: List of JSON serializable dictionaries, one per breakdown item
+    """
+    scene_objects = scene_parsers.scan_scene_file(scene_path)
+    items = breakdown.resolve_scene_objects(tk, scene_objects)
+    breakdown.fetch_publish_data(tk, items, publish_cache)
+    breakdown.add_publish_details(tk, items)
+
+    if index:
+        index.upsert_scene(scene_path, items)
+
+    records = []
+    for item in items:
+        family_key = versions.version_family_key(item["template"], item["fields"])
+        latest_version = version_cache.get(family_key)
+        if latest_version is None:
+            try:
+                latest_version = versions.get_highest_version(
+                    tk, item["template"], item["fields"]
+                )
+            except TankError:
+                # nothing on disk for this item
+                latest_version = -1
+            version_cache[family_key] = latest_version
+
+        sg_data = item["sg_data"]
+        records.append(
+            {
+                "scene": scene_path,
+                "node": item["node_name"],
+                "type": item["node_type"],
+                "path": item["path"],
+                "template": item["template"].name,
+                "fields": item["fields"],
+                "version": item["fields"][versions.VERSION_KEY],
+                "latest_version": latest_version if latest_version >= 0 else None,
+                "sg_data": breakdown.trim_sg_data(sg_data) if sg_data else None,
+            }
+        )
+
+    return records
+
+
+def _init_worker(
+    config_path, serialized_user, publish_cache, version_cache, index_path
+):
+    """
+    Initializes a worker process of the pool.
+
+    :param str config_path: Path to the pipeline configuration to use
+    :param str serialized_user: Serialized authenticated user, or None
+    :param publish_cache: Shared publish cache
+    :param version_cache: Shared version cache
+    :param str index_path: Path to the dependency index to update, or None
+    """
+    if serialized_user:
+        sgtk.set_authenticated_user(
+            sgtk.authentication.deserialize_user(serialized_user)
+        )
+    g_worker_state["tk"] = sgtk.sgtk_from_path(config_path)
+    g_worker_state["publish_cache"] = publish_cache
+    g_worker_state["version_cache"] = version_cache
+    g_worker_state["index"] = DependencyIndex(index_path) if index_path else None
+
+
+def _process_scene_in_worker(scene_path):
+    """
+    Processes a scene file in a worker process of the pool.
+
+    :param str scene_path: Path to the scene file
+    :returns: Tuple of the scene path, a list of records and an error
+              message, or None if the scene was processed successfully
+    """
+    try:
+        records = process_scene(
+            g_worker_state["tk"],
+            scene_path,
+            g_worker_state["publish_cache"],
+            g_worker_state["version_cache"],
+            g_worker_state["index"],
+        )
+    except Exception as e:
+        return (scene_path, [], "%s: %s" % (e.__class__.__name__, e))
+    return (scene_path, records, None)
+
+
+def run_batch(
+    config_path, scene_files, output, processes=None, user=None, index_path=None
+):
+    """
+    Runs the breakdown over the given scene files with a pool of worker
+    processes, writing one JSON line per item to the output as results
+    come in.
+
+    :param str config_path: Path to the pipeline configuration to use
+    :param scene_files: List of scene file paths
+    :param output: File like object to write the JSON lines to
+    :param int processes: Number of worker processes, defaults to the number
+                          of CPUs
+    :param user: Authenticated user to run the workers as
+    :param str index_path: Optional path to a dependency index to store the
+                           results in
+    :returns: Number of scenes which failed to process
+    """
+    serialized_user = sgtk.authentication.serialize_user(user) if user else None
+
+    manager = multiprocessing.Manager()
+    publish_cache = manager.dict()
+    version_cache = manager.dict()
+
+    failures = 0
+    pool = multiprocessing.Pool(
+        processes,
+        initializer=_init_worker,
+        initargs=(
+            config_path,
+            serialized_user,
+            publish_cache,
+            version_cache,
+            index_path,
+        ),
+    )
+    try:
+        for (scene_path, records, error) in pool.imap_unordered(
+            _process_scene_in_worker, scene_files
+        ):
+            if error:
+                failures += 1
+                records = [{"scene": scene_path, "error": error}]
+            for record in records:
+                output.write(json.dumps(record) + "\n")
+            output.flush()
+    finally:
+        pool.close()
+        pool.join()
+        manager.shutdown()
+
+    return failures
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+
+    :param argv: List of command line arguments, defaults to sys.argv
+    :returns: Process exit code
+    """
+    parser = argparse.ArgumentParser(
+        description="Runs the breakdown over scene files and writes the "
+        "results as JSON lines."
+    )
+    parser.add_argument(
+        "scenes", nargs="+", help="Scene files or glob patterns, e.g. '**/*.ma'"
+    )
+    parser.add_argument(
+        "--config",
+        help="Path to the pipeline configuration. Defaults to the "
+        "configuration of the project of the first scene file.",
+    )
+    parser.add_argument(
+        "--processes", type=int, default=None, help="Number of worker processes."
+    )
+    parser.add_argument(
+        "--output", help="File to write the results to. Defaults to stdout."
+    )
+    parser.add_argument(
+        "--index",
+        help="Path to a dependency index database to store the results in, "
+        "e.g. the one used by the app's find_dependent_scenes method.",
+    )
+    args = parser.parse_args(argv)
+
+    scene_files = find_scene_files(args.scenes)
+    if not scene_files:
+        sys.stderr.write("No scene files found.\n")
+        return 1
+
+    # authenticate once and share the session with the workers
+    user = sgtk.authentication.ShotgunAuthenticator().get_user()
+    sgtk.set_authenticated_user(user)
+
+    tk = sgtk.sgtk_from_path(args.config or scene_files[0])
+    config_path = tk.pipeline_configuration.get_path()
+
+    output = open(args.output, "wt") if args.output else sys.stdout
+    try:
+        failures = run_batch(
+            config_path,
+            scene_files,
+            output,
+            processes=args.processes,
+            user=user,
+            index_path=args.index,
+        )
+    finally:
+        if args.output:
+            output.close()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
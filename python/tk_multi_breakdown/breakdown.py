@@ -9,16 +9,58 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+import threading
+import time
+import weakref
+
 import sgtk
 
+from . import metrics
+from . import replay
+from . import single_flight
+from . import timing
+
 # cache the publish data we pull down from shotgun for performance
 g_cached_sg_publish_data = {}
 
+# cache the publish details, which are cached separately, by (type, id)
+g_cached_sg_publish_details = {}
+
+# the publish cache is read and updated from several threads
+g_cache_lock = threading.Lock()
+
+# publish lookups in flight, by path
+g_publish_lookups = single_flight.SingleFlight()
+
+# publish details lookups in flight, by (type, id)
+g_publish_details_lookups = single_flight.SingleFlight()
+
+# normalization plans, by template object
+g_normalization_plans = weakref.WeakKeyDictionary()
+
+# dependency index instances, keyed by database path
+g_dependency_indexes = {}
+
+# template cache instances, keyed by database path and configuration hash
+g_template_caches = {}
+
+# configuration hashes, by toolkit instance, along with the templates they
+# were computed for
+g_config_hashes = weakref.WeakKeyDictionary()
+
 # the template key we use to find the version number
 VERSION_KEY = "version"
 
+# publish fields which are only needed once an item is displayed or returned
+# through the API. The scene browser fetches them separately from the fields
+# needed to group the items and compute their status, see fetch_publish_details.
+PUBLISH_DETAIL_FIELDS = ["code", "image", "task", "project"]
+
+# maximum number of publishes whose details are fetched in a single query
+PUBLISH_DETAILS_BATCH_SIZE = 200
+
 
-def get_breakdown_items():
+def get_breakdown_items(scene_path=None, details=True):
     """
     Analyzes the scene (by running a hook) and returns a list of items
     in the scene which are applicable for the breakdown. These items all
@@ -27,7 +69,8 @@ def get_breakdown_items():
     The file paths detected are also checked against shotgun, and in the case
     a match is found in shotgun (in the form of a publish record), metadata for
     this shotgun object is downloaded and returned. This method will send a single
-    query to shotgun to retrieve this.
+    query to shotgun to retrieve the publishes, and a second one to retrieve their
+    details (code, image, task and project) unless details is False.
 
     A list of dictionaries are returned. Each dictionary will have the following keys:
 
@@ -70,111 +113,699 @@ def get_breakdown_items():
                  'version_number': 1},
      'template': <Sgtk TemplatePath nuke_shot_render_pub_mono_dpx>}
 
+    :param str scene_path: Optional path to a scene file to analyze instead of
+                           the current scene. The file is parsed offline by the
+                           scene_parsers module, without running the hook.
+    :param bool details: If False, the sg_data of the items only holds the fields
+                         needed to group them and compute their status, i.e. it
+                         lacks the PUBLISH_DETAIL_FIELDS, which can be fetched
+                         later on with fetch_publish_details.
     :returns: See details above.
     """
-    global g_cached_sg_publish_data
-    items = []
+    app = sgtk.platform.current_bundle()
+    timing.configure(app)
+    replay.configure(app)
+    metrics.start_exporter(app)
+
+    start = time.time()
+
+    with timing.span("scan") as s:
+        if scene_path:
+            # imported here, only the batch breakdowns parse scene files
+            from . import scene_parsers
+
+            scene_objects = list(scene_parsers.scan_scene_file(scene_path))
+        else:
+            scene_objects = _scan_current_scene(app)
+        s.set(objects=len(scene_objects))
+
+    with timing.span("match_templates", objects=len(scene_objects)) as s:
+        items = resolve_scene_objects(
+            app.sgtk, scene_objects, template_cache=get_template_cache(app)
+        )
+        s.set(items=len(items))
+
+    # now do a second pass on all the files that are valid to see if they are published
+    (publish_cache, details_cache) = get_publish_caches()
+    # only counts the queries of this breakdown, not the ones of the breakdowns
+    # running in other threads
+    with metrics.count_sg_queries() as sg_queries:
+        with timing.span("find_publish", items=len(items)):
+            fetch_publish_data(
+                app.sgtk,
+                items,
+                publish_cache,
+                service=get_cache_client(app),
+                details=details,
+                details_cache=details_cache,
+            )
+            if details:
+                # only queries the details of the publishes found in the caches
+                add_publish_details(app.sgtk, items, cache=details_cache)
+
+    # record which scene uses what if enabled
+    if app.get_setting("dependency_index"):
+        with timing.span("dependency_index"):
+            _update_dependency_index(app, scene_path, items)
+
+    # we no longer need the path key in the dict, so get rid of it
+    for item in items:
+        del item["path"]
+
+    metrics.scans.inc()
+    metrics.scan_items.inc(len(items))
+    metrics.scan_items_per_second.set(len(items) / max(time.time() - start, 1e-6))
+    metrics.sg_queries_per_breakdown.observe(sg_queries.value)
+
+    timing.flush(app)
+    replay.flush(app)
+
+    return items
+
 
+def _scan_current_scene(app):
+    """
+    Runs the scan_scene method of the scene operations hook.
+
+    :param app: The breakdown app
+    :returns: List of dictionaries with node, type and path keys
+    """
     # perform the scene scanning in the main UI thread - a lot of apps are sensitive to these
     # types of operations happening in other threads.
-    app = sgtk.platform.current_bundle()
-    scene_objects = app.engine.execute_in_main_thread(
-        app.execute_hook_method, "hook_scene_operations", "scan_scene"
-    )
     # returns a list of dictionaries, each dict being like this:
     # {"node": node_name, "type": "reference", "path": maya_path}
+    return replay.call(
+        replay.SCAN,
+        None,
+        lambda: app.engine.execute_in_main_thread(
+            app.execute_hook_method, "hook_scene_operations", "scan_scene"
+        ),
+    )
+
+
+def get_dependency_index(app):
+    """
+    Returns the dependency index of the given app, as configured by the
+    dependency_index_path setting.
+
+    :param app: The breakdown app
+    :returns: A DependencyIndex instance
+    """
+    db_path = app.get_setting("dependency_index_path") or os.path.join(
+        app.cache_location, "dependency_index.db"
+    )
+    if db_path not in g_dependency_indexes:
+        # imported here to keep sqlite out of the sessions not using the index
+        from .dependency_index import DependencyIndex
+
+        g_dependency_indexes[db_path] = DependencyIndex(db_path)
+    return g_dependency_indexes[db_path]
+
+
+def get_cache_client(app):
+    """
+    Returns a client of the local cache service, see cache_service.get_client.
+
+    :param app: The breakdown app
+    :returns: A CacheClient, or None if the service is disabled or unavailable,
+              or while capturing or replaying the inputs of the breakdown
+    """
+    if not app.get_setting("cache_service"):
+        return None
+    if replay.is_capturing() or replay.is_replaying():
+        return None
+
+    # imported here to keep sockets out of the sessions not using the service
+    from . import cache_service
 
-    for scene_object in scene_objects:
+    return cache_service.get_client(app)
 
-        node_name = scene_object.get("node")
-        node_type = scene_object.get("type")
-        file_name = scene_object.get("path").replace("/", os.path.sep)
 
-        # see if this read node matches any path in the templates setup
-        matching_template = app.sgtk.template_from_path(file_name)
+def get_publish_caches():
+    """
+    Returns the caches of publish data and of publish details shared by the
+    breakdowns of this process. While capturing, new empty caches are returned
+    instead, so that all the publish lookups go through the capture.
+
+    :returns: Tuple of the path -> publish data and (type, id) -> details
+              dictionaries
+    """
+    if replay.is_capturing():
+        return ({}, {})
+    return (g_cached_sg_publish_data, g_cached_sg_publish_details)
+
+
+def get_template_cache(app):
+    """
+    Returns the template cache of the given app, as configured by the
+    template_cache and template_cache_path settings, for the current
+    templates of the app.
+
+    :param app: The breakdown app
+    :returns: A TemplateCache instance, or None if the cache is disabled or
+              can't be opened, or while replaying a capture
+    """
+    if not app.get_setting("template_cache") or replay.is_replaying():
+        return None
+
+    # imported here to keep sqlite out of the sessions not using the cache
+    from .template_cache import TemplateCache, get_config_hash
+
+    db_path = app.get_setting("template_cache_path") or os.path.join(
+        app.cache_location, "template_cache.db"
+    )
+    tk = app.sgtk
+    (templates, config_hash) = g_config_hashes.get(tk, (None, None))
+    if templates is not tk.templates:
+        # hashing every template is only worth doing once, or again after
+        # the templates are reloaded
+        config_hash = get_config_hash(tk)
+        g_config_hashes[tk] = (tk.templates, config_hash)
+
+    key = (db_path, config_hash)
+    if key not in g_template_caches:
+        try:
+            g_template_caches[key] = TemplateCache(*key)
+        except Exception as e:
+            app.log_warning("Failed to open the breakdown template cache: %s" % e)
+            return None
+    return g_template_caches[key]
+
+
+def get_current_scene_path(app):
+    """
+    Returns the path of the current scene, as returned by the
+    get_current_scene_path method of the scene operations hook, which is run
+    in the main thread.
+
+    :param app: The breakdown app
+    :returns: Path of the current scene, or None if the scene is unsaved or
+              the hook doesn't implement the method
+    """
+    try:
+        return app.engine.execute_in_main_thread(
+            app.execute_hook_method, "hook_scene_operations", "get_current_scene_path"
+        )
+    except (AttributeError, sgtk.TankError) as e:
+        # hooks overridden before the method was added don't implement it
+        app.log_debug("Failed to get the path of the current scene: %s" % e)
+        return None
+
+
+def _update_dependency_index(app, scene_path, items):
+    """
+    Stores the given items in the dependency index for the given scene, or
+    the current scene if no scene path is given.
+
+    :param app: The breakdown app
+    :param str scene_path: Path of the scene the items were found in, or None
+    :param items: Breakdown items
+    """
+    # the index is informative only, don't fail the breakdown for it
+    try:
+        if not scene_path:
+            scene_path = get_current_scene_path(app)
+            if not scene_path:
+                # unsaved scene, nothing to index it by
+                return
+
+        get_dependency_index(app).upsert_scene(scene_path, items)
+    except Exception as e:
+        app.log_warning("Failed to update the breakdown dependency index: %s" % e)
+
+
+def resolve_scene_objects(tk, scene_objects, template_cache=None):
+    """
+    Matches the given scene objects against the templates of the given
+    toolkit instance and returns an item for each object that matches a
+    template with a version field.
+
+    This is the template matching part of get_breakdown_items and does
+    not need a running engine, so it can be used with scene objects coming
+    from other sources than the scene operations hook.
+
+    :param tk: Toolkit API instance to match the paths with
+    :param scene_objects: Iterable of dictionaries with node, type and path keys,
+                          as returned by the scan_scene method of the hook
+    :param template_cache: Optional TemplateCache holding the templates matched
+                           by previous sessions, see get_template_cache
+    :returns: List of items on the same form as get_breakdown_items, with
+              an extra path key holding the normalized path of the item
+    """
+    scene_objects = [
+        (o.get("node"), o.get("type"), o.get("path").replace("/", os.path.sep))
+        for o in scene_objects
+    ]
+    matches = _match_templates(
+        tk, list(dict.fromkeys(o[2] for o in scene_objects)), template_cache
+    )
+
+    items = []
+
+    for (node_name, node_type, file_name) in scene_objects:
+
+        # see if this read node matches any path in the templates setup,
+        # with a version number
+        (matching_template, fields) = matches[file_name]
 
         if matching_template:
 
-            # see if we have a version number
-            fields = matching_template.get_fields(file_name)
-            if VERSION_KEY in fields:
+            # now the fields are the raw breakdown of the path in the read node.
+            # could be bla.left.0002.exr, bla.%V.####.exr etc
+            # normalize them and build the normalized path that we can use to
+            # find corresponding Shotgun published files
+            fields = dict(fields)
+            plan = get_normalization_plan(matching_template)
+            normalized_path = plan.normalize(fields)
+
+            item = {}
+            item["path"] = normalized_path
+            item["node_name"] = node_name
+            item["node_type"] = node_type
+            item["template"] = matching_template
+            item["fields"] = fields
+            item["sg_data"] = None
+
+            # store the normalized fields in dict
+            items.append(item)
 
-                # now the fields are the raw breakdown of the path in the read node.
-                # could be bla.left.0002.exr, bla.%V.####.exr etc
+    return items
 
-                # remove all abstract fields from keys so that the default value will get used
-                # when building a path from the template.  This is consistent with the utility
-                # method 'register_publish'
-                for key_name, key in matching_template.keys.items():
-                    if key_name in fields and key.is_abstract:
-                        del fields[key_name]
 
-                # we also want to normalize the eye field (this should probably be an abstract field!)
-                # note: we need to do this explicitly because the eye isn't abstract in the default
-                # configs yet (which is incorrect!).
-                fields["eye"] = "%V"
+class NormalizationPlan(object):
+    """
+    Normalizes the fields of the items matching a template and builds their
+    normalized path. Everything which only depends on the template is
+    computed once, and the normalized paths are memoized by fields.
+    """
 
-                # now build the normalized path that we can use to find corresponding Shotgun published files
-                normalized_path = matching_template.apply_fields(fields)
+    # maximum number of normalized paths memoized per template
+    MAX_MEMOIZED_PATHS = 100000
+
+    def __init__(self, template):
+        """
+        :param template: Template object the plan is for
+        """
+        self._template = template
+
+        # abstract keys are removed from the fields so that the default value
+        # will get used when building a path from the template. This is
+        # consistent with the utility method 'register_publish'
+        self.abstract_keys = frozenset(
+            key_name for (key_name, key) in template.keys.items() if key.is_abstract
+        )
+
+        # normalized paths, by sorted tuple of normalized fields
+        self._paths = {}
+
+    def normalize(self, fields):
+        """
+        Normalizes the given fields in place and returns the normalized path.
+
+        :param dict fields: Fields extracted from a path matching the template
+        :returns: The normalized path
+        """
+        for key_name in self.abstract_keys:
+            fields.pop(key_name, None)
+
+        # we also want to normalize the eye field (this should probably be an abstract field!)
+        # note: we need to do this explicitly because the eye isn't abstract in the default
+        # configs yet (which is incorrect!).
+        fields["eye"] = "%V"
+
+        try:
+            fields_key = tuple(sorted(fields.items()))
+            path = self._paths.get(fields_key)
+        except TypeError:
+            # unhashable or unorderable field values, don't memoize
+            return self._template.apply_fields(fields)
+
+        if path is None:
+            path = self._template.apply_fields(fields)
+            if len(self._paths) >= self.MAX_MEMOIZED_PATHS:
+                self._paths.clear()
+            self._paths[fields_key] = path
+        return path
+
+
+def _match_templates(tk, paths, template_cache=None):
+    """
+    Matches the given paths against the templates, looking them up in the
+    template cache first if any, and storing the paths matched in it.
+
+    :param tk: Toolkit API instance to match the paths with
+    :param paths: List of unique paths
+    :param template_cache: Optional TemplateCache
+    :returns: Dictionary of path -> (template object, fields). Paths matching
+              no template with a version field have a None template and fields.
+    """
+    matches = {}
+    if template_cache:
+        with timing.span("template_cache", paths=len(paths)) as s:
+            try:
+                cached = template_cache.get_many(paths)
+            except Exception:
+                # the cache is only an optimization, match the paths instead
+                cached = {}
+            for (path, (template_name, fields)) in cached.items():
+                template = tk.templates.get(template_name) if template_name else None
+                if template_name and template is None:
+                    continue
+                matches[path] = (template, fields)
+            s.set(found=len(matches))
+
+    new_matches = {}
+    for path in paths:
+        if path in matches:
+            continue
+        template = tk.template_from_path(path)
+        fields = template.get_fields(path) if template else None
+        if fields is None or VERSION_KEY not in fields:
+            (template, fields) = (None, None)
+        matches[path] = (template, fields)
+        new_matches[path] = (template.name if template else None, fields)
+
+    if template_cache and new_matches:
+        try:
+            template_cache.put_many(new_matches)
+        except Exception:
+            # e.g. a read only cache location, the paths will be matched again
+            pass
+
+    return matches
+
+
+def get_normalization_plan(template):
+    """
+    Returns the normalization plan of the given template, which is compiled
+    on first use and kept for as long as the template exists, i.e. once per
+    configuration.
 
-                item = {}
-                item["path"] = normalized_path
-                item["node_name"] = node_name
-                item["node_type"] = node_type
-                item["template"] = matching_template
-                item["fields"] = fields
-                item["sg_data"] = None
+    :param template: Template object
+    :returns: A NormalizationPlan
+    """
+    plan = g_normalization_plans.get(template)
+    if plan is None:
+        # threads compiling the same plan at once just build equivalent plans
+        plan = NormalizationPlan(template)
+        g_normalization_plans[template] = plan
+    return plan
 
-                # store the normalized fields in dict
-                items.append(item)
 
-    # now do a second pass on all the files that are valid to see if they are published
+def fetch_publish_data(
+    tk, items, cache, service=None, details=False, details_cache=None
+):
+    """
+    Looks up the publishes for the paths of the given items and stores the
+    publish data in the sg_data key of each item. A single query is sent to
+    Shotgun for all paths not found in the cache, nor in the cache service.
+
+    :param tk: Toolkit API instance to query publishes with
+    :param items: Items as returned by resolve_scene_objects
+    :param cache: Dictionary like object of path -> publish data, used to
+                  look up paths and updated with the data fetched
+    :param service: Optional cache_service.CacheClient sharing the publish
+                    data with the other processes of the workstation
+    :param bool details: If True, the PUBLISH_DETAIL_FIELDS of the publishes
+                         queried are fetched in the same query and stored in
+                         the details cache, so that add_publish_details
+                         doesn't query them again. The sg_data of the items
+                         still only holds the fields needed for their status.
+    :param details_cache: Dictionary like object of (type, id) -> details the
+                          details are stored in, defaults to the cache shared
+                          by all the breakdowns of this process
+    """
     # note that we store (by convention) all things on a normalized sequence form in PTR, e.g
     # all four-padded sequences are stored as '%04d' regardless if they have been published from
     # houdini, maya, nuke etc.
-    valid_paths = [x.get("path") for x in items]
+    items_by_path = {}
+    for item in items:
+        items_by_path.setdefault(item["path"], []).append(item)
 
     # check if we have the path in the cache
     paths_to_fetch = []
-    for p in valid_paths:
-        if p not in g_cached_sg_publish_data:
-            paths_to_fetch.append(p)
-        else:
-            # use cache data!
-            for item in items:
-                if item.get("path") == p:
-                    item["sg_data"] = g_cached_sg_publish_data[p]
+    with g_cache_lock:
+        for p in items_by_path:
+            sg_chunk = cache.get(p)
+            if sg_chunk is None:
+                paths_to_fetch.append(p)
+            else:
+                # use cache data!
+                for item in items_by_path[p]:
+                    item["sg_data"] = sg_chunk
+
+    metrics.publish_cache_hits.inc(len(items_by_path) - len(paths_to_fetch))
+    metrics.publish_cache_misses.inc(len(paths_to_fetch))
+
+    if not paths_to_fetch:
+        return
+
+    # then if another process of the workstation looked them up already
+    if service:
+        with timing.span("cache_service", paths=len(paths_to_fetch)) as s:
+            sg_data = service.get_many(_get_publish_namespace(tk), paths_to_fetch)
+            s.set(found=len(sg_data))
+        with g_cache_lock:
+            for (path, sg_chunk) in sg_data.items():
+                cache[path] = sg_chunk
+                for item in items_by_path[path]:
+                    item["sg_data"] = sg_chunk
+        paths_to_fetch = [p for p in paths_to_fetch if p not in sg_data]
+        if not paths_to_fetch:
+            return
+
+    # paths already being looked up by another thread are waited for
+    # rather than queried again
+    sg_data = g_publish_lookups.do_batch(
+        paths_to_fetch,
+        lambda paths: _find_publishes(
+            tk, paths, cache, service, details, details_cache
+        ),
+    )
+
+    # append the sg data to the right path
+    for (path, sg_chunk) in sg_data.items():
+        for item in items_by_path.get(path, []):
+            item["sg_data"] = sg_chunk
 
+
+def _find_publishes(tk, paths, cache, service=None, details=False, details_cache=None):
+    """
+    Queries Shotgun for the publishes of the given paths and stores them
+    in the cache, and in the cache service if any.
+
+    :param tk: Toolkit API instance to query publishes with
+    :param paths: List of normalized paths
+    :param cache: Dictionary like object of path -> publish data to update
+    :param service: Optional cache_service.CacheClient to share the data with
+    :param bool details: If True, also query the PUBLISH_DETAIL_FIELDS and
+                         store them in the details cache
+    :param details_cache: Dictionary like object of (type, id) -> details to
+                          update, defaults to the shared details cache
+    :returns: Dictionary of path -> publish data for the paths found, without
+              the details
+    """
+    with timing.span("find_publish_query", paths=len(paths)) as s:
+        sg_data = replay.call(
+            replay.FIND_PUBLISH,
+            paths,
+            lambda: sgtk.util.find_publish(
+                tk, paths, fields=get_publish_fields(tk, details=details)
+            ),
+        )
+        s.set(found=len(sg_data))
+    metrics.inc_sg_queries()
+
+    sg_details = {}
+    if details:
+        # split the details off, so that the publish data is the same whether
+        # the details were requested or not. replayed publishes captured
+        # without their details lack them, which are then looked up later on
+        for (path, sg_chunk) in list(sg_data.items()):
+            sg_chunk = dict(sg_chunk)
+            chunk_details = dict(
+                (field, sg_chunk.pop(field))
+                for field in PUBLISH_DETAIL_FIELDS
+                if field in sg_chunk
+            )
+            if len(chunk_details) == len(PUBLISH_DETAIL_FIELDS):
+                sg_details[(sg_chunk["type"], sg_chunk["id"])] = chunk_details
+            sg_data[path] = sg_chunk
+
+    # cache the items before the lookup is marked as done, so that callers
+    # arriving afterwards find them in the cache
+    with g_cache_lock:
+        for (path, sg_chunk) in sg_data.items():
+            cache[path] = sg_chunk
+        metrics.publish_cache_size.set(len(cache))
+        if details_cache is None:
+            details_cache = g_cached_sg_publish_details
+        details_cache.update(sg_details)
+
+    if service and sg_data:
+        from . import cache_service
+
+        service.put_many(
+            _get_publish_namespace(tk), sg_data, ttl=cache_service.PUBLISH_TTL
+        )
+
+    return sg_data
+
+
+def _get_publish_namespace(tk):
+    """
+    :returns: Namespace of the publish data of the site in the cache service
+    """
+    return "publishes:%s" % tk.shotgun_url
+
+
+def add_publish_details(tk, items, cache=None):
+    """
+    Completes the publish data of the given items with their details. The
+    items of a same publish are given the same dictionary, and the publish
+    data previously stored on the items is left untouched.
+
+    :param tk: Toolkit API instance to query publishes with
+    :param items: Items with a sg_data key, as returned by fetch_publish_data
+    :param cache: Dictionary like object of (type, id) -> details, see
+                  fetch_publish_details
+    """
+    complete_sg_data = {}
+    sg_data_list = [item["sg_data"] for item in items if item["sg_data"]]
+    details = fetch_publish_details(tk, sg_data_list, cache=cache)
+
+    for item in items:
+        sg_data = item["sg_data"]
+        if not sg_data:
+            continue
+        key = (sg_data["type"], sg_data["id"])
+        if key not in complete_sg_data:
+            # publishes deleted since they were looked up have no details
+            complete_sg_data[key] = dict(sg_data)
+            complete_sg_data[key].update(
+                details.get(key) or dict.fromkeys(PUBLISH_DETAIL_FIELDS)
+            )
+        item["sg_data"] = complete_sg_data[key]
+
+
+def fetch_publish_details(tk, sg_data_list, cache=None):
+    """
+    Fetches the PUBLISH_DETAIL_FIELDS of the given publishes. The details are
+    cached separately from the publish data, and queried in batches of
+    PUBLISH_DETAILS_BATCH_SIZE publishes for the ones not in the cache.
+
+    :param tk: Toolkit API instance to query publishes with
+    :param sg_data_list: List of publish data dictionaries, with type and id keys
+    :param cache: Dictionary like object of (type, id) -> details, defaults to
+                  the cache shared by all the breakdowns of this process, see
+                  get_publish_caches
+    :returns: Dictionary of (type, id) -> dictionary of details
+    """
+    if cache is None:
+        cache = get_publish_caches()[1]
+
+    details = {}
+    keys_to_fetch = []
+    with g_cache_lock:
+        for sg_data in sg_data_list:
+            key = (sg_data["type"], sg_data["id"])
+            if key in details:
+                continue
+            cached = cache.get(key)
+            if cached is None:
+                if key not in keys_to_fetch:
+                    keys_to_fetch.append(key)
+            else:
+                details[key] = cached
+
+    if keys_to_fetch:
+        details.update(
+            g_publish_details_lookups.do_batch(
+                keys_to_fetch, lambda keys: _find_publish_details(tk, keys, cache)
+            )
+        )
+    return details
+
+
+def _find_publish_details(tk, keys, cache):
+    """
+    Queries Shotgun for the details of the given publishes and stores them
+    in the cache.
+
+    :param tk: Toolkit API instance to query publishes with
+    :param keys: List of (type, id) tuples
+    :param cache: Dictionary like object of (type, id) -> details to update
+    :returns: Dictionary of (type, id) -> details for the publishes found
+    """
+    ids_by_type = {}
+    for (entity_type, entity_id) in keys:
+        ids_by_type.setdefault(entity_type, []).append(entity_id)
+
+    details = {}
+    for (entity_type, ids) in ids_by_type.items():
+        for i in range(0, len(ids), PUBLISH_DETAILS_BATCH_SIZE):
+            chunk = ids[i : i + PUBLISH_DETAILS_BATCH_SIZE]
+            with timing.span("find_publish_details_query", publishes=len(chunk)):
+                sg_publishes = replay.call(
+                    replay.FIND_PUBLISH_DETAILS,
+                    [entity_type, chunk],
+                    lambda: tk.shotgun.find(
+                        entity_type, [["id", "in", chunk]], PUBLISH_DETAIL_FIELDS
+                    ),
+                )
+            metrics.inc_sg_queries()
+            for sg_publish in sg_publishes:
+                details[(entity_type, sg_publish["id"])] = dict(
+                    (field, sg_publish.get(field)) for field in PUBLISH_DETAIL_FIELDS
+                )
+
+    with g_cache_lock:
+        cache.update(details)
+
+    return details
+
+
+def get_publish_fields(tk, details=True):
+    """
+    :param tk: Toolkit API instance
+    :param bool details: If False, leave out the PUBLISH_DETAIL_FIELDS
+    :returns: List of publish fields the breakdown queries from Shotgun
+    """
+    # fields needed to group the items and compute their status
     fields = [
         "entity",
         "entity.Asset.sg_asset_type",  # grab asset type if it is an asset
-        "code",
-        "image",
         "name",
-        "task",
         "version_number",
-        "project",
     ]
 
-    if sgtk.util.get_published_file_entity_type(app.sgtk) == "PublishedFile":
+    if sgtk.util.get_published_file_entity_type(tk) == "PublishedFile":
         fields.append("published_file_type")
     else:  # == "TankPublishedFile"
         fields.append("tank_type")
 
-    sg_data = sgtk.util.find_publish(app.sgtk, paths_to_fetch, fields=fields)
+    if details:
+        fields.extend(PUBLISH_DETAIL_FIELDS)
 
-    # process and cache shotgun items
-    for (path, sg_chunk) in sg_data.items():
-        # cache item
-        g_cached_sg_publish_data[path] = sg_chunk
+    return fields
 
-        # append the sg data to the right path
-        for item in items:
-            if item.get("path") == path:
-                item["sg_data"] = sg_chunk
 
-    # we no longer need the path key in the dict, so get rid of it
-    for item in items:
-        del item["path"]
+def trim_sg_data(sg_data):
+    """
+    Trims the publish data returned by get_breakdown_items down to the
+    basic listing returned by the app's analyze_scene method.
 
-    return items
+    :param dict sg_data: Publish data as stored on a breakdown item
+    :returns: Trimmed publish data dictionary
+    """
+    new_sg_data = {}
+    new_sg_data["id"] = sg_data["id"]
+    new_sg_data["type"] = sg_data["type"]
+    new_sg_data["code"] = sg_data["code"]
+    new_sg_data["task"] = sg_data["task"]
+    new_sg_data["name"] = sg_data["name"]
+    new_sg_data["entity"] = sg_data["entity"]
+    new_sg_data["project"] = sg_data["project"]
+    new_sg_data["version_number"] = sg_data["version_number"]
+    new_sg_data["published_file_type"] = sg_data["published_file_type"]
+    return new_sg_data
@@ -9,11 +9,15 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 
+import time
+
 import sgtk
 from sgtk.platform.qt import QtGui
 
 browser_widget = sgtk.platform.import_framework("tk-framework-widget", "browser_widget")
 
+from . import metrics
+from . import timing
 from .ui.item import Ui_Item
 
 
@@ -93,6 +97,7 @@ class BreakdownListItem(browser_widget.ListItem):
         """
         # set up the payload
         output = {}
+        start = time.time()
 
         # First, calculate the thumbnail
         # see if we can download a thumbnail
@@ -103,12 +108,18 @@ class BreakdownListItem(browser_widget.ListItem):
         # entity.Sequence.image
         if self._sg_data:
 
+            # the publish details, e.g. the thumbnail, are fetched on demand
+            if "image" not in self._sg_data:
+                self._sg_data = self._browser.get_publish_details(self._sg_data)
+
             thumb_url = self._sg_data.get("image")
 
             if thumb_url is not None:
                 # input is a dict with a url key
                 # returns a dict with a  thumb_path key
-                ret = self._download_thumbnail({"url": thumb_url})
+                with timing.span("thumbnail"):
+                    ret = self._download_thumbnail({"url": thumb_url})
+                metrics.thumbnail_downloads.inc()
                 if ret:
                     output["thumbnail"] = ret.get("thumb_path")
                 else:
@@ -118,9 +129,12 @@ class BreakdownListItem(browser_widget.ListItem):
 
         # first, get the latest available version for this item
         app = sgtk.platform.current_bundle()
-        latest_version = app.execute_hook(
-            "hook_get_version_number", template=self._template, curr_fields=self._fields
-        )
+        with timing.span("version_lookup", template=self._template.name):
+            latest_version = app.execute_hook(
+                "hook_get_version_number",
+                template=self._template,
+                curr_fields=self._fields,
+            )
 
         current_version = self._fields["version"]
         output["up_to_date"] = latest_version == current_version
@@ -128,6 +142,8 @@ class BreakdownListItem(browser_widget.ListItem):
         self._latest_version = latest_version
         self._is_latest = output["up_to_date"]
 
+        metrics.status_seconds.observe(time.time() - start)
+
         return output
 
     def _on_worker_failure(self, uid, msg):
@@ -0,0 +1,680 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Workstation local cache service shared by the breakdowns of all DCC processes.
+
+The service holds the publish data and highest versions resolved by any of
+the breakdowns running on the workstation, in an in-memory LRU cache which is
+saved to disk at regular intervals and reloaded on start. It listens on a
+Unix socket and serves each client connection from its own thread. The
+clients still do the Shotgun queries and disk scans themselves, the service
+only shares their results.
+
+Requests and responses are JSON objects, one per line::
+
+    {"op": "get", "namespace": "publishes:https://abc.shotgunstudio.com", "keys": [...]}
+    {"values": {"/shows/abc/.../foo.v003.ma": {...}}}
+
+    {"op": "put", "namespace": "...", "values": {...}, "ttl": 3600}
+    {"ok": true}
+
+The service is started on demand by the first client which can't connect to
+it, and stops by itself after being idle for a while. Clients fall back to
+resolving everything in-process whenever the service isn't available.
+
+This module only depends on the standard library so that the service can be
+started with any python interpreter::
+
+    python cache_service.py --socket /run/user/1000/tk-multi-breakdown/cache_service.sock
+
+The socket lives in a folder only readable by the user, and clients check
+that the socket and the process listening on it belong to the user, so that
+another user can't serve them forged publish data.
+"""
+
+import argparse
+import collections
+import getpass
+import json
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows, where the service isn't supported anyway
+    fcntl = None
+
+# maximum number of entries kept by the service
+DEFAULT_MAX_ENTRIES = 200000
+
+# number of seconds between two saves of the cache to disk
+DEFAULT_SAVE_INTERVAL = 60
+
+# number of seconds without requests after which the service stops
+DEFAULT_IDLE_TIMEOUT = 4 * 3600
+
+# number of seconds the publish data of a path is shared for
+PUBLISH_TTL = 3600
+
+# number of seconds the highest version of a version family is shared for,
+# short since new versions are published all the time
+VERSION_TTL = 60
+
+# number of seconds a client waits for the service to answer
+CLIENT_TIMEOUT = 2.0
+
+# number of seconds a client waits before trying to reach the service again
+# after failing to
+CLIENT_RETRY_DELAY = 60
+
+# number of seconds a client waits for a service it started to be available
+AUTOSTART_TIMEOUT = 5.0
+
+# clients, by socket path, see get_client
+g_clients = {}
+g_clients_lock = threading.Lock()
+
+
+def is_supported():
+    """
+    :returns: True if the cache service can be used on this platform
+    """
+    return hasattr(socket, "AF_UNIX") and fcntl is not None
+
+
+# maximum length of the path of a Unix socket, 108 bytes on Linux and 104 on
+# macOS, including the terminating null byte
+MAX_SOCKET_PATH_LENGTH = 100
+
+
+def get_default_socket_path(cache_location=None):
+    """
+    Returns the path of the socket of the current user's service, in a folder
+    only the user can access: $XDG_RUNTIME_DIR/tk-multi-breakdown if set, else
+    a folder of the given cache location, else a per user folder in the
+    temporary folder. Folders whose socket paths would be too long are skipped.
+
+    :param str cache_location: Optional cache location of the app
+    :returns: Path of the socket
+    :raises RuntimeError: If the folder exists but is owned by another user
+    """
+    folders = []
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        folders.append(
+            os.path.join(os.environ["XDG_RUNTIME_DIR"], "tk-multi-breakdown")
+        )
+    if cache_location:
+        folders.append(os.path.join(cache_location, "cache_service"))
+    folders.append(
+        os.path.join(tempfile.gettempdir(), "tk-multi-breakdown-%s" % getpass.getuser())
+    )
+
+    for folder in folders:
+        socket_path = os.path.join(folder, "cache_service.sock")
+        if len(socket_path) <= MAX_SOCKET_PATH_LENGTH:
+            break
+    _make_private_folder(folder)
+    return socket_path
+
+
+def _make_private_folder(folder):
+    """
+    Creates the given folder, only accessible to the current user, or makes
+    sure it is if it exists already.
+
+    :raises RuntimeError: If the folder is owned by another user
+    """
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder, 0o700)
+        except OSError:
+            # created by another process in the meantime
+            if not os.path.isdir(folder):
+                raise
+    stat = os.stat(folder)
+    if stat.st_uid != os.getuid():
+        raise RuntimeError("%s is owned by another user." % folder)
+    if stat.st_mode & 0o077:
+        os.chmod(folder, 0o700)
+
+
+def check_owner(socket_path, connection=None):
+    """
+    Checks that the given socket, and the process listening on it if a
+    connection is given and the platform supports it, belong to the current
+    user.
+
+    :param str socket_path: Path of the socket
+    :param connection: Optional socket connected to the socket path
+    :raises IOError: If the socket or its process belong to another user
+    """
+    if os.stat(socket_path).st_uid != os.getuid():
+        raise IOError("%s is owned by another user." % socket_path)
+
+    if connection is not None and hasattr(socket, "SO_PEERCRED"):
+        # struct ucred, with the pid, uid and gid of the peer
+        credentials = connection.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        (_, uid, _) = struct.unpack("3i", credentials)
+        if uid != os.getuid():
+            raise IOError("%s is served by another user." % socket_path)
+
+
+class LRUCache(object):
+    """
+    Thread safe least recently used cache of JSON serializable values, with
+    a time to live per entry. Entries are keyed by (namespace, key).
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # (namespace, key) -> (value, expiry time or None)
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, namespace, keys):
+        """
+        :returns: Dictionary of key -> value for the keys found
+        """
+        now = time.time()
+        values = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get((namespace, key))
+                if entry is None:
+                    self.misses += 1
+                    continue
+                (value, expiry) = entry
+                if expiry is not None and expiry < now:
+                    del self._entries[(namespace, key)]
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end((namespace, key))
+                values[key] = value
+                self.hits += 1
+        return values
+
+    def put_many(self, namespace, values, ttl=None):
+        """
+        :param str namespace: Namespace of the keys
+        :param dict values: Dictionary of key -> value to store
+        :param float ttl: Number of seconds the values are kept for, or None
+                          to keep them until evicted
+        """
+        expiry = time.time() + ttl if ttl else None
+        with self._lock:
+            for (key, value) in values.items():
+                self._entries[(namespace, key)] = (value, expiry)
+                self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self, path):
+        """
+        Saves the entries which haven't expired to a JSON file.
+        """
+        now = time.time()
+        with self._lock:
+            entries = [
+                [namespace, key, value, expiry]
+                for ((namespace, key), (value, expiry)) in self._entries.items()
+                if expiry is None or expiry >= now
+            ]
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "wt") as fh:
+            json.dump(entries, fh)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Loads the entries saved to a JSON file, skipping the expired ones.
+        """
+        with open(path, "rt") as fh:
+            entries = json.load(fh)
+
+        now = time.time()
+        with self._lock:
+            for (namespace, key, value, expiry) in entries:
+                if expiry is None or expiry >= now:
+                    self._entries[(namespace, key)] = (value, expiry)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Serves the requests of a client connection, one JSON object per line.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                response = {"error": "%s: %s" % (e.__class__.__name__, e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    _UnixStreamServer = socketserver.UnixStreamServer
+else:
+    _UnixStreamServer = socketserver.TCPServer
+
+
+class CacheServer(socketserver.ThreadingMixIn, _UnixStreamServer):
+    """
+    Cache service listening on a Unix socket, serving each connection from
+    its own thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path,
+        persist_path=None,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        save_interval=DEFAULT_SAVE_INTERVAL,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+    ):
+        """
+        :param str socket_path: Path of the socket to listen on. A stale socket
+                                file left by a previous service is removed.
+        :param str persist_path: Optional path of the JSON file the cache is
+                                 saved to and loaded from
+        :param int max_entries: Maximum number of entries kept in memory
+        :param float save_interval: Number of seconds between two saves
+        :param float idle_timeout: Number of seconds without requests after
+                                   which the service stops, or None
+        """
+        self.socket_path = socket_path
+        self.persist_path = persist_path
+        self.cache = LRUCache(max_entries)
+        self._save_interval = save_interval
+        self._idle_timeout = idle_timeout
+        self._last_request = time.time()
+        self._stop_event = threading.Event()
+
+        if persist_path and os.path.exists(persist_path):
+            try:
+                self.cache.load(persist_path)
+            except Exception:
+                # a corrupted cache is just discarded
+                pass
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # the socket is only accessible to the user, whatever the umask
+        umask = os.umask(0o177)
+        try:
+            _UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def dispatch(self, request):
+        """
+        :param dict request: Request sent by a client
+        :returns: Response dictionary
+        """
+        self._last_request = time.time()
+        op = request.get("op")
+        if op == "get":
+            return {
+                "values": self.cache.get_many(request["namespace"], request["keys"])
+            }
+        if op == "put":
+            self.cache.put_many(
+                request["namespace"], request["values"], request.get("ttl")
+            )
+            return {"ok": True}
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if op == "stats":
+            return {
+                "entries": len(self.cache),
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+            }
+        raise ValueError("Unknown operation %r" % op)
+
+    def serve(self):
+        """
+        Serves requests until stopped or idle for too long, saving the cache
+        at regular intervals.
+        """
+        maintenance = threading.Thread(target=self._maintain)
+        maintenance.daemon = True
+        maintenance.start()
+        try:
+            self.serve_forever(poll_interval=0.5)
+        finally:
+            self.stop()
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        """
+        Saves the cache and stops serving requests.
+        """
+        if not self._stop_event.is_set():
+            self._stop_event.set()
+            self.save()
+            self.shutdown()
+
+    def save(self):
+        """
+        Saves the cache to the persistence file, if any.
+        """
+        if self.persist_path:
+            try:
+                self.cache.save(self.persist_path)
+            except Exception as e:
+                sys.stderr.write("Failed to save the breakdown cache: %s\n" % e)
+
+    def _maintain(self):
+        while not self._stop_event.wait(min(self._save_interval, 60)):
+            self.save()
+            if (
+                self._idle_timeout
+                and time.time() - self._last_request > self._idle_timeout
+            ):
+                threading.Thread(target=self.stop).start()
+                return
+
+
+class CacheClient(object):
+    """
+    Client of the cache service. All methods fail silently when the service
+    isn't available, in which case the caller is expected to fall back to
+    resolving everything in-process, and the client doesn't try to reach the
+    service again for CLIENT_RETRY_DELAY seconds.
+    """
+
+    def __init__(self, socket_path, timeout=CLIENT_TIMEOUT):
+        """
+        :param str socket_path: Path of the socket of the service
+        :param float timeout: Number of seconds to wait for the service
+        """
+        self.socket_path = socket_path
+        self._timeout = timeout
+        self._retry_time = 0
+        self._connected = False
+        self._local = threading.local()
+
+    @property
+    def available(self):
+        """
+        False if the service failed to answer recently
+        """
+        return time.time() >= self._retry_time
+
+    @property
+    def connected(self):
+        """
+        True if the service answered the last request
+        """
+        return self._connected
+
+    def set_unavailable(self, delay=CLIENT_RETRY_DELAY):
+        """
+        Stops sending requests to the service for the given delay.
+
+        :param float delay: Number of seconds before the next attempt, 0 to
+                            try again right away
+        """
+        self._connected = False
+        self._retry_time = time.time() + delay
+
+    def ping(self):
+        """
+        :returns: True if the service answered
+        """
+        return bool(self._request({"op": "ping"}))
+
+    def get_many(self, namespace, keys):
+        """
+        :param str namespace: Namespace of the keys
+        :param keys: List of string keys
+        :returns: Dictionary of key -> value for the keys found
+        """
+        if not keys:
+            return {}
+        response = self._request({"op": "get", "namespace": namespace, "keys": keys})
+        return response.get("values", {}) if response else {}
+
+    def put_many(self, namespace, values, ttl=None):
+        """
+        :param str namespace: Namespace of the keys
+        :param dict values: Dictionary of string key -> JSON serializable value
+        :param float ttl: Number of seconds the values are kept for
+        :returns: True if the values were stored
+        """
+        if not values:
+            return True
+        response = self._request(
+            {"op": "put", "namespace": namespace, "values": values, "ttl": ttl}
+        )
+        return bool(response)
+
+    def stats(self):
+        """
+        :returns: Dictionary of the number of entries, hits and misses of the
+                  service, or None if it isn't available
+        """
+        return self._request({"op": "stats"})
+
+    def _request(self, request):
+        """
+        Sends a request over this thread's connection to the service.
+
+        :returns: The response dictionary, or None if the service isn't
+                  available
+        """
+        if not self.available:
+            return None
+        try:
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                connection.settimeout(self._timeout)
+                connection.connect(self.socket_path)
+                try:
+                    check_owner(self.socket_path, connection)
+                except Exception:
+                    connection.close()
+                    raise
+                self._local.connection = connection
+                self._local.reader = connection.makefile("rb")
+            connection.sendall(
+                (json.dumps(request, default=str) + "\n").encode("utf-8")
+            )
+            line = self._local.reader.readline()
+            if not line:
+                raise IOError("Connection closed by the breakdown cache service")
+            response = json.loads(line)
+        except Exception:
+            self._disconnect()
+            self.set_unavailable()
+            return None
+
+        self._connected = True
+        if "error" in response:
+            return None
+        return response
+
+    def _disconnect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        self._local.connection = None
+        self._local.reader = None
+
+
+def start_service(socket_path, persist_path=None, python=None):
+    """
+    Starts the service in a new process, detached from the current one, and
+    waits for it to answer.
+
+    :param str socket_path: Path of the socket the service listens on
+    :param str persist_path: Optional path of the file the cache is saved to
+    :param str python: Python interpreter to run the service with, defaults
+                       to the current one if it is a python interpreter
+    :returns: True if the service answered
+    """
+    if not python:
+        # DCCs embed python, so their executable can't run the service
+        if not os.path.basename(sys.executable).lower().startswith("python"):
+            return False
+        python = sys.executable
+
+    args = [python, os.path.abspath(__file__), "--socket", socket_path]
+    if persist_path:
+        args.extend(["--persist", persist_path])
+
+    with open(os.devnull, "wb") as devnull:
+        subprocess.Popen(
+            args,
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+            start_new_session=True,
+        )
+
+    client = CacheClient(socket_path)
+    deadline = time.time() + AUTOSTART_TIMEOUT
+    while time.time() < deadline:
+        if client.ping():
+            return True
+        client.set_unavailable(0)
+        time.sleep(0.1)
+    return False
+
+
+def get_client(app):
+    """
+    Returns a client of the cache service if it is enabled by the cache_service
+    setting of the app and available, starting the service if it isn't running,
+    e.g. on first use or after it stopped for being idle.
+
+    :param app: The breakdown app
+    :returns: A CacheClient, or None to resolve everything in-process
+    """
+    if not app.get_setting("cache_service") or not is_supported():
+        return None
+
+    socket_path = app.get_setting("cache_service_socket")
+    if not socket_path:
+        try:
+            socket_path = get_default_socket_path(app.cache_location)
+        except (OSError, RuntimeError) as e:
+            app.log_warning("The breakdown cache service can't be used: %s" % e)
+            return None
+
+    with g_clients_lock:
+        client = g_clients.get(socket_path)
+        if client is None:
+            client = CacheClient(socket_path)
+            g_clients[socket_path] = client
+
+        if not client.available:
+            return None
+
+        if not client.connected and not client.ping():
+            started = start_service(
+                socket_path,
+                persist_path=os.path.join(
+                    app.cache_location, "breakdown_cache_service.json"
+                ),
+                python=app.get_setting("cache_service_python"),
+            )
+            if not started:
+                app.log_debug(
+                    "The breakdown cache service isn't available, "
+                    "resolving everything in-process."
+                )
+                return None
+            client.set_unavailable(0)
+
+    return client
+
+
+def main(argv=None):
+    """
+    Command line entry point, running the service until it is idle.
+
+    :param argv: List of command line arguments, defaults to sys.argv
+    :returns: Process exit code
+    """
+    parser = argparse.ArgumentParser(
+        description="Runs the workstation local breakdown cache service."
+    )
+    parser.add_argument(
+        "--socket",
+        help="Socket to listen on, defaults to a socket in a per user folder.",
+    )
+    parser.add_argument("--persist", help="File to save the cache to.")
+    parser.add_argument(
+        "--max-entries", type=int, default=DEFAULT_MAX_ENTRIES, help="Cache size."
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help="Number of seconds without requests after which the service stops.",
+    )
+    args = parser.parse_args(argv)
+    if not args.socket:
+        args.socket = get_default_socket_path()
+
+    # only one service per socket, the others exit right away
+    lock_file = open(args.socket + ".lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        return 0
+
+    server = CacheServer(
+        args.socket,
+        persist_path=args.persist,
+        max_entries=args.max_entries,
+        idle_timeout=args.idle_timeout,
+    )
+    server.serve()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
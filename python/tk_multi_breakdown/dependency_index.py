@@ -0,0 +1,225 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import json
+import os
+import sqlite3
+import time
+
+from . import versions
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    scene TEXT PRIMARY KEY,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    scene TEXT,
+    node_name TEXT,
+    node_type TEXT,
+    template TEXT,
+    fields TEXT,
+    version INTEGER,
+    publish_id INTEGER,
+    entity_type TEXT,
+    entity_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS items_scene ON items (scene);
+CREATE INDEX IF NOT EXISTS items_publish ON items (publish_id);
+CREATE INDEX IF NOT EXISTS items_entity ON items (entity_type, entity_id);
+CREATE INDEX IF NOT EXISTS items_template ON items (template);
+"""
+
+_ITEM_COLUMNS = (
+    "scene",
+    "node_name",
+    "node_type",
+    "template",
+    "fields",
+    "version",
+    "publish_id",
+    "entity_type",
+    "entity_id",
+)
+
+
+class DependencyIndex(object):
+    """
+    Index of the breakdown results of scenes, stored in a local SQLite
+    database. Each scene's items are replaced whenever the scene is
+    analyzed again, and the items can be looked up by publish, entity or
+    template to find which scenes use them.
+
+    A connection is opened per operation, so that an index can be used from
+    any thread and written to by several processes at once.
+    """
+
+    def __init__(self, db_path):
+        """
+        :param str db_path: Path to the SQLite database file. It is created
+                            if it doesn't exist.
+        """
+        self._db_path = db_path
+
+        db_folder = os.path.dirname(db_path)
+        if db_folder and not os.path.exists(db_folder):
+            os.makedirs(db_folder)
+
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+        finally:
+            connection.close()
+
+    @property
+    def db_path(self):
+        """
+        Path to the SQLite database file
+        """
+        return self._db_path
+
+    def upsert_scene(self, scene_path, items):
+        """
+        Stores the breakdown items of a scene, replacing any items previously
+        stored for it.
+
+        :param str scene_path: Path of the scene the items were found in
+        :param items: Breakdown items, as returned by get_breakdown_items. The
+                      template can be a template object or a template name.
+        """
+        rows = [self._item_row(scene_path, item) for item in items]
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM items WHERE scene = ?", (scene_path,))
+                connection.executemany(
+                    "INSERT INTO items (%s) VALUES (%s)"
+                    % (", ".join(_ITEM_COLUMNS), ", ".join("?" * len(_ITEM_COLUMNS))),
+                    rows,
+                )
+                connection.execute(
+                    "INSERT OR REPLACE INTO scenes (scene, updated) VALUES (?, ?)",
+                    (scene_path, time.time()),
+                )
+        finally:
+            connection.close()
+
+    def remove_scene(self, scene_path):
+        """
+        Removes all items stored for a scene.
+
+        :param str scene_path: Path of the scene to remove
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM items WHERE scene = ?", (scene_path,))
+                connection.execute("DELETE FROM scenes WHERE scene = ?", (scene_path,))
+        finally:
+            connection.close()
+
+    def find_by_publish(self, publish_id):
+        """
+        :param int publish_id: Id of a publish
+        :returns: List of items referencing the publish, see _query
+        """
+        return self._query("publish_id = ?", (publish_id,))
+
+    def find_by_entity(self, entity_type, entity_id):
+        """
+        :param str entity_type: Type of the entity, e.g. Asset
+        :param int entity_id: Id of the entity
+        :returns: List of items referencing publishes of the entity, see _query
+        """
+        return self._query(
+            "entity_type = ? AND entity_id = ?", (entity_type, entity_id)
+        )
+
+    def find_by_template(self, template_pattern):
+        """
+        :param str template_pattern: Template name, or a glob pattern matching
+                                     a family of templates, e.g. maya_*_publish
+        :returns: List of items matching the template(s), see _query
+        """
+        return self._query("template GLOB ?", (template_pattern,))
+
+    def get_scenes(self):
+        """
+        :returns: Dictionary of scene path -> time the scene was last indexed
+        """
+        connection = self._connect()
+        try:
+            return dict(connection.execute("SELECT scene, updated FROM scenes"))
+        finally:
+            connection.close()
+
+    def _query(self, condition, parameters):
+        """
+        Returns the items matching the given condition.
+
+        Each item is returned as a dictionary with the keys scene, node_name,
+        node_type, template (name), fields, version, publish_id and entity (a
+        shotgun style entity dictionary without name, or None).
+
+        :param str condition: SQL condition on the items table
+        :param tuple parameters: Parameters of the condition
+        :returns: List of dictionaries ordered by scene and node name
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT %s FROM items WHERE %s ORDER BY scene, node_name"
+                % (", ".join(_ITEM_COLUMNS), condition),
+                parameters,
+            ).fetchall()
+        finally:
+            connection.close()
+
+        results = []
+        for row in rows:
+            result = dict(zip(_ITEM_COLUMNS, row))
+            result["fields"] = json.loads(result["fields"])
+            entity_type = result.pop("entity_type")
+            entity_id = result.pop("entity_id")
+            result["entity"] = (
+                {"type": entity_type, "id": entity_id} if entity_type else None
+            )
+            results.append(result)
+        return results
+
+    def _item_row(self, scene_path, item):
+        """
+        :returns: Tuple of column values for the given breakdown item
+        """
+        template = item["template"]
+        template_name = getattr(template, "name", template)
+
+        sg_data = item.get("sg_data") or {}
+        entity = sg_data.get("entity") or {}
+
+        return (
+            scene_path,
+            item["node_name"],
+            item["node_type"],
+            template_name,
+            json.dumps(item["fields"], sort_keys=True),
+            item["fields"].get(versions.VERSION_KEY),
+            sg_data.get("id"),
+            entity.get("type"),
+            entity.get("id"),
+        )
+
+    def _connect(self):
+        """
+        :returns: A new connection to the database
+        """
+        return sqlite3.connect(self._db_path, timeout=30)
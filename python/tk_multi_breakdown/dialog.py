@@ -8,9 +8,13 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-import copy
+import threading
 
-from sgtk.platform.qt import QtGui
+from sgtk.platform.qt import QtCore, QtGui
+from . import preflight
+from . import replay
+from . import timing
+from . import update_executor
 from .ui.dialog import Ui_Dialog
 
 
@@ -18,6 +22,16 @@ class AppDialog(QtGui.QWidget):
     def __init__(self, app):
         QtGui.QWidget.__init__(self)
         self._app = app
+        # the update running in the background, if any
+        self._update_handle = None
+        self._update_progress = None
+        # polls the progress of the pre-flight checks running in the background
+        self._preflight_timer = None
+        # stops the pre-flight checks running in the background once set
+        self._preflight_cancel = None
+        # set once the dialog is closed, after which the callbacks of the
+        # update still running must not touch the widgets
+        self._closed = False
         # set up the UI
         self.ui = Ui_Dialog()
         self.ui.setupUi(self)
@@ -41,7 +55,18 @@ class AppDialog(QtGui.QWidget):
     # our threads. Nuke does not do proper cleanup on exit.
 
     def closeEvent(self, event):
+        self._closed = True
+        if self._preflight_cancel:
+            self._preflight_cancel.set()
+        if self._preflight_timer:
+            self._preflight_timer.stop()
+        if self._update_handle:
+            # stop after the slice being updated
+            self._update_handle.cancel()
         self.ui.browser.destroy()
+        # write out the timings and the inputs captured by the status workers
+        timing.flush(self._app)
+        replay.flush(self._app)
         # okay to close!
         event.accept()
 
@@ -78,7 +103,8 @@ class AppDialog(QtGui.QWidget):
                 continue
 
             # calculate path based on latest version
-            new_fields = copy.deepcopy(x.data["fields"])
+            # field values are plain strings and numbers, a shallow copy is enough
+            new_fields = dict(x.data["fields"])
             new_fields["version"] = latest_version
             new_path = x.data["template"].apply_fields(new_fields)
 
@@ -86,11 +112,209 @@ class AppDialog(QtGui.QWidget):
             d["node"] = x.data["node_name"]
             d["type"] = x.data["node_type"]
             d["path"] = new_path
+            # used by the pre-flight checks
+            d["template"] = x.data["template"]
+            d["fields"] = new_fields
+            d["current_fields"] = x.data["fields"]
 
             data.append(d)
 
-        # call out to hook
-        self._app.execute_hook_method("hook_scene_operations", "update", items=data)
+        if data and self._app.get_setting("preflight_workers"):
+            # check the files to update to before touching the scene, the
+            # update is started once they are checked
+            self._check_update_targets(data)
+        else:
+            self._start_update([preflight.TargetCheck(d).item for d in data])
+
+    def _start_update(self, data):
+        """
+        Updates the given items in the background.
+
+        :param data: List of the items to pass to the update hook
+        """
+        if not data:
+            self.setup_scene_list()
+            return
+
+        # call out to hook, a slice of items at a time so that the DCC
+        # stays responsive and the update can be cancelled
+        self._update_progress = QtGui.QProgressDialog(
+            "Updating %d items..." % len(data), "Cancel", 0, len(data), self
+        )
+        self._update_progress.setWindowModality(QtCore.Qt.WindowModal)
+        self._update_progress.setMinimumDuration(0)
+        self.ui.update.setEnabled(False)
+
+        executor = update_executor.UpdateExecutor(self._app)
+        self._update_handle = executor.submit(
+            data,
+            progress_callback=self._on_update_progress,
+            done_callback=self._on_update_done,
+        )
+        self._update_progress.canceled.connect(self._update_handle.cancel)
+
+    def _check_update_targets(self, targets):
+        """
+        Checks the files the selected items are about to be updated to from a
+        background thread, and starts the update once they are checked, see
+        _on_preflight_done.
+
+        :param targets: List of pre-flight targets, see preflight.check_targets
+        """
+        progress = QtGui.QProgressDialog(
+            "Checking the files of %d items..." % len(targets),
+            "Cancel",
+            0,
+            len(targets),
+            self,
+        )
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        self.ui.update.setEnabled(False)
+
+        # the checking threads can't touch the widgets, the progress they
+        # report is picked up by a timer instead
+        checked = [0]
+        self._preflight_timer = QtCore.QTimer(self)
+        self._preflight_timer.timeout.connect(lambda: progress.setValue(checked[0]))
+        self._preflight_timer.start(100)
+
+        # cancelling stops the targets not checked yet, and gives the update
+        # button back right away rather than once the checks in progress end
+        cancel_event = threading.Event()
+        self._preflight_cancel = cancel_event
+        progress.canceled.connect(lambda: self._on_preflight_cancelled(cancel_event))
+
+        def report_progress(num_checked, total):
+            checked[0] = num_checked
+
+        def check():
+            (plan, error) = (None, None)
+            try:
+                plan = preflight.check_targets(
+                    self._app.sgtk,
+                    targets,
+                    max_workers=self._app.get_setting("preflight_workers"),
+                    progress_callback=report_progress,
+                    require_current_frames=self._app.get_setting(
+                        "preflight_require_current_frames"
+                    ),
+                    cancel_event=cancel_event,
+                )
+            except Exception as e:
+                error = e
+            if cancel_event.is_set():
+                return
+            self._app.engine.execute_in_main_thread(
+                self._on_preflight_done, progress, plan, error
+            )
+
+        thread = threading.Thread(target=check, name="BreakdownPreflight")
+        thread.daemon = True
+        thread.start()
+
+    def _on_preflight_cancelled(self, cancel_event):
+        """
+        Called in the main thread when the user cancels the pre-flight checks.
+        The checks in progress end in the background and their result is
+        dropped.
+        """
+        cancel_event.set()
+        if self._closed or cancel_event is not self._preflight_cancel:
+            return
+        self._preflight_timer.stop()
+        self._preflight_timer = None
+        self._preflight_cancel = None
+        self.ui.update.setEnabled(True)
+
+    def _on_preflight_done(self, progress, plan, error):
+        """
+        Called in the main thread once the files to update to are checked.
+        Asks the user what to do with the missing and incomplete ones, and
+        starts the update.
+        """
+        if self._closed or progress.wasCanceled():
+            return
+        self._preflight_timer.stop()
+        self._preflight_timer = None
+        self._preflight_cancel = None
+        progress.close()
+        self.ui.update.setEnabled(True)
+        if error is not None:
+            QtGui.QMessageBox.warning(
+                self, "Update pre-flight", "Failed to check the files: %s" % error
+            )
+            return
+
+        self._app.log_debug("Update pre-flight: %s" % plan.get_summary())
+
+        if not plan.invalid and not plan.incomplete:
+            self._start_update(plan.get_items())
+            return
+
+        problems = plan.invalid + plan.incomplete
+        details = "\n".join(c.message for c in problems[:10])
+        if len(problems) > 10:
+            details += "\n..."
+
+        box = QtGui.QMessageBox(self)
+        box.setIcon(QtGui.QMessageBox.Warning)
+        box.setWindowTitle("Update pre-flight")
+        box.setText(plan.get_summary() + ".")
+        box.setInformativeText(
+            "Missing files are skipped. Frame sequences missing frames can be "
+            "skipped or updated anyway."
+        )
+        box.setDetailedText(details)
+        skip_button = box.addButton("Skip Incomplete", QtGui.QMessageBox.AcceptRole)
+        update_button = None
+        if plan.incomplete:
+            update_button = box.addButton(
+                "Update Incomplete", QtGui.QMessageBox.AcceptRole
+            )
+        box.addButton(QtGui.QMessageBox.Cancel)
+        box.exec_()
+
+        if box.clickedButton() == skip_button:
+            self._start_update(plan.get_items())
+        elif update_button is not None and box.clickedButton() == update_button:
+            self._start_update(plan.get_items(include_incomplete=True))
+        else:
+            self.setup_scene_list()
+
+    def _on_update_progress(self, updated, total):
+        """
+        Called in the main thread after each slice of the update.
+        """
+        if self._closed or self._update_progress is None:
+            return
+        self._update_progress.setValue(updated)
+
+    def _on_update_done(self, handle):
+        """
+        Called in the main thread once the update started by update_items is over.
+        """
+        self._update_handle = None
+        if self._closed:
+            # the widgets may be gone already
+            return
+
+        self._update_progress.close()
+        self._update_progress = None
+        self.ui.update.setEnabled(True)
+
+        if handle.exception():
+            QtGui.QMessageBox.warning(
+                self,
+                "Update failed",
+                "Failed to update the scene: %s" % handle.exception(),
+            )
+        elif handle.cancelled():
+            QtGui.QMessageBox.information(
+                self,
+                "Update cancelled",
+                "The update was cancelled after %d of %d items." % handle.progress,
+            )
 
         # finally refresh the UI
         self.setup_scene_list()
@@ -0,0 +1,350 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compact representation of breakdown items.
+
+Breakdown items are plain dictionaries, which is convenient but costly for
+scenes with tens of thousands of items. The classes in this module hold the
+same data in slots instead, intern the field names and values, and share a
+single immutable record between all the items referencing the same publish.
+
+Both classes are mappings, so code written against the dictionary items keeps
+working, e.g. item["fields"]["version"] or item["sg_data"]["id"]. Publish
+records are read-only, while the existing keys of items can be reassigned.
+
+ColumnarItems stores the items column by column instead, for bulk consumers
+which filter and group thousands of items at once.
+"""
+
+import array
+import sys
+import weakref
+from collections.abc import Mapping
+
+
+class PublishRecord(Mapping):
+    """
+    Immutable publish data, shared by all the items referencing the publish.
+    """
+
+    __slots__ = ("_keys", "_values", "__weakref__")
+
+    def __init__(self, keys, values):
+        """
+        :param tuple keys: Interned field names, shared between records
+        :param tuple values: Values of the fields, in the same order
+        """
+        self._keys = keys
+        self._values = values
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return "<PublishRecord %s>" % dict(self)
+
+
+class BreakdownItem(Mapping):
+    """
+    Breakdown item with the same keys as the items returned by
+    get_breakdown_items, i.e node_name, node_type, template, fields and
+    sg_data.
+    """
+
+    KEYS = ("node_name", "node_type", "template", "fields", "sg_data")
+
+    __slots__ = KEYS
+
+    def __init__(self, node_name, node_type, template, fields, sg_data):
+        self.node_name = node_name
+        self.node_type = node_type
+        self.template = template
+        self.fields = fields
+        self.sg_data = sg_data
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return "<BreakdownItem %s %s>" % (self.node_type, self.node_name)
+
+
+class ItemFactory(object):
+    """
+    Converts breakdown item dictionaries to compact items, sharing the
+    publish records and the interned strings between the items it creates.
+    """
+
+    def __init__(self, trim_sg_data=None):
+        """
+        :param trim_sg_data: Optional callable applied to the publish data of
+                             the items before they are turned into records
+        """
+        self._trim_sg_data = trim_sg_data
+
+        # publish records by publish id, kept as long as an item uses them
+        self._records = weakref.WeakValueDictionary()
+
+        # shared tuples of field names of the publish records
+        self._record_keys = {}
+
+    def create(self, item):
+        """
+        :param dict item: Item as returned by get_breakdown_items
+        :returns: A BreakdownItem
+        """
+        fields = dict(
+            (sys.intern(k), self._intern(v)) for (k, v) in item["fields"].items()
+        )
+        return BreakdownItem(
+            self._intern(item["node_name"]),
+            self._intern(item["node_type"]),
+            item["template"],
+            fields,
+            self.get_record(item["sg_data"]),
+        )
+
+    def get_record(self, sg_data):
+        """
+        :param dict sg_data: Publish data, or None
+        :returns: The PublishRecord shared by all items of the publish, or None
+        """
+        if not sg_data:
+            return None
+
+        key = (sg_data.get("type"), sg_data.get("id"))
+        record = self._records.get(key)
+        if record is None:
+            if self._trim_sg_data:
+                sg_data = self._trim_sg_data(sg_data)
+            keys = tuple(sys.intern(k) for k in sorted(sg_data))
+            keys = self._record_keys.setdefault(keys, keys)
+            record = PublishRecord(keys, tuple(sg_data[k] for k in keys))
+            self._records[key] = record
+        return record
+
+    def _intern(self, value):
+        if isinstance(value, str):
+            return sys.intern(value)
+        return value
+
+
+class ColumnarItems(object):
+    """
+    Breakdown items stored column by column, for consumers processing
+    thousands of items in bulk.
+
+    Each column is a parallel array with one value per item. Strings, i.e.
+    node names and types, template names and entity types, are stored as
+    indexes into the shared strings list, so that repeated values are only
+    stored once and can be compared as integers. Missing values are stored
+    as -1.
+
+    The template and field columns hold the template objects and the field
+    dictionaries needed to compute the highest version of the items. They
+    are left out of to_dict, which only returns JSON serializable data.
+    """
+
+    # columns of string indexes
+    STRING_COLUMNS = ("node_name", "node_type", "template_name", "entity_type")
+
+    # columns of integers
+    INT_COLUMNS = ("version", "publish_id", "entity_id")
+
+    def __init__(self):
+        self.strings = []
+        self._string_indexes = {}
+        for column in self.STRING_COLUMNS + self.INT_COLUMNS:
+            setattr(self, column, array.array("l"))
+        self.template = []
+        self.fields = []
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        :param items: Items as returned by get_breakdown_items or analyze_scene
+        :returns: A ColumnarItems instance holding the given items
+        """
+        columns = cls()
+        for item in items:
+            columns.append(item)
+        return columns
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param dict data: Dictionary as returned by to_dict
+        :returns: A ColumnarItems instance without template and field columns
+        """
+        columns = cls()
+        for string in data["strings"]:
+            columns._encode(string)
+        for column in cls.STRING_COLUMNS + cls.INT_COLUMNS:
+            getattr(columns, column).extend(data[column])
+        return columns
+
+    def append(self, item):
+        """
+        Adds an item to the columns.
+
+        :param item: Item as returned by get_breakdown_items or analyze_scene
+        """
+        template = item["template"]
+        sg_data = item["sg_data"] or {}
+        entity = sg_data.get("entity") or {}
+
+        self.node_name.append(self._encode(item["node_name"]))
+        self.node_type.append(self._encode(item["node_type"]))
+        self.template_name.append(self._encode(getattr(template, "name", template)))
+        self.entity_type.append(self._encode(entity.get("type")))
+        self.version.append(_int_or_missing(item["fields"].get("version")))
+        self.publish_id.append(_int_or_missing(sg_data.get("id")))
+        self.entity_id.append(_int_or_missing(entity.get("id")))
+        self.template.append(template)
+        self.fields.append(item["fields"])
+
+    def __len__(self):
+        return len(self.node_name)
+
+    def get_string(self, index):
+        """
+        :param int index: Index stored in a string column
+        :returns: The string, or None for missing values
+        """
+        return None if index < 0 else self.strings[index]
+
+    def get_string_index(self, string):
+        """
+        :param str string: String to look up
+        :returns: The index of the string in the string columns, or -1 if
+                  no item uses it
+        """
+        return self._string_indexes.get(string, -1)
+
+    def column(self, name):
+        """
+        :param str name: Name of a column
+        :returns: List of the values of the column, with the strings decoded
+                  and the missing values as None
+        """
+        values = getattr(self, name)
+        if name in self.STRING_COLUMNS:
+            return [self.get_string(v) for v in values]
+        if name in self.INT_COLUMNS:
+            return [None if v < 0 else v for v in values]
+        return list(values)
+
+    def find(self, **criteria):
+        """
+        Returns the indexes of the items matching all the given column values,
+        e.g. find(node_type="reference", template_name="maya_asset_publish").
+        String criteria are compared as indexes, without decoding the columns.
+
+        :param criteria: Column name -> value to match, None matching missing values
+        :returns: List of item indexes
+        """
+        matches = None
+        for (name, value) in criteria.items():
+            if name in self.STRING_COLUMNS:
+                if value is None:
+                    encoded = -1
+                else:
+                    encoded = self.get_string_index(value)
+                    if encoded < 0:
+                        return []
+            elif name in self.INT_COLUMNS:
+                encoded = -1 if value is None else value
+            else:
+                raise KeyError(name)
+
+            values = getattr(self, name)
+            indexes = matches if matches is not None else range(len(values))
+            matches = [i for i in indexes if values[i] == encoded]
+        return list(matches if matches is not None else range(len(self)))
+
+    def take(self, indexes):
+        """
+        :param indexes: Iterable of item indexes
+        :returns: A new ColumnarItems holding the given items, sharing the
+                  strings of this one
+        """
+        columns = ColumnarItems()
+        columns.strings = self.strings
+        columns._string_indexes = self._string_indexes
+        for i in indexes:
+            for column in self.STRING_COLUMNS + self.INT_COLUMNS:
+                getattr(columns, column).append(getattr(self, column)[i])
+            if self.template:
+                columns.template.append(self.template[i])
+                columns.fields.append(self.fields[i])
+        return columns
+
+    def row(self, index):
+        """
+        :param int index: Item index
+        :returns: Dictionary of the column values of the item
+        """
+        row = {}
+        for column in self.STRING_COLUMNS:
+            row[column] = self.get_string(getattr(self, column)[index])
+        for column in self.INT_COLUMNS:
+            value = getattr(self, column)[index]
+            row[column] = None if value < 0 else value
+        if self.template:
+            row["template"] = self.template[index]
+            row["fields"] = self.fields[index]
+        return row
+
+    def to_dict(self):
+        """
+        :returns: JSON serializable dictionary of the strings and the columns
+                  of integers
+        """
+        data = {"strings": list(self.strings)}
+        for column in self.STRING_COLUMNS + self.INT_COLUMNS:
+            data[column] = getattr(self, column).tolist()
+        return data
+
+    def _encode(self, string):
+        if string is None:
+            return -1
+        index = self._string_indexes.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(string)
+            self._string_indexes[string] = index
+        return index
+
+
+def _int_or_missing(value):
+    return -1 if value is None else value
@@ -0,0 +1,417 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cache and throughput metrics of the breakdown.
+
+Metrics are kept in a process wide registry and can be read through the
+get_metrics method of the app, or written at intervals to a Prometheus
+textfile, e.g. for the node exporter's textfile collector, by setting the
+metrics_textfile_path setting.
+
+Metrics are created once at import time and updating them only takes a lock
+and an addition, so they can be updated from the hot paths and the worker
+threads.
+"""
+
+import bisect
+import collections
+import contextlib
+import os
+import threading
+
+# default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# number of recent observations kept by histograms to compute percentiles
+RESERVOIR_SIZE = 1024
+
+# the textfile exporter currently running, if any
+g_exporter = None
+g_exporter_lock = threading.Lock()
+
+# per thread state, holding the query counter of count_sg_queries
+g_local = threading.local()
+
+
+class Counter(object):
+    """
+    Monotonically increasing value, e.g. a number of queries.
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increments the counter.
+
+        :param amount: Amount to increment by
+        """
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+    def reset(self):
+        with self._lock:
+            self._value = 0
+
+    def _prometheus_lines(self):
+        return ["%s %s" % (self.name, self._value)]
+
+
+class Gauge(Counter):
+    """
+    Value which can go up and down, e.g. the size of a cache.
+    """
+
+    type = "gauge"
+
+    def set(self, value):
+        """
+        Sets the value of the gauge.
+
+        :param value: New value
+        """
+        self._value = value
+
+    def dec(self, amount=1):
+        """
+        Decrements the gauge.
+
+        :param amount: Amount to decrement by
+        """
+        self.inc(-amount)
+
+
+class Histogram(object):
+    """
+    Distribution of observed values, e.g. latencies. Observations are
+    counted in fixed buckets for Prometheus, and the most recent ones are
+    kept to compute percentiles.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def observe(self, value):
+        """
+        Records an observation.
+
+        :param float value: Observed value
+        """
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._bucket_counts[index] += 1
+            self._count += 1
+            self._sum += value
+            self._recent.append(value)
+
+    @property
+    def count(self):
+        return self._count
+
+    def percentile(self, percent):
+        """
+        :param float percent: Percentile to compute, between 0 and 100
+        :returns: The percentile of the recent observations, or None if
+                  nothing was observed
+        """
+        with self._lock:
+            recent = sorted(self._recent)
+        if not recent:
+            return None
+        index = int(round((len(recent) - 1) * percent / 100.0))
+        return recent[index]
+
+    def snapshot(self):
+        return {
+            "count": self._count,
+            "sum": self._sum,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._bucket_counts = [0] * (len(self._buckets) + 1)
+            self._count = 0
+            self._sum = 0.0
+            self._recent = collections.deque(maxlen=RESERVOIR_SIZE)
+
+    def _prometheus_lines(self):
+        with self._lock:
+            bucket_counts = list(self._bucket_counts)
+            count = self._count
+            total = self._sum
+
+        lines = []
+        cumulative = 0
+        for (bound, bucket_count) in zip(self._buckets, bucket_counts):
+            cumulative += bucket_count
+            lines.append('%s_bucket{le="%s"} %d' % (self.name, bound, cumulative))
+        lines.append('%s_bucket{le="+Inf"} %d' % (self.name, count))
+        lines.append("%s_sum %s" % (self.name, total))
+        lines.append("%s_count %d" % (self.name, count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    Collection of named metrics.
+    """
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def counter(self, name, help):
+        """
+        :returns: The counter with the given name, created if needed
+        """
+        return self._get_or_create(Counter, name, help)
+
+    def gauge(self, name, help):
+        """
+        :returns: The gauge with the given name, created if needed
+        """
+        return self._get_or_create(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        """
+        :returns: The histogram with the given name, created if needed
+        """
+        return self._get_or_create(Histogram, name, help, buckets)
+
+    def snapshot(self):
+        """
+        :returns: Dictionary of metric name -> value. Histograms are returned
+                  as dictionaries with count, sum, p50, p90 and p99 keys.
+        """
+        return dict((name, m.snapshot()) for (name, m) in self._metrics.items())
+
+    def reset(self):
+        """
+        Resets all metrics to their initial value.
+        """
+        for metric in self._metrics.values():
+            metric.reset()
+
+    def to_prometheus_text(self):
+        """
+        :returns: The metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            lines.extend(metric._prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_textfile(self, path):
+        """
+        Writes the metrics to a Prometheus textfile. The file is written
+        next to its destination and moved in place, so that it is never
+        read half written.
+
+        :param str path: Path of the .prom file to write
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "wt") as fh:
+            fh.write(self.to_prometheus_text())
+        os.replace(tmp_path, path)
+
+    def _get_or_create(self, metric_class, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args)
+                self._metrics[name] = metric
+            return metric
+
+
+class TextfileExporter(threading.Thread):
+    """
+    Background thread writing the registry to a Prometheus textfile at
+    regular intervals.
+    """
+
+    def __init__(self, registry, path, interval, logger=None):
+        """
+        :param registry: MetricsRegistry to export
+        :param str path: Path of the .prom file to write
+        :param float interval: Number of seconds between writes
+        :param logger: Optional callable used to report write failures
+        """
+        threading.Thread.__init__(self, name="BreakdownMetricsExporter")
+        self.daemon = True
+        self.path = path
+        self._registry = registry
+        self._interval = interval
+        self._logger = logger
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            self.write()
+
+    def write(self):
+        try:
+            self._registry.write_prometheus_textfile(self.path)
+        except Exception as e:
+            if self._logger:
+                self._logger("Failed to write the breakdown metrics: %s" % e)
+
+    def stop(self):
+        """
+        Stops the thread, writing the metrics one last time.
+        """
+        self._stop_event.set()
+        self.write()
+
+
+def start_exporter(app):
+    """
+    Starts writing the metrics to the textfile configured by the
+    metrics_textfile_path setting, if any. Does nothing if the exporter is
+    already running.
+
+    :param app: The breakdown app
+    """
+    global g_exporter
+
+    path = app.get_setting("metrics_textfile_path")
+    if not path:
+        return
+
+    with g_exporter_lock:
+        if g_exporter is not None:
+            return
+        g_exporter = TextfileExporter(
+            g_registry,
+            path,
+            app.get_setting("metrics_textfile_interval"),
+            logger=app.log_warning,
+        )
+        g_exporter.start()
+
+
+def stop_exporter():
+    """
+    Stops the textfile exporter, if running.
+    """
+    global g_exporter
+
+    with g_exporter_lock:
+        if g_exporter is not None:
+            g_exporter.stop()
+            g_exporter = None
+
+
+# the registry holding the breakdown metrics
+g_registry = MetricsRegistry()
+
+scans = g_registry.counter("breakdown_scans_total", "Number of breakdowns run.")
+scan_items = g_registry.counter(
+    "breakdown_scan_items_total", "Number of breakdown items found by the scans."
+)
+scan_items_per_second = g_registry.gauge(
+    "breakdown_scan_items_per_second",
+    "Breakdown items resolved per second by the last breakdown.",
+)
+publish_cache_hits = g_registry.counter(
+    "breakdown_publish_cache_hits_total", "Paths found in the publish cache."
+)
+publish_cache_misses = g_registry.counter(
+    "breakdown_publish_cache_misses_total", "Paths not found in the publish cache."
+)
+publish_cache_size = g_registry.gauge(
+    "breakdown_publish_cache_size", "Number of paths in the publish cache."
+)
+sg_queries = g_registry.counter(
+    "breakdown_sg_queries_total", "Number of Shotgun queries sent by the breakdown."
+)
+sg_queries_per_breakdown = g_registry.histogram(
+    "breakdown_sg_queries_per_breakdown",
+    "Number of Shotgun queries sent per breakdown.",
+    buckets=(0, 1, 2, 5, 10, 20, 50),
+)
+version_scan_seconds = g_registry.histogram(
+    "breakdown_version_scan_seconds",
+    "Time spent scanning the disk for the highest version of an item.",
+)
+status_seconds = g_registry.histogram(
+    "breakdown_status_seconds",
+    "Time spent computing the status of an item in the list item worker.",
+)
+thumbnail_downloads = g_registry.counter(
+    "breakdown_thumbnail_downloads_total", "Number of thumbnails downloaded."
+)
+
+
+def inc_sg_queries(amount=1):
+    """
+    Counts Shotgun queries sent by the breakdown, in the sg_queries counter
+    and in the count_sg_queries context of the calling thread, if any.
+
+    :param amount: Number of queries sent
+    """
+    sg_queries.inc(amount)
+    counter = getattr(g_local, "sg_queries", None)
+    if counter is not None:
+        counter.inc(amount)
+
+
+@contextlib.contextmanager
+def count_sg_queries():
+    """
+    Counts the Shotgun queries sent from the calling thread within the context,
+    leaving out the queries sent by the other threads in the meantime, e.g. by
+    other breakdowns::
+
+        with metrics.count_sg_queries() as queries:
+            ...
+        metrics.sg_queries_per_breakdown.observe(queries.value)
+
+    The queries counted by nested contexts are also counted by the outer ones.
+
+    :returns: Context manager yielding a Counter
+    """
+    counter = Counter("sg_queries", "Shotgun queries sent from this thread.")
+    outer_counter = getattr(g_local, "sg_queries", None)
+    g_local.sg_queries = counter
+    try:
+        yield counter
+    finally:
+        g_local.sg_queries = outer_counter
+        if outer_counter is not None:
+            outer_counter.inc(counter.value)
@@ -0,0 +1,379 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pre-flight checks of the targets of an update.
+
+Before the update hook reloads anything in the DCC, the paths the nodes are
+about to be updated to are checked from a pool of threads: single files must
+exist, and frame sequences must have no gaps in their frame range. Sequences
+with several files per frame, e.g. one per eye, are checked separately for
+each eye, and must have all the eyes of the version currently loaded. As a new
+version may legitimately have a shorter frame range, sequences are only
+required to have at least the frames of the version currently loaded when
+asked to. The result is an UpdatePlan listing the targets which can be
+updated, those which are incomplete and those which are missing, along with
+the size of the files to load.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sgtk import TankError
+from sgtk.templatekey import SequenceKey
+
+from . import timing
+from .versions import is_concrete
+
+# number of threads checking targets at once
+DEFAULT_WORKERS = 8
+
+# statuses of a target
+OK = "ok"
+INCOMPLETE = "incomplete"
+MISSING = "missing"
+ERROR = "error"
+
+
+class TargetCheck(object):
+    """
+    Result of the check of an update target.
+    """
+
+    __slots__ = (
+        "target",
+        "status",
+        "size",
+        "num_files",
+        "frames",
+        "missing_frames",
+        "message",
+    )
+
+    def __init__(self, target):
+        """
+        :param dict target: Update target, see check_targets
+        """
+        self.target = target
+        self.status = OK
+        self.size = 0
+        self.num_files = 0
+        self.frames = None
+        self.missing_frames = []
+        self.message = None
+
+    @property
+    def item(self):
+        """
+        Item to pass to the update hook, with node, type and path keys
+        """
+        return {
+            "node": self.target["node"],
+            "type": self.target["type"],
+            "path": self.target["path"],
+        }
+
+    def __repr__(self):
+        return "<TargetCheck %s %s: %s>" % (
+            self.target["node"],
+            self.status,
+            self.message or self.target["path"],
+        )
+
+
+class UpdatePlan(object):
+    """
+    Checked targets of an update, in the order they were given.
+    """
+
+    def __init__(self, checks):
+        """
+        :param checks: List of TargetCheck
+        """
+        self.checks = checks
+
+    @property
+    def valid(self):
+        """
+        Checks of the targets which can be updated
+        """
+        return [c for c in self.checks if c.status == OK]
+
+    @property
+    def incomplete(self):
+        """
+        Checks of the frame sequences missing frames
+        """
+        return [c for c in self.checks if c.status == INCOMPLETE]
+
+    @property
+    def invalid(self):
+        """
+        Checks of the targets which don't exist or couldn't be checked
+        """
+        return [c for c in self.checks if c.status in (MISSING, ERROR)]
+
+    @property
+    def total_size(self):
+        """
+        Size in bytes of the files of the targets which can be updated
+        """
+        return sum(c.size for c in self.checks if c.status in (OK, INCOMPLETE))
+
+    def get_items(self, include_incomplete=False):
+        """
+        :param bool include_incomplete: Whether to update the frame sequences
+                                        which are missing frames as well
+        :returns: List of items to pass to the update hook, with node, type and
+                  path keys, skipping the invalid targets
+        """
+        statuses = (OK, INCOMPLETE) if include_incomplete else (OK,)
+        return [c.item for c in self.checks if c.status in statuses]
+
+    def get_summary(self):
+        """
+        :returns: One line summary of the plan, e.g.
+                  480 items to update (12.3 GB), 15 incomplete, 5 missing
+        """
+        summary = "%d items to update (%s)" % (
+            len(self.valid),
+            format_size(sum(c.size for c in self.valid)),
+        )
+        if self.incomplete:
+            summary += ", %d incomplete" % len(self.incomplete)
+        if self.invalid:
+            summary += ", %d missing" % len(self.invalid)
+        return summary
+
+
+def check_targets(
+    tk,
+    targets,
+    max_workers=DEFAULT_WORKERS,
+    progress_callback=None,
+    require_current_frames=False,
+    cancel_event=None,
+):
+    """
+    Checks the given update targets in parallel.
+
+    Each target is a dictionary with the node, type and path keys of the item
+    passed to the update hook, plus the template and fields the path was built
+    from and the fields of the version currently loaded, as current_fields.
+    Targets without a template are checked as single files.
+
+    :param tk: Toolkit API instance
+    :param targets: List of target dictionaries
+    :param int max_workers: Number of threads checking targets at once
+    :param progress_callback: Optional callable taking the number of targets
+                              checked so far and the total number of targets,
+                              called from the checking threads
+    :param bool require_current_frames: If True, frame sequences must also have
+                                        at least the frames of the version
+                                        currently loaded
+    :param cancel_event: Optional threading.Event, which stops the checks of the
+                         targets not being checked yet once set
+    :returns: An UpdatePlan, or None if the checks were cancelled
+    """
+    if not targets:
+        return UpdatePlan([])
+
+    checked = [0]
+    lock = threading.Lock()
+
+    def check(target):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        result = check_target(tk, target, require_current_frames)
+        if progress_callback:
+            with lock:
+                checked[0] += 1
+                progress_callback(checked[0], len(targets))
+        return result
+
+    with timing.span("preflight", targets=len(targets)) as s:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            checks = list(pool.map(check, targets))
+        if cancel_event is not None and cancel_event.is_set():
+            s.set(cancelled=True)
+            return None
+        s.set(valid=len([c for c in checks if c.status == OK]))
+    return UpdatePlan(checks)
+
+
+def check_target(tk, target, require_current_frames=False):
+    """
+    Checks a single update target, see check_targets.
+
+    :param tk: Toolkit API instance
+    :param dict target: Target dictionary
+    :param bool require_current_frames: If True, a frame sequence must also have
+                                        at least the frames of the version
+                                        currently loaded
+    :returns: A TargetCheck
+    """
+    check = TargetCheck(target)
+    template = target.get("template")
+    try:
+        if template is None or not (
+            _get_frame_keys(template) or _get_group_keys(template, target["fields"])
+        ):
+            _check_file(check, target["path"])
+        else:
+            _check_sequence(check, tk, template, target, require_current_frames)
+    except (TankError, OSError) as e:
+        check.status = ERROR
+        check.message = str(e)
+    return check
+
+
+def format_size(size):
+    """
+    :param int size: Size in bytes
+    :returns: Human readable size, e.g. 1.2 GB
+    """
+    if size < 1024:
+        return "%d B" % size
+    for unit in ("KB", "MB", "GB", "TB"):
+        size /= 1024.0
+        if size < 1024.0 or unit == "TB":
+            return "%.1f %s" % (size, unit)
+
+
+def _check_file(check, path):
+    try:
+        check.size = os.stat(path).st_size
+    except OSError:
+        check.status = MISSING
+        check.message = "%s doesn't exist" % path
+        return
+    check.num_files = 1
+
+
+def _check_sequence(check, tk, template, target, require_current_frames):
+    frame_keys = _get_frame_keys(template)
+    group_keys = _get_group_keys(template, target["fields"])
+    skip_keys = frame_keys + group_keys
+    paths = _list_files(tk, template, target["fields"], skip_keys)
+    if not paths:
+        check.status = MISSING
+        check.message = "No files found for %s" % target["path"]
+        return
+
+    for path in paths:
+        check.size += os.stat(path).st_size
+    check.num_files = len(paths)
+
+    frames_by_group = _get_frames(template, frame_keys, group_keys, paths)
+    all_frames = set().union(*frames_by_group.values())
+    check.frames = (min(all_frames), max(all_frames)) if all_frames else None
+
+    # frames of the version currently loaded, whose eyes the target should have
+    # too, and whose frames as well if required
+    current_by_group = {}
+    current_fields = target.get("current_fields")
+    if current_fields and (group_keys or require_current_frames):
+        current_by_group = _get_frames(
+            template,
+            frame_keys,
+            group_keys,
+            _list_files(tk, template, current_fields, skip_keys),
+        )
+
+    missing_by_group = {}
+    for group in set(frames_by_group).union(current_by_group):
+        frames = frames_by_group.get(group)
+        expected = set()
+        if require_current_frames or frames is None:
+            expected.update(current_by_group.get(group, ()))
+        if frames:
+            # no gaps in the range of the target
+            expected.update(range(min(frames), max(frames) + 1))
+        if frames is None or expected - frames:
+            missing_by_group[group] = sorted(expected - (frames or set()))
+
+    if missing_by_group:
+        check.status = INCOMPLETE
+        check.missing_frames = sorted(set().union(*missing_by_group.values()))
+        check.message = "%d frames missing from %s" % (
+            sum(len(m) for m in missing_by_group.values()),
+            target["path"],
+        )
+        if group_keys:
+            check.message += " (%s)" % ", ".join(
+                "%s: %s"
+                % (
+                    _format_group(group),
+                    len(missing) if group in frames_by_group else "no files",
+                )
+                for (group, missing) in sorted(missing_by_group.items())
+            )
+        if require_current_frames and current_by_group:
+            check.message += ", at least the frames of the current version required"
+
+
+def _get_frame_keys(template):
+    """
+    :returns: Names of the frame keys of the template, e.g. SEQ
+    """
+    return sorted(
+        name
+        for (name, key) in template.keys.items()
+        if key.is_abstract and isinstance(key, SequenceKey)
+    )
+
+
+def _get_group_keys(template, fields):
+    """
+    :returns: Names of the other keys whose value varies between the files of
+              a version, e.g. eye with a %V value
+    """
+    # the eye isn't abstract in the default configs, but is normalized like
+    # the abstract keys
+    return sorted(
+        name
+        for (name, key) in template.keys.items()
+        if (key.is_abstract or name == "eye")
+        and not isinstance(key, SequenceKey)
+        and not is_concrete(fields.get(name))
+    )
+
+
+def _list_files(tk, template, fields, skip_keys):
+    """
+    :returns: All the files of the version designated by the fields, i.e. all
+              frames and eyes
+    """
+    fields = dict((k, v) for (k, v) in fields.items() if k not in skip_keys)
+    return tk.paths_from_template(template, fields, skip_keys=skip_keys)
+
+
+def _get_frames(template, frame_keys, group_keys, paths):
+    """
+    :returns: Dictionary of the frame numbers of the given paths, by tuple of
+              the values of the group keys, e.g. (("eye", "Left"),)
+    """
+    frames_by_group = {}
+    for path in paths:
+        fields = template.get_fields(path)
+        group = tuple((key_name, fields.get(key_name)) for key_name in group_keys)
+        frames = frames_by_group.setdefault(group, set())
+        for key_name in frame_keys:
+            if isinstance(fields.get(key_name), int):
+                frames.add(fields[key_name])
+    return frames_by_group
+
+
+def _format_group(group):
+    """
+    :returns: Description of a group of files, e.g. eye=Left
+    """
+    return " ".join("%s=%s" % (key_name, value) for (key_name, value) in group)
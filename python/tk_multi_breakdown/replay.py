@@ -0,0 +1,466 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Capture and replay of the inputs of the breakdown.
+
+The breakdown depends on the scene scanned in the DCC, on the publishes found
+in Shotgun and on the files found on disk when resolving the highest versions.
+All of these inputs go through call(), which runs them as usual unless a
+capture or a replay is in progress:
+
+- When capturing, the result and the duration of each call are recorded and
+  written to a gzipped JSON lines archive by flush(). Captures are enabled by
+  the capture_path setting of the app, or by setting the
+  TK_MULTI_BREAKDOWN_CAPTURE environment variable to the archive path.
+
+- When replaying, the results are read from an archive instead, after waiting
+  for as long as the recorded calls took, so that the breakdown can be
+  profiled offline with realistic timings::
+
+      with replay.replaying("/tmp/breakdown_capture.jsonl.gz"):
+          items = app.analyze_scene()
+
+  The replay_scene method of the app also runs the version hook for each
+  item, and the module can be run to replay an archive without a DCC::
+
+      python -m tk_multi_breakdown.replay --config /path/to/config capture.jsonl.gz
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+from sgtk import TankError
+
+# environment variable enabling the capture regardless of the app settings
+CAPTURE_ENV_VAR = "TK_MULTI_BREAKDOWN_CAPTURE"
+
+# version of the archive format
+ARCHIVE_VERSION = 1
+
+# kinds of inputs
+SCAN = "scan"
+FIND_PUBLISH = "find_publish"
+FIND_PUBLISH_DETAILS = "find_publish_details"
+LIST_VERSIONS = "list_versions"
+STAT = "stat"
+
+# the capture or replay in progress, if any
+g_session = None
+g_session_lock = threading.Lock()
+
+
+class ReplayError(TankError):
+    """
+    Raised when replaying an input which is missing from the archive.
+    """
+
+
+def call(kind, key, fn):
+    """
+    Runs an input of the breakdown, recording or replaying it if a capture or
+    a replay is in progress.
+
+    :param str kind: Kind of input, e.g. FIND_PUBLISH
+    :param key: JSON serializable arguments identifying the input, e.g. the
+                list of paths looked up
+    :param fn: Function computing the input when it isn't replayed
+    :returns: The result of the function, or the replayed result
+    """
+    session = g_session
+    if session is None:
+        return fn()
+    return session.call(kind, key, fn)
+
+
+def _encode_key(key):
+    return json.dumps(key, sort_keys=True, default=str)
+
+
+class Recorder(object):
+    """
+    Records the inputs of the breakdown along with the time they took.
+    """
+
+    def __init__(self, archive_path):
+        """
+        :param str archive_path: Path of the archive written by save
+        """
+        self.archive_path = archive_path
+        self._records = []
+        self._num_saved = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        :returns: Number of inputs recorded, saved or not
+        """
+        return self._num_saved + len(self._records)
+
+    def call(self, kind, key, fn):
+        start = time.time()
+        result = fn()
+        duration = time.time() - start
+        with self._lock:
+            self._records.append(
+                {
+                    "kind": kind,
+                    # copied, as the arguments may change after the call
+                    "key": json.loads(_encode_key(key)),
+                    "result": result,
+                    "duration": round(duration, 6),
+                }
+            )
+        return result
+
+    def save(self):
+        """
+        Writes the inputs recorded since the previous save to the archive, and
+        forgets them. The first save writes a new archive next to its
+        destination and moves it in place, the following ones append to it.
+        """
+        # imported here, only captures use it
+        import gzip
+
+        with self._lock:
+            (records, self._records) = (self._records, [])
+            new = self._num_saved == 0
+            self._num_saved += len(records)
+
+            if new:
+                folder = os.path.dirname(self.archive_path)
+                if folder and not os.path.exists(folder):
+                    os.makedirs(folder)
+                tmp_path = "%s.%d.tmp" % (self.archive_path, os.getpid())
+                with gzip.open(tmp_path, "wt") as fh:
+                    fh.write(
+                        json.dumps({"version": ARCHIVE_VERSION, "created": time.time()})
+                        + "\n"
+                    )
+                    self._write_records(fh, records)
+                os.replace(tmp_path, self.archive_path)
+            elif records:
+                # gzip members appended to a file are read back as one stream
+                with gzip.open(self.archive_path, "at") as fh:
+                    self._write_records(fh, records)
+
+    def _write_records(self, fh, records):
+        for record in records:
+            fh.write(json.dumps(record, default=str) + "\n")
+
+
+class Player(object):
+    """
+    Replays the inputs recorded in an archive.
+
+    Shotgun lookups are answered path by path and publish by publish from all
+    the recorded queries, since the queries sent depend on what is already
+    cached. Each call waits for the time the recorded query for the same
+    arguments took, or for the median time of the queries of the same kind.
+    Scans are replayed in the order they were recorded, and disk lookups are
+    matched by arguments.
+    """
+
+    def __init__(self, archive_path, speed=1.0):
+        """
+        :param str archive_path: Path of an archive written by a Recorder
+        :param float speed: Factor applied to the recorded durations, e.g. 0
+                            to replay as fast as possible
+        """
+        self.archive_path = archive_path
+        self.speed = speed
+        self._scans = []
+        self._scan_index = 0
+        self._publishes = {}
+        self._publish_details = {}
+        self._results = {}
+        self._durations = {}
+        self._median_durations = {}
+        self._lock = threading.Lock()
+        self._load(archive_path)
+
+    def call(self, kind, key, fn):
+        encoded_key = _encode_key(key)
+        duration = self._durations.get((kind, encoded_key))
+        if duration is None:
+            duration = self._median_durations.get(kind, 0)
+        if duration and self.speed:
+            time.sleep(duration * self.speed)
+
+        if kind == SCAN:
+            with self._lock:
+                if not self._scans:
+                    raise ReplayError("No scene scan in %s" % self.archive_path)
+                scan = self._scans[min(self._scan_index, len(self._scans) - 1)]
+                self._scan_index += 1
+            return [dict(scene_object) for scene_object in scan]
+
+        if kind == FIND_PUBLISH:
+            return dict(
+                (path, self._publishes[path]) for path in key if path in self._publishes
+            )
+
+        if kind == FIND_PUBLISH_DETAILS:
+            (entity_type, ids) = key
+            return [
+                self._publish_details[(entity_type, i)]
+                for i in ids
+                if (entity_type, i) in self._publish_details
+            ]
+
+        if (kind, encoded_key) not in self._results:
+            if kind == STAT:
+                return False
+            raise ReplayError(
+                "No %s input for %s in %s" % (kind, encoded_key, self.archive_path)
+            )
+        return self._results[(kind, encoded_key)]
+
+    def _load(self, archive_path):
+        # imported here, only replays use them
+        import gzip
+        import statistics
+
+        durations_by_kind = {}
+        with gzip.open(archive_path, "rt") as fh:
+            header = json.loads(fh.readline())
+            if header.get("version") != ARCHIVE_VERSION:
+                raise ReplayError(
+                    "Unsupported breakdown capture archive %s." % archive_path
+                )
+            for line in fh:
+                record = json.loads(line)
+                (kind, key, result) = (record["kind"], record["key"], record["result"])
+                encoded_key = _encode_key(key)
+                self._durations[(kind, encoded_key)] = record["duration"]
+                durations_by_kind.setdefault(kind, []).append(record["duration"])
+
+                if kind == SCAN:
+                    self._scans.append(result)
+                elif kind == FIND_PUBLISH:
+                    self._publishes.update(result)
+                elif kind == FIND_PUBLISH_DETAILS:
+                    for sg_publish in result:
+                        self._publish_details[(key[0], sg_publish["id"])] = sg_publish
+                else:
+                    self._results[(kind, encoded_key)] = result
+
+        for (kind, durations) in durations_by_kind.items():
+            self._median_durations[kind] = statistics.median(durations)
+
+
+def is_replaying():
+    """
+    :returns: True if a replay is in progress, in which case the caches shared
+              across sessions shouldn't be used, so that the replay only
+              depends on the archive
+    """
+    return isinstance(g_session, Player)
+
+
+def is_capturing():
+    """
+    :returns: True if a capture is in progress, in which case the caches
+              shouldn't be used either, so that all the inputs are recorded
+    """
+    return isinstance(g_session, Recorder)
+
+
+def start_capture(archive_path):
+    """
+    Starts recording the inputs of the breakdown, unless a capture or a
+    replay is already in progress.
+
+    :param str archive_path: Path of the archive to write
+    :returns: The Recorder in progress
+    """
+    global g_session
+    with g_session_lock:
+        if g_session is None:
+            g_session = Recorder(archive_path)
+        return g_session
+
+
+def stop_capture():
+    """
+    Stops recording and writes the archive.
+
+    :returns: The path of the archive written, or None if no capture was in
+              progress
+    """
+    global g_session
+    with g_session_lock:
+        session = g_session
+        if not isinstance(session, Recorder):
+            return None
+        g_session = None
+    session.save()
+    return session.archive_path
+
+
+@contextlib.contextmanager
+def replaying(archive_path, speed=1.0):
+    """
+    Context manager replaying the inputs recorded in the given archive.
+
+    :param str archive_path: Path of the archive to replay
+    :param float speed: Factor applied to the recorded durations
+    :returns: The Player
+    """
+    global g_session
+    player = Player(archive_path, speed=speed)
+    with g_session_lock:
+        if g_session is not None:
+            raise TankError("A breakdown capture or replay is already in progress.")
+        g_session = player
+    try:
+        yield player
+    finally:
+        with g_session_lock:
+            g_session = None
+
+
+def configure(app):
+    """
+    Starts a capture if the app settings or the environment ask for it.
+
+    :param app: The breakdown app
+    """
+    archive_path = os.environ.get(CAPTURE_ENV_VAR) or app.get_setting("capture_path")
+    if archive_path and g_session is None:
+        start_capture(archive_path)
+
+
+def flush(app):
+    """
+    Writes the inputs captured so far, if a capture is in progress.
+
+    :param app: The breakdown app
+    """
+    session = g_session
+    if not isinstance(session, Recorder):
+        return
+    try:
+        session.save()
+    except Exception as e:
+        app.log_warning("Failed to write the breakdown capture: %s" % e)
+        return
+    app.log_debug(
+        "Breakdown capture written to %s (%d inputs)."
+        % (session.archive_path, len(session))
+    )
+
+
+def replay_items(tk, archive_path, speed=1.0, probe_templates=None):
+    """
+    Replays a captured breakdown without an engine: the scene objects are
+    matched against the templates, looked up as publishes and resolved to
+    their highest version with the app's default logic.
+
+    :param tk: Toolkit API instance of the configuration the archive was
+               captured with
+    :param str archive_path: Path of the archive to replay
+    :param float speed: Factor applied to the recorded durations
+    :param probe_templates: Template names or patterns to resolve with the
+                            probing strategy, see the probe_version_templates
+                            setting
+    :returns: List of breakdown items, with an extra latest_version key which
+              is None if no version could be found
+    """
+    from . import breakdown
+    from . import versions
+
+    with replaying(archive_path, speed=speed):
+        scene_objects = call(SCAN, None, lambda: [])
+        items = breakdown.resolve_scene_objects(tk, scene_objects)
+        # the caches of this process are left out, as when capturing
+        details_cache = {}
+        breakdown.fetch_publish_data(
+            tk, items, {}, details=True, details_cache=details_cache
+        )
+        breakdown.add_publish_details(tk, items, cache=details_cache)
+        for item in items:
+            try:
+                item["latest_version"] = versions.get_highest_version(
+                    tk,
+                    item["template"],
+                    item["fields"],
+                    strategy=versions.get_search_strategy(
+                        item["template"], probe_templates
+                    ),
+                )
+            except TankError:
+                item["latest_version"] = None
+    return items
+
+
+def main(argv=None):
+    """
+    Command line entry point, replaying an archive and printing a timing
+    summary of the breakdown phases.
+
+    :param argv: List of command line arguments, defaults to sys.argv
+    :returns: Process exit code
+    """
+    import argparse
+
+    import sgtk
+
+    from . import timing
+
+    parser = argparse.ArgumentParser(
+        description="Replays a captured breakdown offline."
+    )
+    parser.add_argument("archive", help="Archive written by a capture.")
+    parser.add_argument(
+        "--config", required=True, help="Path to the pipeline configuration."
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Factor applied to the recorded durations, 0 to replay as fast "
+        "as possible.",
+    )
+    parser.add_argument(
+        "--probe-templates",
+        nargs="*",
+        default=[],
+        help="Templates to resolve with the probing strategy.",
+    )
+    parser.add_argument(
+        "--trace", help="Chrome trace event file to write the timings to."
+    )
+    args = parser.parse_args(argv)
+
+    tk = sgtk.sgtk_from_path(args.config)
+
+    timing.enable()
+    start = time.time()
+    items = replay_items(
+        tk, args.archive, speed=args.speed, probe_templates=args.probe_templates
+    )
+    spans = timing.get_spans()
+
+    sys.stdout.write(
+        "%d items replayed in %.3fs: %s\n"
+        % (len(items), time.time() - start, timing.get_summary(spans))
+    )
+    if args.trace:
+        timing.export_chrome_trace(spans, args.trace)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -27,11 +27,21 @@ class SceneBrowserWidget(browser_widget.BrowserWidget):
     _item_work_completed = QtCore.Signal(str, object)
     _item_work_failed = QtCore.Signal(str, str)
 
+    # number of publishes whose details are fetched together by the list items
+    DETAILS_BATCH_SIZE = 50
+
     def __init__(self, parent=None):
         browser_widget.BrowserWidget.__init__(self, parent)
 
+        # publish data of the items, in display order, and the position of
+        # each publish in that list, by (type, id)
+        self._publishes = []
+        self._publish_positions = {}
+
     def get_data(self, data):
-        items = breakdown.get_breakdown_items()
+        # the publish details are only fetched as the list items need them,
+        # see get_publish_details
+        items = breakdown.get_breakdown_items(details=False)
         return {
             "items": items,
             "show_red": data["show_red"],
@@ -55,8 +65,34 @@ class SceneBrowserWidget(browser_widget.BrowserWidget):
             lambda uid, msg: self._item_work_failed.emit(uid, msg)
         )
 
+    def get_publish_details(self, sg_data):
+        """
+        Returns the given publish data completed with its details. The details
+        of the publishes displayed after this one are fetched at the same time,
+        so that the list items, which compute their status in display order,
+        find theirs in the cache. This is run in a worker thread.
+
+        :param dict sg_data: Publish data of a list item
+        :returns: Publish data dictionary including the publish details
+        """
+        position = self._publish_positions.get((sg_data["type"], sg_data["id"]), 0)
+        batch = [sg_data] + self._publishes[
+            position + 1 : position + self.DETAILS_BATCH_SIZE
+        ]
+        details = breakdown.fetch_publish_details(self._app.sgtk, batch)
+
+        complete_sg_data = dict(sg_data)
+        complete_sg_data.update(
+            details.get((sg_data["type"], sg_data["id"]))
+            or dict.fromkeys(breakdown.PUBLISH_DETAIL_FIELDS)
+        )
+        return complete_sg_data
+
     def process_result(self, result):
 
+        self._publishes = []
+        self._publish_positions = {}
+
         if len(result.get("items")) == 0:
             self.set_message("No versioned data in your scene!")
             return
@@ -116,6 +152,13 @@ class SceneBrowserWidget(browser_widget.BrowserWidget):
                 # item has a publish in sg
                 i = self.add_item(BreakdownListItem)
 
+                # remember the display order of the publishes
+                if d.get("sg_data"):
+                    key = (d["sg_data"]["type"], d["sg_data"]["id"])
+                    if key not in self._publish_positions:
+                        self._publish_positions[key] = len(self._publishes)
+                        self._publishes.append(d["sg_data"])
+
                 # provide a limited amount of data for receivers via the
                 # data dictionary on
                 # the item object
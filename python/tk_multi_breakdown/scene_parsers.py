@@ -0,0 +1,295 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Offline scene file parsers.
+
+These parsers extract the same {node, type, path} records as the scan_scene
+method of the scene operations hooks, straight from the scene files and
+without a running DCC. Files are read line by line and only the statements
+of interest are kept in memory, so memory use doesn't grow with file size.
+"""
+
+import os
+import re
+
+from sgtk import TankError
+
+# matches double quoted MEL strings or bare words
+MEL_TOKEN_REGEX = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+# matches the copy number maya appends to paths referenced several times
+COPY_NUMBER_REGEX = re.compile(r"\{\d+\}$")
+
+# maya node types handled as file texture nodes
+MAYA_FILE_NODE_TYPES = ("file", "psdFileTex")
+
+# maya attribute names holding the texture path of file nodes
+MAYA_FILE_TEXTURE_ATTRS = ('".ftn"', '".fileTextureName"')
+
+# matches the first line of a nuke node, e.g "Read {"
+NUKE_NODE_REGEX = re.compile(r"^([A-Za-z_]\w*) \{$")
+
+# nuke node classes with a file knob handled by the breakdown
+NUKE_NODE_CLASSES = ("Read", "ReadGeo2", "Camera2")
+
+# nuke node classes whose content is saved in the script
+NUKE_GROUP_CLASSES = ("Group", "LiveGroup")
+
+
+def scan_scene_file(scene_path):
+    """
+    Extracts scene objects from a scene file without a running DCC.
+
+    Maya ASCII and Nuke scripts are parsed to return the same records as the
+    Maya and Nuke scene operations hooks. Other scene files, e.g. Maya binary
+    or Houdini files, can't be parsed.
+
+    :param str scene_path: Path to the scene file to scan
+    :returns: Generator of dictionaries with node, type and path keys
+    :raises TankError: If the file isn't a Maya ASCII or a Nuke scene file
+    """
+    extension = os.path.splitext(scene_path)[1].lower()
+    parser = SCENE_PARSERS.get(extension)
+    if parser is None:
+        raise TankError(
+            "Can't parse scene file %s, only %s files are supported."
+            % (scene_path, " and ".join(sorted(SCENE_PARSERS)))
+        )
+    return parser(scene_path)
+
+
+def parse_maya_ascii(scene_path):
+    """
+    Extracts the top level references and the file texture nodes of a Maya
+    ASCII file, on the same form as the Maya scene operations hook.
+
+    Referenced file nodes are defined in the referenced files rather than in
+    the scene itself, so only the file nodes of the scene are returned.
+
+    :param str scene_path: Path to the .ma file
+    :returns: Generator of dictionaries with node, type and path keys
+    """
+    # the file node being defined, if any, as a [name, path] list
+    file_node = None
+
+    for statement in _iter_mel_statements(scene_path):
+
+        if not statement.startswith(("\t", " ")):
+            # a new top level command ends the definition of the current node
+            if file_node:
+                yield _maya_file_node_item(*file_node)
+                file_node = None
+
+            tokens = _tokenize_mel(statement)
+            if tokens[0] == "file" and "-r" in tokens:
+                # top level reference: file -r ... -rfn "fooRN" ... "path";
+                path = COPY_NUMBER_REGEX.sub("", tokens[-1])
+                node_name = _get_mel_flag(tokens, "-rfn")
+                yield {
+                    "node": node_name,
+                    "type": "reference",
+                    "path": path.replace("/", os.path.sep),
+                }
+
+            elif tokens[0] == "createNode" and tokens[1] in MAYA_FILE_NODE_TYPES:
+                file_node = [_get_mel_flag(tokens, "-n"), ""]
+
+        elif file_node and statement.lstrip().startswith("setAttr"):
+            tokens = _tokenize_mel(statement)
+            if tokens[1] in MAYA_FILE_TEXTURE_ATTRS:
+                file_node[1] = tokens[-1]
+
+    if file_node:
+        yield _maya_file_node_item(*file_node)
+
+
+def parse_nuke_script(scene_path):
+    """
+    Extracts the read, read geometry and camera nodes of a Nuke script, on
+    the same form as the Nuke scene operations hook. Nodes inside groups are
+    addressed by their full name, e.g. Group1.Read1.
+
+    :param str scene_path: Path to the .nk file
+    :returns: Generator of dictionaries with node, type and path keys
+    """
+    # names of the groups the current node is nested in
+    group_stack = []
+
+    # the node being parsed, if any, as a dictionary of knobs of interest
+    node = None
+    node_class = None
+    brace_depth = 0
+
+    with open(scene_path, "rt", errors="replace") as scene_file:
+        for line in scene_file:
+            line = line.strip()
+
+            if node is None:
+                match = NUKE_NODE_REGEX.match(line)
+                if match:
+                    node_class = match.group(1)
+                    node = {}
+                    brace_depth = 0
+                elif line == "end_group" and group_stack:
+                    group_stack.pop()
+                continue
+
+            if brace_depth == 0 and line == "}":
+                # end of the node
+                name = node.get("name")
+                if node_class in NUKE_NODE_CLASSES and name:
+                    yield {
+                        "node": ".".join(group_stack + [name]),
+                        "type": node_class,
+                        "path": node.get("file", "").replace("/", os.path.sep),
+                    }
+                elif node_class in NUKE_GROUP_CLASSES and name:
+                    # the nodes that follow are inside this group
+                    group_stack.append(name)
+                node = None
+                continue
+
+            if brace_depth == 0:
+                (knob, _, value) = line.partition(" ")
+                if knob in ("name", "file"):
+                    node[knob] = _parse_tcl_value(value)
+
+            brace_depth += _brace_delta(line)
+
+
+def _iter_mel_statements(scene_path):
+    """
+    Yields the MEL statements of interest of a Maya ASCII file.
+
+    Statements can span several lines. Only the first line of statements
+    which can't be of interest is kept, the rest is skipped, so that large
+    data statements are never held in memory.
+
+    :param str scene_path: Path to the .ma file
+    :returns: Generator of statement strings
+    """
+    statement_lines = []
+    keep = False
+
+    with open(scene_path, "rt", errors="replace") as scene_file:
+        for line in scene_file:
+
+            if not statement_lines:
+                stripped = line.lstrip()
+                keep = stripped.startswith(("file ", "createNode ", 'setAttr ".ftn'))
+                keep = keep or stripped.startswith('setAttr ".fileTextureName"')
+                statement_lines.append(line.rstrip("\n"))
+            elif keep:
+                statement_lines.append(line.strip())
+
+            if line.rstrip().endswith(";"):
+                yield " ".join(statement_lines)
+                statement_lines = []
+
+        if statement_lines:
+            yield " ".join(statement_lines)
+
+
+def _tokenize_mel(statement):
+    """
+    Splits a MEL statement into words and unescaped strings.
+
+    :param str statement: MEL statement
+    :returns: List of tokens, quoted strings are returned with their quotes
+              except for the last token which is always unquoted
+    """
+    statement = statement.strip().rstrip(";")
+    tokens = []
+    for match in MEL_TOKEN_REGEX.finditer(statement):
+        if match.group(1) is not None:
+            tokens.append('"%s"' % _unescape(match.group(1)))
+        else:
+            tokens.append(match.group(2))
+    if tokens and tokens[-1].startswith('"'):
+        tokens[-1] = tokens[-1][1:-1]
+    return tokens or [""]
+
+
+def _get_mel_flag(tokens, flag):
+    """
+    :param tokens: Tokens of a MEL statement
+    :param str flag: Flag to get the value of, e.g. -n
+    :returns: The unquoted value of the flag, or None if not found
+    """
+    if flag not in tokens:
+        return None
+    index = tokens.index(flag) + 1
+    if index >= len(tokens):
+        return None
+    return tokens[index].strip('"')
+
+
+def _maya_file_node_item(name, path):
+    """
+    :returns: Scene object dictionary for a maya file texture node
+    """
+    return {"node": name, "type": "file", "path": path.replace("/", os.path.sep)}
+
+
+def _parse_tcl_value(value):
+    """
+    Returns the string held by a nuke knob value, which can be a bare word,
+    a double quoted string or a brace quoted string.
+
+    :param str value: Knob value as stored in the script
+    :returns: String value
+    """
+    value = value.strip()
+    if value.startswith('"') and value.endswith('"') and len(value) > 1:
+        return _unescape(value[1:-1])
+    if value.startswith("{") and value.endswith("}"):
+        return value[1:-1]
+    return value
+
+
+def _unescape(value):
+    """
+    Removes backslash escapes from a quoted string.
+    """
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+def _brace_delta(line):
+    """
+    Returns the number of braces opened minus the number of braces closed in
+    a line of a nuke script, ignoring escaped and double quoted braces.
+
+    :param str line: Line to count braces in
+    :returns: Brace balance of the line
+    """
+    delta = 0
+    in_quotes = False
+    escaped = False
+    for char in line:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            in_quotes = not in_quotes
+        elif not in_quotes:
+            if char == "{":
+                delta += 1
+            elif char == "}":
+                delta -= 1
+    return delta
+
+
+# parsers by scene file extension
+SCENE_PARSERS = {
+    ".ma": parse_maya_ascii,
+    ".nk": parse_nuke_script,
+}
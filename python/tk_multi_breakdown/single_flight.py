@@ -0,0 +1,133 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Coalescing of concurrent identical lookups.
+
+The breakdown runs its publish and version lookups from the browser worker
+thread, while API callers may run the same lookups from other threads at the
+same time. A SingleFlight makes sure that only one of them runs a given
+lookup, the others waiting for its result instead of issuing the same query
+or disk scan.
+"""
+
+import threading
+
+
+class _Call(object):
+    """
+    A lookup in flight, which other callers can wait on.
+    """
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight(object):
+    """
+    Runs a function at most once at a time per key. Callers arriving while
+    the function runs for their key wait for it and share its result, or its
+    exception. Nothing is cached once the call is over, caching is left to
+    the callers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs), unless a call for the same key is already
+        in flight, in which case its result is returned instead.
+
+        :param key: Hashable key identifying the lookup
+        :param fn: Function performing the lookup
+        :returns: The result of the function
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            return call.wait()
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def do_batch(self, keys, fn):
+        """
+        Runs a batched lookup for the keys which are not in flight already,
+        and waits for the other keys to be looked up by the calls running
+        them.
+
+        :param keys: Iterable of hashable keys to look up
+        :param fn: Function taking a list of keys and returning a dictionary
+                   of key -> result. Keys missing from the dictionary have no
+                   result.
+        :returns: Dictionary of key -> result for all keys with a result
+        """
+        own_calls = {}
+        other_calls = {}
+        with self._lock:
+            for key in keys:
+                if key in own_calls or key in other_calls:
+                    continue
+                call = self._calls.get(key)
+                if call is None:
+                    call = _Call()
+                    self._calls[key] = call
+                    own_calls[key] = call
+                else:
+                    other_calls[key] = call
+
+        results = {}
+        if own_calls:
+            try:
+                results = fn(list(own_calls))
+            except BaseException as e:
+                for call in own_calls.values():
+                    call.error = e
+                raise
+            finally:
+                with self._lock:
+                    for key in own_calls:
+                        del self._calls[key]
+                for (key, call) in own_calls.items():
+                    call.result = results.get(key)
+                    call.done.set()
+
+        results = dict(results)
+        for (key, call) in other_calls.items():
+            result = call.wait()
+            if result is not None:
+                results[key] = result
+        return results
@@ -0,0 +1,206 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Breakdown snapshots, which store the result of a breakdown in a file so that
+farm jobs and downstream tools can use it without scanning the scene again.
+
+A snapshot is a JSON lines file, gzipped if its name ends with .gz. The first
+line is a header, followed by one line per item::
+
+    {"format": "tk-multi-breakdown-snapshot", "version": 1, "scene": "/.../lighting.v012.ma",
+     "created": 1700000000.0}
+    {"node_name": "chairRN", "node_type": "reference", "template": "maya_asset_publish",
+     "fields": {...}, "sg_data": {...}, "latest_version": 14}
+
+Items hold the template name rather than the template object, and the publish
+data as trimmed by trim_sg_data. Snapshots are read one line at a time, and
+the template objects are only looked up when an item's template is accessed.
+"""
+
+import gzip
+import json
+import os
+import time
+from collections.abc import Mapping
+
+from sgtk import TankError
+
+# identifies snapshot files
+SNAPSHOT_FORMAT = "tk-multi-breakdown-snapshot"
+
+# version of the snapshot format
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotItem(Mapping):
+    """
+    Breakdown item read from a snapshot, with the same keys as the items
+    returned by analyze_scene plus latest_version. The template object is
+    looked up by name on first access.
+    """
+
+    KEYS = (
+        "node_name",
+        "node_type",
+        "template",
+        "fields",
+        "sg_data",
+        "latest_version",
+    )
+
+    __slots__ = (
+        "node_name",
+        "node_type",
+        "template_name",
+        "fields",
+        "sg_data",
+        "latest_version",
+        "_templates",
+        "_template",
+    )
+
+    def __init__(self, data, templates=None):
+        """
+        :param dict data: Item as stored in a snapshot
+        :param templates: Optional dictionary of template name -> template
+                          object, e.g. tk.templates
+        """
+        self.node_name = data["node_name"]
+        self.node_type = data["node_type"]
+        self.template_name = data["template"]
+        self.fields = data["fields"]
+        self.sg_data = data.get("sg_data")
+        self.latest_version = data.get("latest_version")
+        self._templates = templates
+        self._template = None
+
+    @property
+    def template(self):
+        """
+        Template object of the item, or None if no templates were given or the
+        template doesn't exist in them
+        """
+        if self._template is None and self._templates is not None:
+            self._template = self._templates.get(self.template_name)
+        return self._template
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return "<SnapshotItem %s %s>" % (self.node_type, self.node_name)
+
+
+class Snapshot(object):
+    """
+    Breakdown snapshot file, read lazily. Iterating over a snapshot reads its
+    items one by one, so that large snapshots are processed in constant
+    memory.
+    """
+
+    def __init__(self, path, templates=None):
+        """
+        :param str path: Path of the snapshot file
+        :param templates: Optional dictionary of template name -> template
+                          object to attach to the items, e.g. tk.templates
+        :raises TankError: If the file is not a breakdown snapshot
+        """
+        self.path = path
+        self._templates = templates
+        with _open(path, "rt") as fh:
+            self.header = _read_header(fh, path)
+
+    @property
+    def scene_path(self):
+        """
+        Path of the scene the snapshot was taken of, or None
+        """
+        return self.header.get("scene")
+
+    def __iter__(self):
+        with _open(self.path, "rt") as fh:
+            _read_header(fh, self.path)
+            for line in fh:
+                if line.strip():
+                    yield SnapshotItem(json.loads(line), self._templates)
+
+
+def write_snapshot(path, items, scene_path=None):
+    """
+    Writes breakdown items to a snapshot file. The file is written next to its
+    destination and moved in place, so that it is never read half written.
+
+    :param str path: Path of the snapshot file, gzipped if it ends with .gz
+    :param items: Iterable of items as returned by analyze_scene, optionally
+                  with a latest_version key. Templates can be template
+                  objects or names.
+    :param str scene_path: Optional path of the scene the items come from
+    :returns: Number of items written
+    """
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    count = 0
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with _open(tmp_path, "wt", gzipped=path.endswith(".gz")) as fh:
+        header = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "scene": scene_path,
+            "created": time.time(),
+        }
+        fh.write(json.dumps(header) + "\n")
+        for item in items:
+            template = item["template"]
+            record = {
+                "node_name": item["node_name"],
+                "node_type": item["node_type"],
+                "template": getattr(template, "name", template),
+                "fields": item["fields"],
+                "sg_data": item["sg_data"],
+                "latest_version": item.get("latest_version"),
+            }
+            fh.write(json.dumps(record, default=str) + "\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def _open(path, mode, gzipped=None):
+    if gzipped is None:
+        gzipped = path.endswith(".gz")
+    if gzipped:
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _read_header(fh, path):
+    try:
+        header = json.loads(fh.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT:
+        raise TankError("%s is not a breakdown snapshot." % path)
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise TankError(
+            "Unsupported breakdown snapshot version %s in %s."
+            % (header.get("version"), path)
+        )
+    return header
@@ -0,0 +1,256 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS config (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS paths (
+    path TEXT PRIMARY KEY,
+    template TEXT,
+    fields TEXT,
+    updated REAL
+) WITHOUT ROWID;
+"""
+
+# version of the schema above, the paths table is recreated when it changes
+SCHEMA_VERSION = "2"
+
+# number of seconds paths matching no template are kept in the cache. Most
+# paths of a scene don't match any template, e.g. textures, so these entries
+# are expired rather than kept for as long as the configuration is the same.
+NEGATIVE_ENTRY_TTL = 7 * 24 * 3600
+
+# maximum number of paths looked up per query, below the SQLite limit of
+# query parameters
+LOOKUP_BATCH_SIZE = 500
+
+
+class TemplateCache(object):
+    """
+    Cache of the templates matching paths, and of the fields extracted from
+    them, stored in a local SQLite database so that the paths of a scene
+    are only matched against the templates the first time the scene is
+    opened.
+
+    The cache is only valid for the templates it was filled with, and is
+    emptied whenever it is opened with a different configuration hash, see
+    get_config_hash. Nothing is loaded in memory, paths are looked up in
+    batches as scenes are analyzed.
+
+    Paths matching no template are only kept for negative_ttl seconds, and
+    are removed from the database when it is opened once they have expired.
+
+    A connection is opened per operation, so that the cache can be used from
+    any thread and written to by several processes at once.
+    """
+
+    def __init__(self, db_path, config_hash, negative_ttl=NEGATIVE_ENTRY_TTL):
+        """
+        :param str db_path: Path to the SQLite database file. It is created
+                            if it doesn't exist.
+        :param str config_hash: Hash of the templates the cache is for
+        :param float negative_ttl: Number of seconds paths matching no template
+                                   are kept for
+        """
+        self._db_path = db_path
+        self._config_hash = config_hash
+        self._negative_ttl = negative_ttl
+
+        db_folder = os.path.dirname(db_path)
+        if db_folder and not os.path.exists(db_folder):
+            os.makedirs(db_folder)
+
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            with connection:
+                if self._get_config(connection, "schema") != SCHEMA_VERSION:
+                    # databases written by a previous version of the app
+                    connection.execute("DROP TABLE paths")
+                    connection.executescript(_SCHEMA)
+                    self._set_config(connection, "schema", SCHEMA_VERSION)
+                    self._set_config(connection, "hash", None)
+
+                if self._get_config(connection, "hash") != config_hash:
+                    connection.execute("DELETE FROM paths")
+                    self._set_config(connection, "hash", config_hash)
+                else:
+                    connection.execute(
+                        "DELETE FROM paths WHERE template IS NULL AND updated < ?",
+                        (time.time() - negative_ttl,),
+                    )
+        finally:
+            connection.close()
+
+    @property
+    def db_path(self):
+        """
+        Path to the SQLite database file
+        """
+        return self._db_path
+
+    @property
+    def config_hash(self):
+        """
+        Hash of the templates the cache is for
+        """
+        return self._config_hash
+
+    def get_many(self, paths):
+        """
+        Looks up the given paths.
+
+        :param paths: List of paths
+        :returns: Dictionary of path -> (template name, fields) for the paths
+                  found. Paths matching no template, or a template without a
+                  version, are returned with a None template name and fields.
+        """
+        results = {}
+        expired = time.time() - self._negative_ttl
+        connection = self._connect()
+        try:
+            for i in range(0, len(paths), LOOKUP_BATCH_SIZE):
+                chunk = paths[i : i + LOOKUP_BATCH_SIZE]
+                rows = connection.execute(
+                    "SELECT path, template, fields, updated FROM paths WHERE path IN (%s)"
+                    % ", ".join("?" * len(chunk)),
+                    chunk,
+                )
+                for (path, template_name, fields, updated) in rows:
+                    if template_name is None and updated < expired:
+                        continue
+                    results[path] = (
+                        template_name,
+                        json.loads(fields) if fields is not None else None,
+                    )
+        finally:
+            connection.close()
+        return results
+
+    def put_many(self, entries):
+        """
+        Stores the templates matching the given paths.
+
+        :param dict entries: Dictionary of path -> (template name, fields), with
+                             a None template name and fields for the paths
+                             matching no template. Entries whose fields are not
+                             JSON serializable are skipped.
+        """
+        rows = []
+        now = time.time()
+        for (path, (template_name, fields)) in entries.items():
+            try:
+                fields = (
+                    json.dumps(fields, sort_keys=True) if fields is not None else None
+                )
+            except (TypeError, ValueError):
+                # e.g. timestamps, which would not be read back as such
+                continue
+            rows.append((path, template_name, fields, now))
+
+        if not rows:
+            return
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO paths (path, template, fields, updated) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+        finally:
+            connection.close()
+
+    def clear(self):
+        """
+        Removes all paths from the cache.
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM paths")
+        finally:
+            connection.close()
+
+    def _get_config(self, connection, name):
+        """
+        :returns: The value of the given row of the config table, or None
+        """
+        row = connection.execute(
+            "SELECT value FROM config WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_config(self, connection, name, value):
+        connection.execute(
+            "INSERT OR REPLACE INTO config (name, value) VALUES (?, ?)", (name, value)
+        )
+
+    def _connect(self):
+        """
+        :returns: A new connection to the database
+        """
+        return sqlite3.connect(self._db_path, timeout=30)
+
+
+def get_config_hash(tk):
+    """
+    Returns a hash of the templates and roots of the given toolkit instance,
+    which changes whenever a template definition or key changes, so that
+    paths are matched again.
+
+    :param tk: Toolkit API instance
+    :returns: Hexadecimal hash string
+    """
+    digest = hashlib.sha1()
+    for (name, path) in sorted(tk.roots.items()):
+        digest.update(("root %s %s\n" % (name, path)).encode("utf-8"))
+
+    for (name, template) in sorted(tk.templates.items()):
+        digest.update(
+            (
+                "template %s %s %s\n"
+                % (name, template.__class__.__name__, template.definition)
+            ).encode("utf-8")
+        )
+        for (key_name, key) in sorted(template.keys.items()):
+            digest.update(
+                (
+                    "key %s %s %s\n"
+                    % (key_name, key.__class__.__name__, _get_key_settings(key))
+                ).encode("utf-8")
+            )
+    return digest.hexdigest()
+
+
+def _get_key_settings(key):
+    """
+    :returns: Stable string representation of the settings of a template key,
+              e.g. its choices, default value and format
+    """
+    settings = []
+    for (name, value) in sorted(vars(key).items()):
+        if isinstance(value, (str, int, float, bool, type(None), list, tuple, dict)):
+            try:
+                settings.append("%s=%s" % (name, json.dumps(value, sort_keys=True)))
+            except (TypeError, ValueError):
+                # values holding objects, whose repr isn't stable
+                pass
+    return " ".join(settings)
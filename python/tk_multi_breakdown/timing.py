@@ -0,0 +1,315 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Timing instrumentation of the breakdown phases.
+
+Phases are wrapped in spans which record their start time, duration, thread
+and a few counts::
+
+    with timing.span("find_publish", paths=len(paths)) as s:
+        sg_data = sgtk.util.find_publish(...)
+        s.set(found=len(sg_data))
+
+Timing is enabled by the enable_timing setting of the app or by setting the
+TK_MULTI_BREAKDOWN_TIMING environment variable to 1. When disabled, span()
+returns a shared no-op span and nothing is recorded.
+
+Recorded spans are written out by flush(), as a one line summary in the log
+and to a Chrome trace event file which can be loaded in chrome://tracing or
+https://ui.perfetto.dev. The trace file is started afresh by the first flush
+of a session, and later flushes append to it, so that it holds all the spans
+of the session.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+# environment variable enabling the timing regardless of the app settings
+TIMING_ENV_VAR = "TK_MULTI_BREAKDOWN_TIMING"
+
+# maximum number of spans kept in memory between two flushes
+MAX_SPANS = 100000
+
+# whether spans are recorded, see configure()
+g_enabled = False
+
+# spans recorded since the last flush, as tuples of
+# (name, start, duration, process id, thread id, args)
+g_spans = collections.deque(maxlen=MAX_SPANS)
+
+# spans are appended from the worker threads as well as the main thread
+g_lock = threading.Lock()
+
+# trace files written to by this session, which later flushes append to
+g_trace_paths = set()
+
+
+class _Span(object):
+    """
+    Context manager recording the duration of a phase.
+    """
+
+    __slots__ = ("_name", "_args", "_start")
+
+    def __init__(self, name, args):
+        self._name = name
+        self._args = args
+        self._start = None
+
+    def set(self, **args):
+        """
+        Adds counts or other values to the span, e.g. the number of items
+        processed in the phase.
+        """
+        self._args.update(args)
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.time() - self._start
+        if exc_type is not None:
+            self._args["error"] = exc_type.__name__
+        with g_lock:
+            g_spans.append(
+                (
+                    self._name,
+                    self._start,
+                    duration,
+                    os.getpid(),
+                    threading.current_thread().ident,
+                    self._args,
+                )
+            )
+        return False
+
+
+class _NullSpan(object):
+    """
+    Span returned when timing is disabled, which does nothing.
+    """
+
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **args):
+    """
+    Returns a context manager timing the phase it wraps.
+
+    :param str name: Name of the phase, e.g. find_publish
+    :param args: Counts or other JSON serializable values stored with the span
+    :returns: A span, which is a no-op if timing is disabled
+    """
+    if not g_enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def is_enabled():
+    """
+    :returns: True if spans are being recorded
+    """
+    return g_enabled
+
+
+def enable(enabled=True):
+    """
+    Turns the recording of spans on or off.
+
+    :param bool enabled: Whether spans should be recorded
+    """
+    global g_enabled
+    g_enabled = enabled
+
+
+def configure(app):
+    """
+    Enables timing if the app settings or the environment ask for it.
+
+    :param app: The breakdown app
+    """
+    enable(
+        bool(app.get_setting("enable_timing"))
+        or os.environ.get(TIMING_ENV_VAR, "0") not in ("", "0")
+    )
+
+
+def get_spans():
+    """
+    :returns: List of the spans recorded since the last flush, as
+              tuples of (name, start, duration, pid, tid, args)
+    """
+    with g_lock:
+        return list(g_spans)
+
+
+def clear():
+    """
+    Discards all recorded spans.
+    """
+    with g_lock:
+        g_spans.clear()
+
+
+def get_summary(spans):
+    """
+    Builds a one line summary of the given spans, with the total time and
+    the number of calls of each phase, slowest first, e.g.:
+
+    scan 1.204s (1), find_publish 0.310s (1, paths=120), version_lookup 2.101s (120)
+
+    Numeric span values, e.g. item counts, are summed up per phase.
+
+    :param spans: Spans as returned by get_spans
+    :returns: Summary string
+    """
+    totals = collections.OrderedDict()
+    for (name, _, duration, _, _, args) in spans:
+        total = totals.setdefault(name, [0.0, 0, collections.OrderedDict()])
+        total[0] += duration
+        total[1] += 1
+        for (key, value) in args.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total[2][key] = total[2].get(key, 0) + value
+
+    parts = []
+    for (name, (duration, calls, counts)) in sorted(
+        totals.items(), key=lambda t: -t[1][0]
+    ):
+        details = ", ".join(
+            [str(calls)] + ["%s=%s" % (key, value) for (key, value) in counts.items()]
+        )
+        parts.append("%s %.3fs (%s)" % (name, duration, details))
+    return ", ".join(parts)
+
+
+def export_chrome_trace(spans, path):
+    """
+    Writes the given spans as a Chrome trace event file.
+
+    :param spans: Spans as returned by get_spans
+    :param str path: Path of the JSON file to write
+    """
+    _make_folder(path)
+    with open(path, "wt") as fh:
+        json.dump(
+            {"traceEvents": _get_trace_events(spans), "displayTimeUnit": "ms"},
+            fh,
+            default=str,
+        )
+
+
+def append_chrome_trace(spans, path, new=False):
+    """
+    Appends the given spans to a Chrome trace event file in the JSON array
+    format, whose closing bracket is optional so that events can be added
+    without rewriting the file.
+
+    :param spans: Spans as returned by get_spans
+    :param str path: Path of the JSON file to append to
+    :param bool new: If True, the file is started afresh
+    """
+    _make_folder(path)
+    new = new or not os.path.exists(path)
+    with open(path, "wt" if new else "at") as fh:
+        fh.write(
+            ("[\n" if new else "")
+            + "".join(
+                json.dumps(event, default=str) + ",\n"
+                for event in _get_trace_events(spans)
+            )
+        )
+
+
+def read_chrome_trace(path):
+    """
+    Reads a trace file written by export_chrome_trace or append_chrome_trace.
+
+    :param str path: Path of the JSON file
+    :returns: List of trace events
+    """
+    with open(path, "rt") as fh:
+        text = fh.read().strip()
+    if text.startswith("["):
+        return json.loads(text.rstrip(",").rstrip("]").rstrip().rstrip(",") + "]")
+    return json.loads(text)["traceEvents"]
+
+
+def _get_trace_events(spans):
+    """
+    :returns: List of Chrome trace events for the given spans
+    """
+    return [
+        {
+            "name": name,
+            "cat": "breakdown",
+            "ph": "X",
+            "ts": int(start * 1000000),
+            "dur": int(duration * 1000000),
+            "pid": pid,
+            "tid": tid,
+            "args": args,
+        }
+        for (name, start, duration, pid, tid, args) in spans
+    ]
+
+
+def _make_folder(path):
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+
+def flush(app):
+    """
+    Logs a summary of the spans recorded since the last flush and appends them
+    to the trace file configured by the timing_trace_path setting, which
+    defaults to a file in the app's cache location. The first flush of the
+    session starts the file afresh. The spans are discarded afterwards.
+
+    :param app: The breakdown app
+    """
+    if not g_enabled:
+        return
+
+    with g_lock:
+        spans = list(g_spans)
+        g_spans.clear()
+
+    if not spans:
+        return
+
+    trace_path = app.get_setting("timing_trace_path") or os.path.join(
+        app.cache_location, "breakdown_trace.json"
+    )
+    try:
+        append_chrome_trace(spans, trace_path, new=trace_path not in g_trace_paths)
+        g_trace_paths.add(trace_path)
+    except Exception as e:
+        app.log_warning("Failed to write the breakdown timing trace: %s" % e)
+
+    app.log_info("Breakdown timing: %s (trace: %s)" % (get_summary(spans), trace_path))
@@ -0,0 +1,296 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Application of updates to the scene in slices.
+
+The update method of the scene operations hook used to be called once with all
+the items to update, blocking the DCC until all of them were updated. The
+UpdateExecutor calls it with slices of items of the same node type instead,
+each slice being run in the main thread. Between slices the DCC processes its
+events, progress is reported and the update can be cancelled.
+
+Updates can be run synchronously with run(), or in the background with
+submit(), which returns an UpdateHandle to follow and cancel the update.
+
+Each slice is a separate call to the hook, so a slice is also the unit of undo
+and of the progress windows hooks may display: undoing the update takes one
+undo step per slice. Setting update_slice_size to a value larger than the
+number of items restores a single hook call, and undo step, per node type.
+
+The hook can also stop the update, e.g. when the user cancels from its own
+progress window, by returning the list of the items of the slice it processed
+before it stopped. Returning None means all the items of the slice were
+processed.
+"""
+
+import threading
+
+from . import timing
+
+# default number of items passed to the update hook at once
+DEFAULT_SLICE_SIZE = 50
+
+
+def get_slices(items, slice_size=DEFAULT_SLICE_SIZE):
+    """
+    Splits the given hook items into slices of items of the same node type,
+    keeping the order of the items within each type.
+
+    :param items: List of dictionaries with node, type and path keys
+    :param int slice_size: Maximum number of items per slice
+    :returns: List of lists of items
+    """
+    items_by_type = {}
+    for item in items:
+        items_by_type.setdefault(item["type"], []).append(item)
+
+    slices = []
+    for type_items in items_by_type.values():
+        for i in range(0, len(type_items), slice_size):
+            slices.append(type_items[i : i + slice_size])
+    return slices
+
+
+class UpdateCancelled(Exception):
+    """
+    Raised by UpdateHandle.result when the update was cancelled.
+    """
+
+
+class UpdateHandle(object):
+    """
+    Handle of an update running in the background, similar to a future.
+
+    Callbacks are run in the main thread: progress callbacks after each slice
+    with the number of items updated so far and the total number of items, and
+    done callbacks with the handle once the update is over, whether it
+    completed, failed or was cancelled.
+    """
+
+    def __init__(self, total):
+        """
+        :param int total: Number of items to update
+        """
+        self.total = total
+        self.updated = []
+        self._cancel_requested = False
+        self._cancelled = False
+        self._error = None
+        self._done = threading.Event()
+        self._progress_callbacks = []
+        self._done_callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def progress(self):
+        """
+        Tuple of the number of items updated and the total number of items
+        """
+        return (len(self.updated), self.total)
+
+    def cancel(self):
+        """
+        Requests the update to stop. The slice being updated, if any, is
+        completed first.
+
+        :returns: False if the update is already over
+        """
+        if self._done.is_set():
+            return False
+        self._cancel_requested = True
+        return True
+
+    def cancel_requested(self):
+        """
+        :returns: True if cancel was called
+        """
+        return self._cancel_requested
+
+    def cancelled(self):
+        """
+        :returns: True if the update stopped before all items were updated
+                  because it was cancelled
+        """
+        return self._cancelled
+
+    def done(self):
+        """
+        :returns: True if the update is over
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the update to be over. Must not be called from the main
+        thread, which runs the update.
+
+        :param float timeout: Maximum number of seconds to wait
+        :returns: True if the update is over
+        """
+        return self._done.wait(timeout)
+
+    def exception(self, timeout=None):
+        """
+        :param float timeout: Maximum number of seconds to wait for the update
+        :returns: The exception raised by the update hook, or None
+        """
+        self.wait(timeout)
+        return self._error
+
+    def result(self, timeout=None):
+        """
+        Waits for the update and returns the items updated.
+
+        :param float timeout: Maximum number of seconds to wait for the update
+        :returns: List of the hook items updated
+        :raises UpdateCancelled: If the update was cancelled
+        :raises: The exception raised by the update hook, if any
+        """
+        if not self.wait(timeout):
+            raise TimeoutError("The update is still running.")
+        if self._error is not None:
+            raise self._error
+        if self._cancelled:
+            raise UpdateCancelled(
+                "Update cancelled after %d of %d items." % self.progress
+            )
+        return list(self.updated)
+
+    def add_progress_callback(self, callback):
+        """
+        :param callback: Callable taking the number of items updated and the
+                         total number of items
+        """
+        self._progress_callbacks.append(callback)
+
+    def add_done_callback(self, callback):
+        """
+        :param callback: Callable taking the handle. Called right away if the
+                         update is already over.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._done_callbacks.append(callback)
+                return
+        callback(self)
+
+    def _report_progress(self):
+        for callback in self._progress_callbacks:
+            callback(len(self.updated), self.total)
+
+    def _finish(self, cancelled=False, error=None):
+        self._cancelled = cancelled
+        self._error = error
+        with self._lock:
+            self._done.set()
+            callbacks = list(self._done_callbacks)
+        for callback in callbacks:
+            callback(self)
+
+
+class UpdateExecutor(object):
+    """
+    Runs the update hook over slices of items, in the main thread.
+    """
+
+    def __init__(self, app, slice_size=None):
+        """
+        :param app: The breakdown app
+        :param int slice_size: Maximum number of items passed to the hook at once,
+                               defaults to the update_slice_size setting
+        """
+        self._app = app
+        self._slice_size = slice_size or app.get_setting("update_slice_size")
+
+    def run(self, items, progress_callback=None, handle=None):
+        """
+        Updates the given items, slice by slice, in the calling thread.
+
+        :param items: List of dictionaries with node, type and path keys, the path
+                      being the path each node should be updated to
+        :param progress_callback: Optional callable taking the number of items
+                                  updated so far and the total number of items
+        :param handle: Optional UpdateHandle to report to and check for
+                       cancellation between slices
+        :returns: List of the return values of the hook, one per slice
+        """
+        handle = handle or UpdateHandle(len(items))
+        if progress_callback:
+            handle.add_progress_callback(progress_callback)
+
+        results = []
+        for items_slice in get_slices(items, self._slice_size):
+            if handle.cancel_requested():
+                break
+            results.append(self._update_slice(items_slice, handle))
+        return results
+
+    def submit(self, items, progress_callback=None, done_callback=None):
+        """
+        Updates the given items in the background. Each slice is run in the
+        main thread, which is free to process events in between.
+
+        :param items: List of dictionaries with node, type and path keys
+        :param progress_callback: Optional callable taking the number of items
+                                  updated so far and the total number of items,
+                                  called in the main thread after each slice
+        :param done_callback: Optional callable taking the handle, called in the
+                              main thread once the update is over
+        :returns: An UpdateHandle
+        """
+        handle = UpdateHandle(len(items))
+        if progress_callback:
+            handle.add_progress_callback(progress_callback)
+        if done_callback:
+            handle.add_done_callback(
+                lambda h: self._app.engine.execute_in_main_thread(done_callback, h)
+            )
+
+        thread = threading.Thread(
+            target=self._run_in_background,
+            args=(items, handle),
+            name="BreakdownUpdateExecutor",
+        )
+        thread.daemon = True
+        thread.start()
+        return handle
+
+    def _run_in_background(self, items, handle):
+        try:
+            for items_slice in get_slices(items, self._slice_size):
+                if handle.cancel_requested():
+                    break
+                self._app.engine.execute_in_main_thread(
+                    self._update_slice, items_slice, handle
+                )
+        except Exception as e:
+            self._app.log_exception("Failed to update the scene.")
+            handle._finish(error=e)
+            return
+        handle._finish(cancelled=len(handle.updated) < handle.total)
+
+    def _update_slice(self, items_slice, handle):
+        """
+        Runs the update hook for a slice of items and reports the progress.
+        If the hook returns the list of the items it processed before it was
+        cancelled, only those are counted as updated and the update stops.
+        """
+        with timing.span("update", items=len(items_slice), type=items_slice[0]["type"]):
+            result = self._app.execute_hook_method(
+                "hook_scene_operations", "update", items=items_slice
+            )
+        if isinstance(result, list) and len(result) < len(items_slice):
+            handle.updated.extend(result)
+            handle.cancel()
+        else:
+            handle.updated.extend(items_slice)
+        handle._report_progress()
+        return result
@@ -0,0 +1,474 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import fnmatch
+import json
+import os
+import re
+import weakref
+
+from sgtk import TankError
+from sgtk.templatekey import IntegerKey
+
+from . import replay
+from . import single_flight
+
+# the template key we use to find the version number
+VERSION_KEY = "version"
+
+# strategies to find the highest version of an item on disk, see
+# get_search_strategy
+GLOB_STRATEGY = "glob"
+PROBE_STRATEGY = "probe"
+
+# maximum number of times the probed version is doubled before giving up
+MAX_PROBE_DOUBLINGS = 20
+
+# disk scans in flight, by version family
+g_version_scans = single_flight.SingleFlight()
+
+# version parsers, by template object
+g_version_parsers = weakref.WeakKeyDictionary()
+
+# matches the keys of a template definition, e.g. {Shot}
+KEY_REGEX = re.compile(r"\{([^}]+)\}")
+
+# matches either kind of folder separator
+SEPARATOR_PATTERN = r"[/\\]"
+
+
+def get_skip_keys(template):
+    """
+    Returns the keys which vary between the files of a version family, i.e.
+    all abstract (sequence) keys of the template plus 'version' and 'eye'.
+
+    :param template: Template object to get the keys for
+    :returns: List of key names
+    """
+    # first, find all abstract (Sequence) keys from the template:
+    abstract_keys = set()
+    for key_name, key in template.keys.items():
+        if key.is_abstract:
+            abstract_keys.add(key_name)
+
+    # skip keys are all abstract keys + 'version' & 'eye'
+    return [k for k in abstract_keys] + [VERSION_KEY, "eye"]
+
+
+def version_family_key(template, fields):
+    """
+    Returns a hashable key identifying all versions of the file represented
+    by the given template and fields. Two items with the same key resolve to
+    the same highest version.
+
+    :param template: Template object of the item
+    :param dict fields: Fields of the item
+    :returns: Tuple of the template name and the relevant fields
+    """
+    skip_keys = get_skip_keys(template)
+    return (
+        template.name,
+        tuple(sorted((k, v) for (k, v) in fields.items() if k not in skip_keys)),
+    )
+
+
+def get_search_strategy(template, probe_templates):
+    """
+    Returns the strategy used to find the highest version of the items of the
+    given template on disk:
+
+    - GLOB_STRATEGY lists all the files of all versions and parses them, which
+      is always correct but slow for folders holding thousands of files.
+    - PROBE_STRATEGY checks whether the files of the versions following the
+      current one exist, see VersionProber.
+
+    :param template: Template object of the items
+    :param probe_templates: List of template names, or glob patterns matching
+                            template names, to search with PROBE_STRATEGY, as
+                            set by the probe_version_templates setting
+    :returns: GLOB_STRATEGY or PROBE_STRATEGY
+    """
+    for pattern in probe_templates or []:
+        if fnmatch.fnmatchcase(template.name, pattern):
+            return PROBE_STRATEGY
+    return GLOB_STRATEGY
+
+
+def get_highest_version(tk, template, fields, service=None, strategy=GLOB_STRATEGY):
+    """
+    Given a template and some fields, return the highest version number found on disk.
+    The template key containing the version number is assumed to be named {version}.
+
+    :param tk: Toolkit API instance to scan the disk with
+    :param template: Template object to calculate for
+    :param dict fields: A complete set of fields for the template
+    :param service: Optional cache_service.CacheClient sharing the highest
+                    versions with the other processes of the workstation
+    :param str strategy: GLOB_STRATEGY or PROBE_STRATEGY, see get_search_strategy
+    :returns: The highest version number found
+    :rtype: int
+    :raises TankError: If no files could be found for the template and fields
+    """
+    if strategy == PROBE_STRATEGY:
+        search = _probe_highest_version
+    else:
+        search = _scan_highest_version
+
+    family_key = version_family_key(template, fields)
+    if not service:
+        # concurrent lookups of the same version family share a single disk scan
+        return g_version_scans.do((id(tk), family_key), search, tk, template, fields)
+
+    namespace = "versions:%s" % tk.pipeline_configuration.get_path()
+    service_key = json.dumps(family_key, default=str)
+    version = service.get_many(namespace, [service_key]).get(service_key)
+    if version is None:
+        from . import cache_service
+
+        version = g_version_scans.do((id(tk), family_key), search, tk, template, fields)
+        service.put_many(
+            namespace, {service_key: version}, ttl=cache_service.VERSION_TTL
+        )
+    return version
+
+
+def _scan_highest_version(tk, template, fields):
+    """
+    Scans the disk for the highest version, see get_highest_version.
+    """
+    # note - have to do some tricks here to get sequences and stereo working
+    # need to fix this in Tank platform
+
+    # get all eyes, all frames and all versions
+    # potentially a HUGE glob, so may be slow...
+    # todo: better support for sequence iterations
+    #       by using the abstract iteration methods
+
+    # find all files, skipping the keys which vary between versions
+    skip_keys = get_skip_keys(template)
+    all_versions = replay.call(
+        replay.LIST_VERSIONS,
+        [template.name, fields, skip_keys],
+        lambda: tk.paths_from_template(template, fields, skip_keys=skip_keys),
+    )
+
+    # if we didn't find anything then something has gone wrong with our
+    # logic as we should have at least one file so error out:
+    # TODO - this should be handled more cleanly!
+    if not all_versions:
+        raise TankError("Failed to find any files!")
+
+    # now look for the highest version number...
+    return max([0] + get_version_parser(template).parse_all(all_versions))
+
+
+def _probe_highest_version(tk, template, fields):
+    """
+    Probes the disk for the highest version, see VersionProber. Falls back
+    to scanning the disk when the versions can't be probed.
+    """
+    prober = VersionProber(template, fields, tk)
+    version = prober.find_highest(fields.get(VERSION_KEY))
+    if version is None:
+        return _scan_highest_version(tk, template, fields)
+    return version
+
+
+class VersionProber(object):
+    """
+    Finds the highest version of an item by checking whether the paths of
+    other versions exist, rather than listing all the files of all versions.
+
+    Starting from the current version, the version probed is doubled until
+    a path is missing, and the highest existing version is then searched
+    for by bisection between the last two versions probed. This only takes
+    a few stat calls, but assumes that there are no gaps in the versions,
+    i.e. that if v010 exists, so do v001 to v009.
+
+    Frame sequences and stereo files are probed through the frame and eye of
+    the item if they are concrete, or through the folder holding the files if
+    the version is part of the folder path, e.g. .../v{version}/{name}.{SEQ}.exr.
+    Otherwise, e.g. for the normalized fields of a sequence whose frames are
+    all in the same folder, the first file of the current version is looked
+    up with the given toolkit instance, and its frame and eye are probed,
+    assuming that the versions following the current one have them too.
+    """
+
+    def __init__(self, template, fields, tk=None):
+        """
+        :param template: Template object of the item
+        :param dict fields: Fields of the item
+        :param tk: Optional toolkit instance to look up the files of the
+                   current version with, when their frame and eye aren't
+                   concrete and can't be probed through their folder
+        """
+        self._fields = dict(fields)
+        self.probes = 0
+
+        # the eye isn't abstract in the default configs, but is normalized
+        # like the abstract keys
+        abstract_keys = set(
+            name
+            for (name, key) in template.keys.items()
+            if (key.is_abstract or name == "eye") and not is_concrete(fields.get(name))
+        )
+        (self._template, self._exists) = (None, None)
+        if not abstract_keys:
+            self._template = template
+            self._exists = os.path.exists
+            return
+
+        parent = template.parent
+        if (
+            parent is not None
+            and VERSION_KEY in parent.keys
+            and not abstract_keys.intersection(parent.keys)
+        ):
+            self._template = parent
+            self._exists = os.path.isdir
+        elif tk is not None:
+            concrete_fields = self._get_concrete_fields(tk, template, abstract_keys)
+            if concrete_fields:
+                self._fields.update(concrete_fields)
+                self._template = template
+                self._exists = os.path.exists
+
+    def _get_concrete_fields(self, tk, template, abstract_keys):
+        """
+        :returns: Dictionary of the values of the given keys for the first file
+                  of the current version, or None if it has no files
+        """
+        fields = dict(
+            (k, v) for (k, v) in self._fields.items() if k not in abstract_keys
+        )
+        skip_keys = sorted(abstract_keys)
+        paths = replay.call(
+            replay.LIST_VERSIONS,
+            [template.name, fields, skip_keys],
+            lambda: tk.paths_from_template(template, fields, skip_keys=skip_keys),
+        )
+        if not paths:
+            return None
+        first_fields = template.get_fields(min(paths))
+        return dict((k, first_fields[k]) for k in abstract_keys if k in first_fields)
+
+    @property
+    def can_probe(self):
+        """
+        True if the versions of the item can be probed
+        """
+        return self._template is not None
+
+    def exists(self, version):
+        """
+        :param int version: Version to probe
+        :returns: True if the path of the given version exists
+        """
+        self._fields[VERSION_KEY] = version
+        try:
+            path = self._template.apply_fields(self._fields)
+        except TankError:
+            return False
+        self.probes += 1
+        return replay.call(
+            replay.STAT, [self._exists.__name__, path], lambda: self._exists(path)
+        )
+
+    def find_highest(self, version):
+        """
+        :param int version: Current version of the item
+        :returns: The highest version found, or None if the versions can't be
+                  probed, the current version doesn't exist or there are more
+                  versions than MAX_PROBE_DOUBLINGS doublings can reach
+        """
+        if not self.can_probe or not isinstance(version, int):
+            return None
+        if not self.exists(version):
+            return None
+
+        # double the distance to the current version until a version is missing
+        (low, step) = (version, 1)
+        for _ in range(MAX_PROBE_DOUBLINGS):
+            if not self.exists(low + step):
+                break
+            low += step
+            step *= 2
+        else:
+            # out of doublings, high must be missing for the bisection to hold
+            if self.exists(low + step):
+                return None
+        high = low + step
+
+        # low exists and high doesn't, bisect what lies in between
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.exists(middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
+
+def is_concrete(value):
+    """
+    :returns: True if the value of an abstract key designates a single file,
+              e.g. frame 1001 rather than %04d or FORMAT: %d
+    """
+    if isinstance(value, int):
+        return True
+    if not isinstance(value, str) or value.startswith("FORMAT:"):
+        return False
+    return not any(c in value for c in "%#@$")
+
+
+class VersionParser(object):
+    """
+    Extracts the version number of large lists of paths matching a template
+    with a single precompiled regular expression, rather than parsing all the
+    fields of each path with the template.
+
+    The pattern is built from the template definition, with the version key
+    matching digits and the other keys matching anything but a folder
+    separator. It is compiled twice, with the other keys matching as little
+    and as much as possible, and a path is only parsed cleanly if both agree
+    on its version, e.g. not foo.v2.v003.exr with a {name}.v{version}.exr
+    definition.
+
+    Paths which aren't parsed cleanly, as well as all paths of templates the
+    pattern can't be built for, e.g. templates with optional sections or a
+    version key which isn't an integer, are parsed with the template instead.
+    """
+
+    def __init__(self, template):
+        """
+        :param template: Template object to parse paths for
+        """
+        self._template = template
+        self._lazy_regex = self._compile(template, "+?")
+        self._greedy_regex = self._compile(template, "+")
+
+    @property
+    def is_compiled(self):
+        """
+        True if paths are parsed with a precompiled pattern
+        """
+        return self._lazy_regex is not None and self._greedy_regex is not None
+
+    def parse(self, path):
+        """
+        :param str path: Path matching the template
+        :returns: The version number of the path
+        """
+        return self.parse_all([path])[0]
+
+    def parse_all(self, paths):
+        """
+        :param paths: List of paths matching the template
+        :returns: List of the version numbers of the paths, in the same order
+        """
+        if not self.is_compiled:
+            return [self._template.get_fields(p)[VERSION_KEY] for p in paths]
+
+        lazy_match = self._lazy_regex.match
+        greedy_match = self._greedy_regex.match
+        versions = []
+        for path in paths:
+            lazy = lazy_match(path)
+            if lazy:
+                version = lazy.group(VERSION_KEY)
+                greedy = greedy_match(path)
+                if greedy and greedy.group(VERSION_KEY) == version:
+                    versions.append(int(version))
+                    continue
+            versions.append(self._template.get_fields(path)[VERSION_KEY])
+        return versions
+
+    def _compile(self, template, quantifier):
+        """
+        :param template: Template object to compile the pattern for
+        :param str quantifier: Quantifier of the patterns of the keys other
+                               than the version, e.g. + or +?
+        :returns: Compiled pattern matching the full paths of the template, or
+                  None if the template can't be parsed with a simple pattern
+        """
+        definition = getattr(template, "definition", None)
+        root_path = getattr(template, "root_path", None)
+        version_key = template.keys.get(VERSION_KEY)
+        if (
+            not definition
+            or root_path is None
+            or "[" in definition
+            or not isinstance(version_key, IntegerKey)
+        ):
+            return None
+
+        parts = KEY_REGEX.split(definition)
+        # the definition alternates literal text and key names, and the version
+        # must be delimited by literal text to be parsed unambiguously
+        version_indexes = [
+            i for i in range(1, len(parts), 2) if parts[i] == VERSION_KEY
+        ]
+        if not version_indexes:
+            return None
+        for i in version_indexes:
+            if not parts[i - 1] or (i + 1 < len(parts) and not parts[i + 1]):
+                return None
+
+        pattern = [re.escape(root_path.rstrip("/\\")), SEPARATOR_PATTERN]
+        seen_keys = set()
+        for (i, part) in enumerate(parts):
+            if i % 2 == 0:
+                # literal text, with either kind of folder separator
+                pattern.append(
+                    SEPARATOR_PATTERN.join(
+                        re.escape(p) for p in re.split(r"[/\\]", part)
+                    )
+                )
+            elif part in seen_keys:
+                # keys used several times must have the same value everywhere
+                pattern.append("(?P=%s)" % _group_name(part))
+            else:
+                seen_keys.add(part)
+                if part == VERSION_KEY:
+                    pattern.append(r"(?P<%s>\d+)" % VERSION_KEY)
+                else:
+                    pattern.append(
+                        r"(?P<%s>[^/\\]%s)" % (_group_name(part), quantifier)
+                    )
+        pattern.append("$")
+
+        try:
+            return re.compile("".join(pattern))
+        except re.error:
+            return None
+
+
+def get_version_parser(template):
+    """
+    Returns the version parser of the given template, which is compiled on
+    first use and kept for as long as the template exists.
+
+    :param template: Template object
+    :returns: A VersionParser
+    """
+    parser = g_version_parsers.get(template)
+    if parser is None:
+        parser = VersionParser(template)
+        g_version_parsers[template] = parser
+    return parser
+
+
+def _group_name(key_name):
+    """
+    :returns: A regular expression group name for the given template key
+    """
+    if key_name == VERSION_KEY:
+        return VERSION_KEY
+    return "k_%s" % re.sub(r"\W", "_", key_name)
@@ -8,6 +8,7 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+import json
 import os
 from tank import Hook
 import tank
@@ -39,6 +40,12 @@ class BreakdownSceneOperations(Hook):
         available. Any such versions are then displayed in the UI as out of date.
         """
 
+        # synthetic scenes used by the benchmarks are stored as json
+        scene_file = os.environ.get("TEST_SCENE_FILE")
+        if scene_file:
+            with open(scene_file, "rt") as fh:
+                return json.load(fh)
+
         nodes = []
 
         nodes.append(
@@ -55,6 +62,16 @@ class BreakdownSceneOperations(Hook):
 
         return nodes
 
+    def get_current_scene_path(self):
+        """
+        Returns the path of the current scene. This is used to record which
+        scene the breakdown items were found in.
+
+        :returns: Path to the current scene file, or None if the scene has
+                  not been saved.
+        """
+        return os.environ.get("TEST_SCENE_PATH")
+
     def update(self, items):
         """
         Perform replacements given a number of scene items passed from the app.
@@ -0,0 +1,446 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Benchmarks for the breakdown pipeline.
+
+Synthetic scenes are generated and returned by the fixture scene operations
+hook, with matching templates and version trees written to disk. Timings are
+compared against the baselines stored in fixtures/benchmarks/baselines.json and
+a benchmark fails if it is slower than its baseline by more than the allowed
+tolerance, or if it has no baseline. The benchmarks are skipped if the
+baselines file is missing.
+
+Baselines are measured on the reference machine, by running the benchmarks
+with TK_BREAKDOWN_BENCHMARK_SAVE set to an output path and copying the file
+written to fixtures/benchmarks/baselines.json.
+
+The following environment variables control the benchmarks:
+
+- TK_BREAKDOWN_BENCHMARK_SIZES: Comma separated scene sizes, defaults to 100 so
+  that the default test run stays fast. The full range is 100,1000,10000,50000.
+- TK_BREAKDOWN_BENCHMARK_DEPTH: Folder depth of the generated templates.
+- TK_BREAKDOWN_BENCHMARK_FRAMES: Frames per version, 0 for single files.
+- TK_BREAKDOWN_BENCHMARK_VERSIONS: Versions on disk per file.
+- TK_BREAKDOWN_BENCHMARK_SG_LATENCY: Seconds added to each Shotgun query.
+- TK_BREAKDOWN_BENCHMARK_TOLERANCE: Allowed slowdown, 0.5 means 50% slower.
+- TK_BREAKDOWN_BENCHMARK_SAVE: Path of a file to write the timings to, merged
+  with the current baselines, instead of comparing them to the baselines. This
+  is typically a temporary or CI artifact path.
+"""
+
+import importlib
+import json
+import logging
+import os
+import time
+
+from tank_test.tank_test_base import *
+import sgtk
+from sgtk.templatekey import IntegerKey, SequenceKey, StringKey
+
+BASELINES_PATH = os.path.join(
+    os.path.dirname(__file__), "fixtures", "benchmarks", "baselines.json"
+)
+
+log = logging.getLogger(__name__)
+
+# absolute slack added to the tolerance so that tiny timings don't fail on noise
+BASELINE_SLACK = 0.05
+
+# number of scene items referencing each file family
+ITEMS_PER_FAMILY = 10
+
+
+def _int_env(name, default):
+    return int(os.environ.get(name, default))
+
+
+class SyntheticScene(object):
+    """
+    Generates a template, a version tree on disk and a scene referencing it.
+    """
+
+    def __init__(self, root, num_items, depth=3, frames=0, num_versions=3):
+        """
+        :param str root: Project root to write the files to
+        :param int num_items: Number of items in the scene
+        :param int depth: Number of folder levels in the template
+        :param int frames: Number of frames per version, 0 for single files
+        :param int num_versions: Number of versions on disk per file family
+        """
+        self.root = root
+        self.num_items = num_items
+        self.depth = depth
+        self.frames = frames
+        self.num_versions = num_versions
+        self.num_families = max(1, num_items // ITEMS_PER_FAMILY)
+        self.template = self._make_template()
+
+    def _make_template(self):
+        keys = {
+            "name": StringKey("name"),
+            "version": IntegerKey("version", format_spec="03"),
+            "SEQ": SequenceKey("SEQ", format_spec="04"),
+        }
+        folders = []
+        for level in range(self.depth):
+            key_name = "level%d" % level
+            keys[key_name] = StringKey(key_name)
+            folders.append("{%s}" % key_name)
+
+        if self.frames:
+            file_name = "{name}.v{version}.{SEQ}.exr"
+        else:
+            file_name = "{name}.v{version}.ma"
+
+        definition = "/".join(
+            ["benchmark"] + folders + ["{name}", "v{version}", file_name]
+        )
+        return sgtk.TemplatePath(
+            definition, keys, self.root, name="benchmark_%d" % self.num_items
+        )
+
+    def family_fields(self, family):
+        """
+        :returns: Fields of the first version of the given family
+        """
+        fields = {"name": "asset%05d" % family, "version": 1}
+        for level in range(self.depth):
+            fields["level%d" % level] = "l%d_%d" % (level, family % (level + 2))
+        return fields
+
+    def write_files(self):
+        """
+        Writes all versions of all families to disk.
+        """
+        for family in range(self.num_families):
+            fields = self.family_fields(family)
+            for version in range(1, self.num_versions + 1):
+                fields["version"] = version
+                for frame in range(1, self.frames + 1) if self.frames else [None]:
+                    if frame is not None:
+                        fields["SEQ"] = frame
+                    path = self.template.apply_fields(fields)
+                    folder = os.path.dirname(path)
+                    if not os.path.exists(folder):
+                        os.makedirs(folder)
+                    open(path, "w").close()
+
+    def scene_objects(self):
+        """
+        :returns: Scene objects on the form returned by the scan_scene hook
+        """
+        objects = []
+        for item in range(self.num_items):
+            fields = self.family_fields(item % self.num_families)
+            if self.frames:
+                fields["SEQ"] = "FORMAT: %d"
+            objects.append(
+                {
+                    "node": "node%06d" % item,
+                    "type": "TestNode",
+                    "path": self.template.apply_fields(fields),
+                }
+            )
+        return objects
+
+
+class TestBenchmarks(TankTestBase):
+    """
+    Benchmarks of the breakdown pipeline on synthetic scenes.
+    """
+
+    def setUp(self):
+        """
+        Fixtures setup
+        """
+        super(TestBenchmarks, self).setUp()
+        self.setup_fixtures()
+
+        os.environ["BUNDLE_ROOT"] = os.path.abspath(
+            os.path.join(os.path.dirname(__file__), "..", "..")
+        )
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+        self.sizes = [
+            int(s)
+            for s in os.environ.get("TK_BREAKDOWN_BENCHMARK_SIZES", "100").split(",")
+        ]
+        self.depth = _int_env("TK_BREAKDOWN_BENCHMARK_DEPTH", 3)
+        self.frames = _int_env("TK_BREAKDOWN_BENCHMARK_FRAMES", 0)
+        self.num_versions = _int_env("TK_BREAKDOWN_BENCHMARK_VERSIONS", 3)
+        self.tolerance = float(
+            os.environ.get("TK_BREAKDOWN_BENCHMARK_TOLERANCE", "0.5")
+        )
+        self.sg_latency = float(
+            os.environ.get("TK_BREAKDOWN_BENCHMARK_SG_LATENCY", "0.0")
+        )
+
+        # add latency to the mocked shotgun queries
+        original_find = self.mockgun.find
+
+        def find(*args, **kwargs):
+            time.sleep(self.sg_latency)
+            return original_find(*args, **kwargs)
+
+        self.mockgun.find = find
+
+        context = self.tk.context_from_entity(self.project["type"], self.project["id"])
+        self.engine = sgtk.platform.start_engine("test_engine", self.tk, context)
+        self.app = self.engine.apps["tk-multi-breakdown"]
+        self.tk_multi_breakdown = self.app.import_module("tk_multi_breakdown")
+
+        self.timings = {}
+        self.addCleanup(os.environ.pop, "TEST_SCENE_FILE", None)
+
+    def tearDown(self):
+        """
+        Fixtures teardown
+        """
+        cur_engine = sgtk.platform.current_engine()
+        if cur_engine:
+            cur_engine.destroy()
+
+        super(TestBenchmarks, self).tearDown()
+
+    def _setup_scene(self, num_items):
+        """
+        Generates a synthetic scene and makes the fixture hook return it.
+        """
+        scene = SyntheticScene(
+            self.project_root,
+            num_items,
+            depth=self.depth,
+            frames=self.frames,
+            num_versions=self.num_versions,
+        )
+        scene.write_files()
+        self.tk.templates[scene.template.name] = scene.template
+
+        # register every other family as a publish
+        publishes = []
+        for family in range(0, scene.num_families, 2):
+            fields = scene.family_fields(family)
+            if self.frames:
+                fields["SEQ"] = "FORMAT: %d"
+            path = scene.template.apply_fields(fields)
+            publishes.append(
+                {
+                    "type": "PublishedFile",
+                    "id": 1000 + family,
+                    "code": os.path.basename(path),
+                    "name": fields["name"],
+                    "version_number": 1,
+                    "path_cache": os.path.relpath(path, self.project_root).replace(
+                        os.path.sep, "/"
+                    ),
+                    "path_cache_storage": self.primary_storage,
+                    "project": self.project,
+                    "entity": None,
+                    "task": None,
+                    "image": None,
+                    "published_file_type": None,
+                }
+            )
+        self.add_to_sg_mock_db(publishes)
+
+        scene_file = os.path.join(self.project_root, "scene_%d.json" % num_items)
+        with open(scene_file, "wt") as fh:
+            json.dump(scene.scene_objects(), fh)
+        os.environ["TEST_SCENE_FILE"] = scene_file
+
+        return scene
+
+    def _time(self, name, size, fn):
+        """
+        Times the given function, starting from empty caches, and records the
+        best of a few runs.
+        """
+        runs = 3 if size <= 1000 else 1
+        best = None
+        for _ in range(runs):
+            self.tk_multi_breakdown.breakdown.g_cached_sg_publish_data.clear()
+            start = time.time()
+            fn()
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.timings["%s[%d]" % (name, size)] = best
+        return best
+
+    def _check_baselines(self):
+        """
+        Compares the recorded timings against the baselines, or saves them as
+        the new baselines.
+        """
+        for (key, elapsed) in sorted(self.timings.items()):
+            log.info("benchmark %s: %.4fs", key, elapsed)
+
+        baselines = {}
+        if os.path.exists(BASELINES_PATH):
+            with open(BASELINES_PATH, "rt") as fh:
+                baselines = json.load(fh)
+
+        save_path = os.environ.get("TK_BREAKDOWN_BENCHMARK_SAVE")
+        if save_path:
+            baselines.update(self.timings)
+            folder = os.path.dirname(os.path.abspath(save_path))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(save_path, "wt") as fh:
+                json.dump(baselines, fh, indent=4, sort_keys=True)
+            log.info("benchmark timings written to %s", save_path)
+            return
+
+        if not baselines:
+            self.skipTest(
+                "No benchmark baselines in %s, the timings were not checked. "
+                "Measure them on the reference machine with "
+                "TK_BREAKDOWN_BENCHMARK_SAVE." % BASELINES_PATH
+            )
+
+        regressions = []
+        for (key, elapsed) in sorted(self.timings.items()):
+            if key not in baselines:
+                regressions.append("%s has no baseline" % key)
+                continue
+            allowed = baselines[key] * (1.0 + self.tolerance) + BASELINE_SLACK
+            if elapsed > allowed:
+                regressions.append(
+                    "%s took %.4fs, baseline %.4fs" % (key, elapsed, baselines[key])
+                )
+        self.assertEqual(regressions, [])
+
+    def test_pipeline(self):
+        """
+        Times the scan, version and analysis steps of the breakdown.
+        """
+        for size in self.sizes:
+            scene = self._setup_scene(size)
+
+            items = []
+            self._time(
+                "get_breakdown_items",
+                size,
+                lambda: items.__setitem__(
+                    slice(None), self.tk_multi_breakdown.get_breakdown_items()
+                ),
+            )
+            self.assertEqual(len(items), size)
+
+            families = dict(
+                (
+                    self.tk_multi_breakdown.versions.version_family_key(
+                        i["template"], i["fields"]
+                    ),
+                    i,
+                )
+                for i in items
+            )
+
+            def compute_versions():
+                for item in families.values():
+                    self.assertEqual(
+                        self.app.compute_highest_version(
+                            item["template"], item["fields"]
+                        ),
+                        scene.num_versions,
+                    )
+
+            self._time("compute_highest_version", size, compute_versions)
+            self._time("analyze_scene", size, self.app.analyze_scene)
+
+        self._check_baselines()
+
+    def test_process_result(self):
+        """
+        Times the population of the scene browser widget.
+        """
+        try:
+            from sgtk.platform.qt import QtGui
+
+            scene_browser = importlib.import_module(
+                self.tk_multi_breakdown.__name__ + ".scene_browser"
+            )
+        except Exception as e:
+            self.skipTest("Qt or the frameworks are not available: %s" % e)
+
+        if QtGui.QApplication.instance() is None:
+            self._qt_app = QtGui.QApplication([])
+
+        for size in self.sizes:
+            self._setup_scene(size)
+            items = self.tk_multi_breakdown.get_breakdown_items()
+
+            def populate():
+                widget = scene_browser.SceneBrowserWidget()
+                widget.set_app(self.app)
+                try:
+                    widget.process_result(
+                        {"items": items, "show_red": True, "show_green": True}
+                    )
+                finally:
+                    widget.destroy()
+
+            self._time("process_result", size, populate)
+
+        self._check_baselines()
+
+    def test_version_parser(self):
+        """
+        Compares the batch version parser to parsing each path with the
+        template.
+        """
+        versions = self.tk_multi_breakdown.versions
+
+        for size in self.sizes:
+            scene = SyntheticScene(
+                self.project_root, size, depth=self.depth, frames=max(self.frames, 10)
+            )
+            fields = scene.family_fields(0)
+            paths = []
+            for version in range(1, max(1, size // scene.frames) + 1):
+                for frame in range(1, scene.frames + 1):
+                    fields["version"] = version
+                    fields["SEQ"] = frame
+                    paths.append(scene.template.apply_fields(fields))
+
+            parser = versions.VersionParser(scene.template)
+            self.assertTrue(parser.is_compiled)
+
+            results = {}
+            get_fields_time = self._time(
+                "version_get_fields",
+                size,
+                lambda: results.__setitem__(
+                    "get_fields",
+                    [scene.template.get_fields(p)["version"] for p in paths],
+                ),
+            )
+            parser_time = self._time(
+                "version_parser",
+                size,
+                lambda: results.__setitem__("parser", parser.parse_all(paths)),
+            )
+
+            summary = (
+                "version parsing of %d paths: get_fields %.3fs, parser %.3fs (%.1fx)"
+                % (
+                    len(paths),
+                    get_fields_time,
+                    parser_time,
+                    get_fields_time / max(parser_time, 1e-6),
+                )
+            )
+            log.info(summary)
+            self.assertEqual(results["parser"], results["get_fields"])
+            self.assertLess(parser_time, get_fields_time, summary)
+
+        self._check_baselines()
@@ -8,7 +8,13 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+import importlib
+import json
 import os
+import sys
+import tempfile
+import threading
+import time
 
 from tank_test.tank_test_base import *
 import sgtk
@@ -177,6 +183,413 @@ class TestApi(TestApplication):
             self.assertEqual(item["template"], self.tk.templates["maya_shot_publish"])
             self.assertEqual(item["sg_data"], None)
 
+    def test_analyze_scene_compact(self):
+        """
+        Tests the compact items returned by analyze_scene
+        """
+        tk_multi_breakdown = self.app.import_module("tk_multi_breakdown")
+        scene_data = self.app.analyze_scene(compact=True)
+
+        self.assertEqual(len(scene_data), 2)
+        self.assertEqual(
+            [dict(item) for item in scene_data],
+            [dict(item) for item in self.app.analyze_scene()],
+        )
+        item = scene_data[0]
+        self.assertIsInstance(item, tk_multi_breakdown.items.BreakdownItem)
+        self.assertEqual(item["fields"]["version"], 3)
+        self.assertEqual(item.node_name, "maya_publish")
+        self.assertRaises(KeyError, lambda: item["path"])
+
+        # items of the same publish share a single record
+        factory = tk_multi_breakdown.items.ItemFactory(
+            tk_multi_breakdown.breakdown.trim_sg_data
+        )
+        sg_data = {
+            "type": "PublishedFile",
+            "id": 12,
+            "code": "foo.v003.ma",
+            "task": None,
+            "name": "foo",
+            "entity": self.shot,
+            "project": self.project,
+            "version_number": 3,
+            "published_file_type": None,
+            "image": "https://thumbnail",
+        }
+        items = [
+            factory.create(
+                {
+                    "node_name": "foo%d" % i,
+                    "node_type": "reference",
+                    "template": item["template"],
+                    "fields": dict(item["fields"]),
+                    "sg_data": dict(sg_data),
+                }
+            )
+            for i in range(2)
+        ]
+        self.assertIs(items[0]["sg_data"], items[1]["sg_data"])
+        self.assertEqual(items[0]["sg_data"]["id"], 12)
+        self.assertNotIn("image", items[0]["sg_data"])
+
+    def test_analyze_scene_columnar(self):
+        """
+        Tests the columnar result of analyze_scene
+        """
+        columns = self.app.analyze_scene(columnar=True)
+
+        self.assertEqual(len(columns), 2)
+        self.assertEqual(columns.column("node_name"), ["maya_publish"] * 2)
+        self.assertEqual(columns.column("template_name"), ["maya_shot_publish"] * 2)
+        self.assertEqual(columns.column("version"), [3, 3])
+        self.assertEqual(columns.column("publish_id"), [None, None])
+        # repeated strings are stored once
+        self.assertEqual(
+            columns.strings, ["maya_publish", "TestNode", "maya_shot_publish"]
+        )
+
+        self.assertEqual(columns.find(node_type="TestNode", version=3), [0, 1])
+        self.assertEqual(columns.find(node_type="reference"), [])
+        self.assertEqual(columns.find(publish_id=None), [0, 1])
+
+        row = columns.row(1)
+        self.assertEqual(row["template"], self.tk.templates["maya_shot_publish"])
+        self.assertEqual(row["fields"]["version"], 3)
+        self.assertEqual(row["entity_type"], None)
+
+        data = json.loads(json.dumps(columns.to_dict()))
+        restored = type(columns).from_dict(data)
+        self.assertEqual(restored.to_dict(), columns.to_dict())
+        self.assertEqual(len(columns.take([1])), 1)
+
+    def test_normalization_plan(self):
+        """
+        Tests that the normalization plans produce the same fields and paths
+        as normalizing each item from scratch
+        """
+        breakdown = self.app.import_module("tk_multi_breakdown").breakdown
+        template = self.tk.template_from_path(self.test_path_1)
+
+        fields = template.get_fields(self.test_path_1)
+        expected_fields = dict(fields)
+        for (key_name, key) in template.keys.items():
+            if key_name in expected_fields and key.is_abstract:
+                del expected_fields[key_name]
+        expected_fields["eye"] = "%V"
+        expected_path = template.apply_fields(expected_fields)
+
+        plan = breakdown.get_normalization_plan(template)
+        self.assertIs(breakdown.get_normalization_plan(template), plan)
+        self.assertEqual(plan.normalize(fields), expected_path)
+        self.assertEqual(fields, expected_fields)
+
+        # the second item with the same fields gets the memoized path
+        fields = template.get_fields(self.test_path_1)
+        self.assertIs(plan.normalize(fields), plan.normalize(dict(expected_fields)))
+        self.assertEqual(fields, expected_fields)
+
+    def test_version_parser(self):
+        """
+        Tests that the batch version parser agrees with the template, including
+        for paths it can't parse on its own
+        """
+        versions = self.app.import_module("tk_multi_breakdown").versions
+        template = self.tk.templates["maya_shot_publish"]
+        parser = versions.get_version_parser(template)
+        self.assertTrue(parser.is_compiled)
+
+        fields = template.get_fields(self.test_path_1)
+        paths = [self.test_path_1, self.test_path_2]
+        # a name which looks like a version is ambiguous for the pattern
+        fields["name"] = "foo.v2"
+        fields["version"] = 12
+        paths.append(template.apply_fields(fields))
+
+        self.assertEqual(parser.parse_all(paths), [3, 4, 12])
+        self.assertEqual(
+            parser.parse_all(paths), [template.get_fields(p)["version"] for p in paths]
+        )
+
+    def test_probe_version_search(self):
+        """
+        Tests that probing the versions finds the same highest version as
+        listing them, for files and for frame sequences
+        """
+        versions = self.app.import_module("tk_multi_breakdown").versions
+        template = self.tk.templates["maya_shot_publish"]
+        self.assertEqual(
+            versions.get_search_strategy(template, ["nuke_*", "maya_shot_*"]),
+            versions.PROBE_STRATEGY,
+        )
+        self.assertEqual(
+            versions.get_search_strategy(template, ["nuke_*"]), versions.GLOB_STRATEGY
+        )
+
+        fields = template.get_fields(self.test_path_1)
+        for version in range(5, 20):
+            fields["version"] = version
+            with open(template.apply_fields(fields), "wt"):
+                pass
+
+        fields["version"] = 3
+        prober = versions.VersionProber(template, fields)
+        self.assertEqual(prober.find_highest(3), 19)
+        self.assertTrue(prober.probes < 17)
+        self.assertEqual(
+            versions.get_highest_version(
+                self.tk, template, fields, strategy=versions.PROBE_STRATEGY
+            ),
+            versions.get_highest_version(self.tk, template, fields),
+        )
+
+        # versions beyond the reach of the doublings are scanned instead
+        max_probe_doublings = versions.MAX_PROBE_DOUBLINGS
+        versions.MAX_PROBE_DOUBLINGS = 2
+        try:
+            self.assertIsNone(versions.VersionProber(template, fields).find_highest(3))
+            self.assertEqual(
+                versions.get_highest_version(
+                    self.tk, template, fields, strategy=versions.PROBE_STRATEGY
+                ),
+                19,
+            )
+        finally:
+            versions.MAX_PROBE_DOUBLINGS = max_probe_doublings
+
+        # sequences are probed through the folder of their version
+        template = self.tk.templates["nuke_shot_render_pub_mono_dpx"]
+        fields = {
+            "Sequence": self.seq["code"],
+            "Shot": self.shot["code"],
+            "Step": self.step["short_name"],
+            "name_alpha": "comp",
+            "channel": "output",
+            "width": 2048,
+            "height": 1556,
+            "frame": "FORMAT: %d",
+        }
+        for version in (1, 2, 3):
+            fields["version"] = version
+            folder = template.parent.apply_fields(fields)
+            os.makedirs(folder)
+            fields["frame"] = 1001
+            with open(template.apply_fields(fields), "wt"):
+                pass
+            fields["frame"] = "FORMAT: %d"
+
+        fields["version"] = 1
+        self.assertEqual(
+            versions.get_highest_version(
+                self.tk, template, fields, strategy=versions.PROBE_STRATEGY
+            ),
+            3,
+        )
+        # a concrete frame is probed directly
+        fields["frame"] = 1001
+        self.assertEqual(versions.VersionProber(template, fields).find_highest(1), 3)
+
+    def test_probe_flat_sequence(self):
+        """
+        Tests that stereo sequences whose versions share a folder are probed
+        through a file of the current version, rather than listed
+        """
+        versions = self.app.import_module("tk_multi_breakdown").versions
+        keys = self.tk.templates["nuke_shot_render_pub_stereo"].keys
+        template = sgtk.TemplatePath(
+            "sequences/{Sequence}/{Shot}/{Step}/flat/"
+            "{Shot}_{name_alpha}_{eye}_v{version}.{frame}.exr",
+            dict((name, keys[name]) for name in keys),
+            self.project_root,
+            name="flat_stereo",
+        )
+        fields = {
+            "Sequence": self.seq["code"],
+            "Shot": self.shot["code"],
+            "Step": self.step["short_name"],
+            "name_alpha": "comp",
+        }
+        os.makedirs(template.parent.apply_fields(fields))
+        for version in (1, 2, 3):
+            for eye in ("Left", "Right"):
+                for frame in (1001, 1002):
+                    fields.update(version=version, eye=eye, frame=frame)
+                    with open(template.apply_fields(fields), "wt"):
+                        pass
+
+        # normalized fields, as stored on the items
+        del fields["frame"]
+        fields.update(version=1, eye="%V")
+
+        prober = versions.VersionProber(template, fields, self.tk)
+        self.assertTrue(prober.can_probe)
+        self.assertEqual(prober.find_highest(1), 3)
+        self.assertFalse(versions.VersionProber(template, fields).can_probe)
+
+        scans = []
+        scan_highest_version = versions._scan_highest_version
+        versions._scan_highest_version = lambda *args: scans.append(args)
+        try:
+            self.assertEqual(
+                versions.get_highest_version(
+                    self.tk, template, fields, strategy=versions.PROBE_STRATEGY
+                ),
+                3,
+            )
+        finally:
+            versions._scan_highest_version = scan_highest_version
+        self.assertEqual(scans, [])
+
+    def test_template_cache(self):
+        """
+        Tests that paths matched in a previous session are not matched against
+        the templates again, until the templates change
+        """
+        tk_multi_breakdown = self.app.import_module("tk_multi_breakdown")
+        breakdown = tk_multi_breakdown.breakdown
+        # not imported by the package, to keep sqlite out of the sessions not
+        # using the cache
+        template_cache = importlib.import_module(
+            "%s.template_cache" % tk_multi_breakdown.__name__
+        )
+
+        get_config_hash = template_cache.get_config_hash
+        config_hash = get_config_hash(self.tk)
+        self.assertEqual(config_hash, get_config_hash(self.tk))
+
+        db_path = os.path.join(self.tank_temp, "template_cache.db")
+        cache = template_cache.TemplateCache(db_path, config_hash)
+        scene_objects = [
+            {"node": "maya_publish", "type": "reference", "path": self.test_path_1},
+            {"node": "maya_publish_2", "type": "reference", "path": self.test_path_2},
+            {"node": "other", "type": "file", "path": "/not/a/template/path.ma"},
+        ]
+        items = breakdown.resolve_scene_objects(self.tk, scene_objects, cache)
+        self.assertEqual(len(items), 2)
+
+        template, fields = cache.get_many([self.test_path_1])[self.test_path_1]
+        self.assertEqual(template, "maya_shot_publish")
+        self.assertEqual(fields["version"], 3)
+        self.assertEqual(
+            cache.get_many(["/not/a/template/path.ma"]),
+            {"/not/a/template/path.ma": (None, None)},
+        )
+
+        # a new session reads the cache without matching any path
+        template_from_path = self.tk.template_from_path
+        self.tk.template_from_path = None
+        try:
+            cache = template_cache.TemplateCache(db_path, config_hash)
+            cached_items = breakdown.resolve_scene_objects(
+                self.tk, scene_objects, cache
+            )
+        finally:
+            self.tk.template_from_path = template_from_path
+
+        self.assertEqual(
+            [(i["path"], i["template"], i["fields"]) for i in cached_items],
+            [(i["path"], i["template"], i["fields"]) for i in items],
+        )
+
+        # paths matching no template expire, and are removed on open
+        cache = template_cache.TemplateCache(db_path, config_hash, negative_ttl=-1)
+        self.assertEqual(cache.get_many(["/not/a/template/path.ma"]), {})
+        self.assertEqual(len(cache.get_many([self.test_path_1])), 1)
+        cache = template_cache.TemplateCache(db_path, config_hash)
+        self.assertEqual(cache.get_many(["/not/a/template/path.ma"]), {})
+
+        # other templates empty the cache
+        cache = template_cache.TemplateCache(db_path, "other")
+        self.assertEqual(cache.get_many([self.test_path_1]), {})
+
+        # the hash of the configuration is computed once per toolkit instance
+        settings = {"template_cache": True, "template_cache_path": db_path}
+        get_setting = self.app.get_setting
+        hashes = []
+
+        def counting_get_config_hash(tk):
+            hashes.append(tk)
+            return config_hash
+
+        breakdown.g_config_hashes.clear()
+        self.app.get_setting = lambda name, default=None: settings.get(
+            name, get_setting(name, default)
+        )
+        template_cache.get_config_hash = counting_get_config_hash
+        try:
+            self.assertIsNotNone(breakdown.get_template_cache(self.app))
+            self.assertIsNotNone(breakdown.get_template_cache(self.app))
+        finally:
+            del self.app.get_setting
+            template_cache.get_config_hash = get_config_hash
+        self.assertEqual(hashes, [self.app.sgtk])
+
+    def test_publish_details(self):
+        """
+        Tests that the publish details are fetched separately from the data
+        needed to compute the status
+        """
+        breakdown = self.app.import_module("tk_multi_breakdown").breakdown
+        breakdown.g_cached_sg_publish_data.clear()
+        breakdown.g_cached_sg_publish_details.clear()
+
+        self.add_to_sg_mock_db(
+            {
+                "type": "PublishedFile",
+                "id": 12,
+                "code": "foo.v003.ma",
+                "name": "foo",
+                "version_number": 3,
+                "image": "https://thumbnail",
+                "task": None,
+                "entity": self.shot,
+                "project": self.project,
+                "published_file_type": None,
+                "path_cache": "sequences/seq_code/shot_code/step_short_name/publish/foo.v003.ma",
+                "path_cache_storage": self.primary_storage,
+            }
+        )
+
+        queries = []
+        find = self.mockgun.find
+
+        def counting_find(entity_type, filters, fields=None, *args, **kwargs):
+            queries.append(fields)
+            return find(entity_type, filters, fields, *args, **kwargs)
+
+        self.mockgun.find = counting_find
+
+        items = breakdown.get_breakdown_items(details=False)
+        self.assertEqual(items[0]["sg_data"]["id"], 12)
+        self.assertIs(items[0]["sg_data"], items[1]["sg_data"])
+        self.assertNotIn("image", items[0]["sg_data"])
+        self.assertTrue(all("image" not in (fields or []) for fields in queries))
+
+        del queries[:]
+        scene_data = self.app.analyze_scene()
+        # the publish is cached, only its details are queried
+        self.assertEqual(queries, [breakdown.PUBLISH_DETAIL_FIELDS])
+        self.assertEqual(scene_data[0]["sg_data"]["code"], "foo.v003.ma")
+        self.assertEqual(scene_data[0]["sg_data"]["project"]["id"], self.project["id"])
+
+        # both tiers are cached
+        del queries[:]
+        items = breakdown.get_breakdown_items()
+        self.assertEqual(queries, [])
+        self.assertEqual(items[0]["sg_data"]["image"], "https://thumbnail")
+
+        # with nothing cached, the details are part of the publish query
+        breakdown.g_cached_sg_publish_data.clear()
+        breakdown.g_cached_sg_publish_details.clear()
+        del queries[:]
+        items = breakdown.get_breakdown_items()
+        self.assertEqual(len(queries), 1)
+        self.assertIn("image", queries[0])
+        self.assertEqual(items[0]["sg_data"]["image"], "https://thumbnail")
+        self.assertTrue(
+            all("image" not in d for d in breakdown.g_cached_sg_publish_data.values())
+        )
+
     def test_compute_highest_version(self):
         """
         Tests the version computation logic
@@ -187,6 +600,10 @@ class TestApi(TestApplication):
         self.assertEqual(
             self.app.compute_highest_version(item["template"], item["fields"]), 4
         )
+        # the default logic of the hook is available to hook overrides
+        self.assertEqual(
+            self.app.find_highest_version(item["template"], item["fields"]), 4
+        )
         # test bad data
         self.assertRaises(
             TankError,
@@ -195,6 +612,165 @@ class TestApi(TestApplication):
             item["fields"],
         )
 
+    def test_capture_replay(self):
+        """
+        Tests that a captured breakdown replays offline with the same results
+        """
+        tk_multi_breakdown = self.app.import_module("tk_multi_breakdown")
+        replay = tk_multi_breakdown.replay
+        tk_multi_breakdown.breakdown.g_cached_sg_publish_data.clear()
+
+        archive_path = os.path.join(self.tank_temp, "capture.jsonl.gz")
+        recorder = replay.start_capture(archive_path)
+        try:
+            scene_data = self.app.analyze_scene()
+            # the inputs of each breakdown are appended to the archive
+            self.assertEqual(recorder._records, [])
+            self.assertNotEqual(len(recorder), 0)
+            versions = [
+                self.app.compute_highest_version(i["template"], i["fields"])
+                for i in scene_data
+            ]
+        finally:
+            self.assertEqual(replay.stop_capture(), archive_path)
+        self.assertEqual(versions, [4, 4])
+
+        # the scene, the files and the publish queries are all replayed
+        os.remove(self.test_path_2)
+        os.environ["TEST_PATH_1"] = self.test_path_2
+        replayed = self.app.replay_scene(archive_path, speed=0)
+
+        self.assertEqual(
+            [(i["node_name"], i["fields"], i["latest_version"]) for i in replayed],
+            [(i["node_name"], i["fields"], 4) for i in scene_data],
+        )
+        self.assertEqual(
+            [i["sg_data"] for i in replayed], [i["sg_data"] for i in scene_data]
+        )
+
+        # inputs missing from the archive fail rather than hit the disk
+        get_setting = self.app.get_setting
+        self.app.get_setting = lambda name, default=None: (
+            True
+            if name in ("cache_service", "template_cache")
+            else get_setting(name, default)
+        )
+        try:
+            with replay.replaying(archive_path, speed=0):
+                # nor are the caches shared across sessions used
+                breakdown = tk_multi_breakdown.breakdown
+                self.assertIsNone(breakdown.get_cache_client(self.app))
+                self.assertIsNone(breakdown.get_template_cache(self.app))
+        finally:
+            del self.app.get_setting
+
+        with replay.replaying(archive_path, speed=0):
+            self.assertRaises(
+                replay.ReplayError,
+                self.app.compute_highest_version,
+                self.tk.templates["maya_asset_publish"],
+                scene_data[0]["fields"],
+            )
+
+    def test_capture_warm_caches(self):
+        """
+        Tests that a capture records the publishes already cached by earlier
+        breakdowns, and that the cache service isn't used while capturing
+        """
+        tk_multi_breakdown = self.app.import_module("tk_multi_breakdown")
+        replay = tk_multi_breakdown.replay
+        breakdown = tk_multi_breakdown.breakdown
+
+        breakdown.g_cached_sg_publish_data.clear()
+        breakdown.g_cached_sg_publish_details.clear()
+        self.add_to_sg_mock_db(
+            {
+                "type": "PublishedFile",
+                "id": 12,
+                "code": "foo.v003.ma",
+                "name": "foo",
+                "version_number": 3,
+                "image": "https://thumbnail",
+                "task": None,
+                "entity": self.shot,
+                "project": self.project,
+                "published_file_type": None,
+                "path_cache": "sequences/seq_code/shot_code/step_short_name/publish/foo.v003.ma",
+                "path_cache_storage": self.primary_storage,
+            }
+        )
+
+        # warms the publish caches
+        self.app.analyze_scene()
+        self.assertNotEqual(breakdown.g_cached_sg_publish_data, {})
+
+        archive_path = os.path.join(self.tank_temp, "warm_capture.jsonl.gz")
+        get_setting = self.app.get_setting
+        self.app.get_setting = lambda name, default=None: (
+            True if name == "cache_service" else get_setting(name, default)
+        )
+        replay.start_capture(archive_path)
+        try:
+            self.assertIsNone(breakdown.get_cache_client(self.app))
+            scene_data = self.app.analyze_scene()
+        finally:
+            replay.stop_capture()
+            del self.app.get_setting
+        self.assertTrue(all(i["sg_data"] for i in scene_data))
+
+        replayed = self.app.replay_scene(archive_path, speed=0)
+        self.assertEqual(
+            [i["sg_data"] for i in replayed], [i["sg_data"] for i in scene_data]
+        )
+
+    def test_snapshot(self):
+        """
+        Tests exporting a breakdown to a snapshot and loading it back
+        """
+        snapshot_path = os.path.join(self.tank_temp, "snapshot.jsonl.gz")
+        os.environ["TEST_SCENE_PATH"] = "/scene_a.ma"
+        computed = []
+        compute_highest_version = self.app.compute_highest_version
+
+        def counting_compute_highest_version(template, fields):
+            computed.append(fields["version"])
+            return compute_highest_version(template, fields)
+
+        self.app.compute_highest_version = counting_compute_highest_version
+        try:
+            self.assertEqual(self.app.export_snapshot(snapshot_path), 2)
+        finally:
+            del os.environ["TEST_SCENE_PATH"]
+            del self.app.compute_highest_version
+        # both items are versions of the same file
+        self.assertEqual(len(computed), 1)
+
+        snapshot = self.app.load_snapshot(snapshot_path)
+        self.assertEqual(snapshot.scene_path, "/scene_a.ma")
+
+        scene_data = self.app.analyze_scene()
+        items = list(snapshot)
+        self.assertEqual(len(items), 2)
+        for (item, scene_item) in zip(items, scene_data):
+            self.assertEqual(item.template_name, "maya_shot_publish")
+            self.assertEqual(item["template"], scene_item["template"])
+            self.assertEqual(item["fields"], scene_item["fields"])
+            self.assertEqual(item["sg_data"], scene_item["sg_data"])
+            self.assertEqual(item["latest_version"], 4)
+            self.assertEqual(
+                self.app.compute_highest_version(item["template"], item["fields"]), 4
+            )
+
+        # uncompressed, without versions
+        snapshot_path = os.path.join(self.tank_temp, "snapshot.jsonl")
+        self.app.export_snapshot(snapshot_path, latest_versions=False)
+        self.assertEqual(
+            [i["latest_version"] for i in self.app.load_snapshot(snapshot_path)],
+            [None, None],
+        )
+
+        self.assertRaises(TankError, self.app.load_snapshot, self.test_path_1)
+
     def test_update(self):
         """
         Test scene update
@@ -219,3 +795,1093 @@ class TestApi(TestApplication):
         self.assertEqual(sgtk._hook_items[0]["node"], "maya_publish")
         self.assertEqual(sgtk._hook_items[0]["path"], self.test_path_2)
         self.assertEqual(sgtk._hook_items[0]["type"], "TestNode")
+
+    def test_update_items(self):
+        """
+        Tests updating items in slices, synchronously and in the background
+        """
+        scene_data = self.app.analyze_scene()
+        for item in scene_data:
+            item["fields"]["version"] = 4
+
+        sgtk._hook_items = None
+        self.app.update_items(scene_data)
+        self.assertEqual([i["path"] for i in sgtk._hook_items], [self.test_path_2] * 2)
+
+        update_executor = self.app.import_module("tk_multi_breakdown").update_executor
+        items = [
+            {
+                "node": "node%d" % i,
+                "type": ("file", "reference")[i % 2],
+                "path": "/%d" % i,
+            }
+            for i in range(7)
+        ]
+        slices = update_executor.get_slices(items, slice_size=2)
+        self.assertEqual(
+            [[i["node"] for i in s] for s in slices],
+            [["node0", "node2"], ["node4", "node6"], ["node1", "node3"], ["node5"]],
+        )
+
+        # record the slices passed to the hook
+        calls = []
+        self.app.execute_hook_method = lambda hook, method, items: calls.append(items)
+        try:
+            executor = update_executor.UpdateExecutor(self.app, slice_size=2)
+
+            progress = []
+            executor.run(items, progress_callback=lambda *args: progress.append(args))
+            self.assertEqual(calls, slices)
+            self.assertEqual(progress, [(2, 7), (4, 7), (6, 7), (7, 7)])
+
+            del calls[:]
+            handle = executor.submit(items)
+            self.assertEqual(len(handle.result(timeout=10)), 7)
+            self.assertTrue(handle.done())
+            self.assertFalse(handle.cancelled())
+            self.assertEqual(calls, slices)
+
+            # cancelled after the first slice
+            del calls[:]
+            handles = []
+            submitted = threading.Event()
+            done = threading.Event()
+
+            def cancel(updated, total):
+                submitted.wait()
+                handles[0].cancel()
+
+            handles.append(
+                executor.submit(
+                    items,
+                    progress_callback=cancel,
+                    done_callback=lambda h: done.set(),
+                )
+            )
+            submitted.set()
+            handle = handles[0]
+            self.assertRaises(
+                update_executor.UpdateCancelled, handle.result, timeout=10
+            )
+            self.assertTrue(handle.cancelled())
+            self.assertEqual(handle.progress, (2, 7))
+            self.assertEqual(calls, slices[:1])
+            self.assertTrue(done.wait(10))
+
+            # the hook reports the user cancelled during the second slice, each
+            # slice being its own undo step, after the first of its items
+            def update(hook, method, items):
+                calls.append(items)
+                if len(calls) == 2:
+                    return items[:1]
+
+            self.app.execute_hook_method = update
+            del calls[:]
+            progress = []
+            executor.run(items, progress_callback=lambda *args: progress.append(args))
+            self.assertEqual(calls, slices[:2])
+            self.assertEqual(progress, [(2, 7), (3, 7)])
+
+            del calls[:]
+            handle = executor.submit(items)
+            self.assertRaises(
+                update_executor.UpdateCancelled, handle.result, timeout=10
+            )
+            self.assertTrue(handle.cancelled())
+            self.assertEqual(handle.progress, (3, 7))
+            self.assertEqual(handle.updated, slices[0] + slices[1][:1])
+            self.assertEqual(calls, slices[:2])
+        finally:
+            del self.app.execute_hook_method
+
+    def test_check_update_targets(self):
+        """
+        Tests the pre-flight checks of the files to update to
+        """
+        preflight = self.app.import_module("tk_multi_breakdown").preflight
+        scene_data = self.app.analyze_scene()
+        scene_data[0]["fields"]["version"] = 4
+        scene_data[1]["fields"]["version"] = 99
+
+        plan = self.app.check_update_targets(scene_data)
+        self.assertEqual(
+            [c.status for c in plan.checks], [preflight.OK, preflight.MISSING]
+        )
+        self.assertEqual(
+            plan.get_items(),
+            [
+                {
+                    "node": scene_data[0]["node_name"],
+                    "type": scene_data[0]["node_type"],
+                    "path": self.test_path_2,
+                }
+            ],
+        )
+        self.assertEqual(plan.total_size, os.path.getsize(self.test_path_2))
+
+        # frame sequences must have no gaps in their own range
+        template = self.tk.templates["nuke_shot_render_pub_mono_dpx"]
+        fields = {
+            "Sequence": self.seq["code"],
+            "Shot": self.shot["code"],
+            "Step": self.step["short_name"],
+            "name_alpha": "comp",
+            "channel": "output",
+            "width": 2048,
+            "height": 1556,
+        }
+        frames = {1: range(1001, 1011), 2: range(1001, 1011), 3: [1001, 1002, 1005]}
+        for (version, version_frames) in frames.items():
+            fields["version"] = version
+            os.makedirs(template.parent.apply_fields(fields))
+            for frame in version_frames:
+                fields["frame"] = frame
+                with open(template.apply_fields(fields), "wt") as fh:
+                    fh.write("dpx")
+        fields["frame"] = "FORMAT: %d"
+
+        items = []
+        for version in (2, 3, 4):
+            new_fields = dict(fields, version=version)
+            items.append(
+                {
+                    "node_type": "Read",
+                    "node_name": "Read%d" % version,
+                    "template": template,
+                    "fields": new_fields,
+                    "current_fields": dict(fields, version=1),
+                }
+            )
+        plan = self.app.check_update_targets(items)
+        self.assertEqual(
+            [c.status for c in plan.checks],
+            [preflight.OK, preflight.INCOMPLETE, preflight.MISSING],
+        )
+        self.assertEqual(plan.checks[0].frames, (1001, 1010))
+        self.assertEqual(plan.checks[0].size, 30)
+        self.assertEqual(plan.checks[1].missing_frames, [1003, 1004])
+        self.assertEqual([i["node"] for i in plan.get_items()], ["Read2"])
+        self.assertEqual(
+            [i["node"] for i in plan.get_items(include_incomplete=True)],
+            ["Read2", "Read3"],
+        )
+        self.assertEqual(
+            plan.get_summary(), "1 items to update (30 B), 1 incomplete, 1 missing"
+        )
+
+        # and the frames of the current version as well if required
+        get_setting = self.app.get_setting
+        self.app.get_setting = lambda name, default=None: (
+            True
+            if name == "preflight_require_current_frames"
+            else get_setting(name, default)
+        )
+        try:
+            plan = self.app.check_update_targets(items)
+        finally:
+            del self.app.get_setting
+        self.assertEqual(
+            plan.checks[1].missing_frames, [1003, 1004] + list(range(1006, 1011))
+        )
+        self.assertIn("frames of the current version", plan.checks[1].message)
+
+        # stereo sequences must have all the eyes of the current version, and
+        # no gaps for each eye
+        template = self.tk.templates["nuke_shot_render_pub_stereo"]
+        frames = {
+            1: {"Left": range(1001, 1006), "Right": range(1001, 1006)},
+            2: {"Left": range(1001, 1006), "Right": range(1001, 1004)},
+            3: {"Left": range(1001, 1006)},
+        }
+        for (version, eye_frames) in frames.items():
+            for (eye, version_frames) in eye_frames.items():
+                for frame in version_frames:
+                    fields.update(version=version, eye=eye, frame=frame)
+                    path = template.apply_fields(fields)
+                    if not os.path.exists(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    with open(path, "wt") as fh:
+                        fh.write("exr")
+        del fields["frame"]
+        fields["eye"] = "%V"
+
+        targets = [
+            {
+                "node": "Read%d" % version,
+                "type": "Read",
+                "path": "/stereo.v%03d.%%V.%%04d.exr" % version,
+                "template": template,
+                "fields": dict(fields, version=version),
+                "current_fields": dict(fields, version=1),
+            }
+            for version in (1, 2, 3)
+        ]
+        progress = []
+        plan = preflight.check_targets(
+            self.tk, targets, progress_callback=lambda *args: progress.append(args)
+        )
+        self.assertEqual(
+            [c.status for c in plan.checks],
+            [preflight.OK, preflight.OK, preflight.INCOMPLETE],
+        )
+        self.assertEqual(sorted(progress), [(1, 3), (2, 3), (3, 3)])
+        self.assertEqual(plan.checks[0].num_files, 10)
+        self.assertIn("eye=Right: no files", plan.checks[2].message)
+
+        plan = preflight.check_targets(self.tk, targets, require_current_frames=True)
+        self.assertEqual(
+            [c.status for c in plan.checks],
+            [preflight.OK, preflight.INCOMPLETE, preflight.INCOMPLETE],
+        )
+        self.assertEqual(plan.checks[1].missing_frames, [1004, 1005])
+        self.assertIn("eye=Right: 2", plan.checks[1].message)
+
+        # cancelled checks skip the targets not checked yet
+        cancel_event = threading.Event()
+        progress = []
+
+        def cancel(checked, total):
+            progress.append(checked)
+            cancel_event.set()
+
+        self.assertIsNone(
+            preflight.check_targets(
+                self.tk,
+                targets,
+                max_workers=1,
+                progress_callback=cancel,
+                cancel_event=cancel_event,
+            )
+        )
+        self.assertEqual(progress, [1])
+
+    def test_metrics(self):
+        """
+        Tests the metrics collected by the breakdown
+        """
+        metrics = self.app.import_module("tk_multi_breakdown").metrics
+        metrics.g_registry.reset()
+        self.addCleanup(metrics.g_registry.reset)
+
+        scene_data = self.app.analyze_scene()
+        # the path isn't published, so it is looked up again
+        self.app.analyze_scene()
+        self.app.compute_highest_version(
+            scene_data[0]["template"], scene_data[0]["fields"]
+        )
+
+        values = self.app.get_metrics()
+        self.assertEqual(values["breakdown_scans_total"], 2)
+        self.assertEqual(values["breakdown_scan_items_total"], 4)
+        self.assertEqual(values["breakdown_publish_cache_misses_total"], 2)
+        self.assertEqual(values["breakdown_publish_cache_hit_rate"], 0.0)
+        self.assertEqual(values["breakdown_sg_queries_total"], 2)
+        self.assertEqual(values["breakdown_sg_queries_per_breakdown"]["p50"], 1)
+        self.assertEqual(values["breakdown_version_scan_seconds"]["count"], 1)
+
+        prom_path = os.path.join(self.project_root, "breakdown.prom")
+        metrics.g_registry.write_prometheus_textfile(prom_path)
+        with open(prom_path) as fh:
+            text = fh.read()
+        self.assertIn(
+            "# TYPE breakdown_scans_total counter\nbreakdown_scans_total 2\n", text
+        )
+        self.assertIn('breakdown_version_scan_seconds_bucket{le="+Inf"} 1\n', text)
+
+        # queries sent by other threads aren't counted by the breakdowns
+        with metrics.count_sg_queries() as queries:
+            metrics.inc_sg_queries()
+            thread = threading.Thread(target=metrics.inc_sg_queries, args=(5,))
+            thread.start()
+            thread.join()
+            with metrics.count_sg_queries() as nested_queries:
+                metrics.inc_sg_queries(2)
+        self.assertEqual(nested_queries.value, 2)
+        self.assertEqual(queries.value, 3)
+        self.assertEqual(metrics.sg_queries.value, 10)
+
+    def test_timing(self):
+        """
+        Tests that the breakdown phases are timed when enabled
+        """
+        timing = self.app.import_module("tk_multi_breakdown").timing
+        os.environ[timing.TIMING_ENV_VAR] = "1"
+        self.addCleanup(os.environ.pop, timing.TIMING_ENV_VAR)
+        self.addCleanup(timing.enable, False)
+
+        item = self.app.analyze_scene()[0]
+
+        trace_path = os.path.join(self.app.cache_location, "breakdown_trace.json")
+        events = timing.read_chrome_trace(trace_path)
+        spans = dict((e["name"], e) for e in events)
+        self.assertEqual(
+            sorted(spans),
+            ["find_publish", "find_publish_query", "match_templates", "scan"],
+        )
+        self.assertEqual(spans["scan"]["args"], {"objects": 3})
+        self.assertEqual(spans["match_templates"]["args"], {"objects": 3, "items": 2})
+        self.assertEqual(spans["find_publish_query"]["args"], {"paths": 1, "found": 0})
+        self.assertEqual(timing.get_spans(), [])
+
+        # the API methods are timed without running a breakdown first, and
+        # later flushes append to the trace of the session
+        timing.enable(False)
+        self.app._package = None
+        self.app.compute_highest_version(item["template"], item["fields"])
+        self.assertEqual(
+            [s[0] for s in timing.get_spans()], ["compute_highest_version"]
+        )
+        timing.flush(self.app)
+        self.assertEqual(
+            [e["name"] for e in timing.read_chrome_trace(trace_path)],
+            [e["name"] for e in events] + ["compute_highest_version"],
+        )
+
+        # timing is a no-op when disabled
+        timing.enable(False)
+        with timing.span("compute_highest_version") as s:
+            s.set(items=1)
+        self.assertEqual(timing.get_spans(), [])
+
+
+class TestStartup(TestApplication):
+    """
+    Tests that the app defers its imports until it is used
+    """
+
+    def setUp(self):
+        """
+        Fixtures setup
+        """
+        # record the modules loaded before the engine and the app start
+        self.modules_before_startup = set(sys.modules)
+        super(TestStartup, self).setUp()
+        self.app = self.engine.apps["tk-multi-breakdown"]
+
+    def _get_new_modules(self, *names, since=None):
+        """
+        :param since: Optional set of module names to compare with, defaults to
+                      the modules loaded before setup
+        :returns: Sorted list of the modules loaded since setup, or since the
+                  given modules were loaded, whose names contain one of the
+                  given names
+        """
+        if since is None:
+            since = self.modules_before_startup
+        return sorted(
+            m for m in set(sys.modules) - since if any(name in m for name in names)
+        )
+
+    def test_startup_imports(self):
+        """
+        Tests that starting the app imports nothing from its package, and that
+        using the API only loads the modules it needs, and not the frameworks
+        or Qt
+        """
+        self.assertIn("Legacy Breakdown...", self.engine.commands)
+        self.assertEqual(self._get_new_modules("tk_multi_breakdown"), [])
+        modules_after_init = set(sys.modules)
+
+        self.app.analyze_scene()
+
+        self.assertEqual(
+            sorted(
+                m.rsplit("tk_multi_breakdown", 1)[1]
+                for m in self._get_new_modules("tk_multi_breakdown")
+            ),
+            ["", ".breakdown", ".metrics", ".replay", ".single_flight", ".timing"],
+        )
+        self.assertEqual(
+            self._get_new_modules(
+                "scene_browser",
+                "breakdown_list_item",
+                "dialog",
+                "dependency_index",
+                "browser_widget",
+                "shotgun_globals",
+                "PySide",
+                "PyQt",
+            ),
+            [],
+        )
+        # nor the modules of the optional features
+        self.assertEqual(
+            self._get_new_modules(
+                "socketserver",
+                "sqlite3",
+                "concurrent.futures",
+                "gzip",
+                "statistics",
+                since=modules_after_init,
+            ),
+            [],
+        )
+
+
+class TestSingleFlight(TestApplication):
+    """
+    Concurrency stress tests of the coalescing of publish and version lookups
+    """
+
+    NUM_THREADS = 16
+
+    def setUp(self):
+        """
+        Fixtures setup
+        """
+        super(TestSingleFlight, self).setUp()
+        self.app = self.engine.apps["tk-multi-breakdown"]
+        self.tk_multi_breakdown = self.app.import_module("tk_multi_breakdown")
+
+        publish_folder = os.path.join(
+            self.project_root,
+            "sequences",
+            self.seq["code"],
+            self.shot["code"],
+            self.step["short_name"],
+            "publish",
+        )
+        for version in (3, 4):
+            with open(os.path.join(publish_folder, "foo.v%03d.ma" % version), "wt"):
+                pass
+        self.test_path_1 = os.path.join(publish_folder, "foo.v003.ma")
+
+        # read by the fixture hook
+        os.environ["TEST_PATH_1"] = self.test_path_1
+        os.environ["TEST_PATH_1_DUPE"] = self.test_path_1
+
+    def _run_concurrently(self, fn, num_threads=NUM_THREADS):
+        """
+        Runs fn(index) from several threads released at the same time.
+
+        :returns: List of the results, or exceptions, by thread index
+        """
+        barrier = threading.Barrier(num_threads)
+        results = [None] * num_threads
+
+        def run(index):
+            barrier.wait()
+            try:
+                results[index] = fn(index)
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _counting(self, fn, calls, delay=0.2):
+        """
+        Wraps fn to count its calls and make it slow enough for the other
+        threads to pile up behind it.
+        """
+        lock = threading.Lock()
+
+        def wrapper(*args, **kwargs):
+            with lock:
+                calls.append(args)
+            time.sleep(delay)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    def test_do(self):
+        """
+        Tests that concurrent calls for the same key run once and share
+        the result or the error
+        """
+        flights = self.tk_multi_breakdown.single_flight.SingleFlight()
+        calls = []
+        lookup = self._counting(lambda key: "result %s" % key, calls)
+
+        results = self._run_concurrently(lambda i: flights.do(i % 4, lookup, i % 4))
+        self.assertEqual(sorted(calls), [(0,), (1,), (2,), (3,)])
+        self.assertEqual(results, ["result %d" % (i % 4) for i in range(16)])
+
+        def fail():
+            calls.append("fail")
+            time.sleep(0.2)
+            raise TankError("Failed to find any files!")
+
+        del calls[:]
+        results = self._run_concurrently(lambda i: flights.do("fail", fail))
+        self.assertEqual(calls, ["fail"])
+        self.assertTrue(all(isinstance(r, TankError) for r in results))
+
+        # nothing is kept once the calls are over
+        self.assertEqual(flights.do("fail", lambda: 1), 1)
+
+    def test_do_batch(self):
+        """
+        Tests that overlapping batches only look up each key once
+        """
+        flights = self.tk_multi_breakdown.single_flight.SingleFlight()
+        calls = []
+        lookup = self._counting(
+            lambda keys: dict((k, k * 10) for k in keys if k % 2), calls
+        )
+
+        results = self._run_concurrently(
+            lambda i: flights.do_batch(range(i, i + 8), lookup)
+        )
+        looked_up = [k for (keys,) in calls for k in keys]
+        self.assertEqual(sorted(looked_up), sorted(set(looked_up)))
+        for (i, result) in enumerate(results):
+            self.assertEqual(
+                result, dict((k, k * 10) for k in range(i, i + 8) if k % 2)
+            )
+
+    def test_concurrent_publish_lookups(self):
+        """
+        Tests that concurrent breakdowns of the same paths send a single
+        Shotgun query
+        """
+        breakdown = self.tk_multi_breakdown.breakdown
+        calls = []
+        self.mockgun.find = self._counting(self.mockgun.find, calls)
+
+        scene_objects = [
+            {"node": "maya_publish", "type": "TestNode", "path": self.test_path_1}
+        ]
+        cache = {}
+
+        def fetch(index):
+            items = breakdown.resolve_scene_objects(self.tk, scene_objects)
+            breakdown.fetch_publish_data(self.tk, items, cache)
+            return items
+
+        fetch(0)
+        num_queries = len(calls)
+        self.assertNotEqual(num_queries, 0)
+
+        del calls[:]
+        results = self._run_concurrently(fetch)
+        self.assertEqual(len(calls), num_queries)
+        self.assertEqual([len(r) for r in results], [1] * self.NUM_THREADS)
+
+    def test_concurrent_version_scans(self):
+        """
+        Tests that concurrent version lookups of the same file share a
+        single disk scan
+        """
+        item = self.app.analyze_scene()[0]
+        calls = []
+        self.tk.paths_from_template = self._counting(self.tk.paths_from_template, calls)
+
+        results = self._run_concurrently(
+            lambda i: self.tk_multi_breakdown.versions.get_highest_version(
+                self.tk, item["template"], dict(item["fields"])
+            )
+        )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [4] * self.NUM_THREADS)
+
+
+class TestBatch(TestApplication):
+    """
+    Tests for the headless batch breakdown
+    """
+
+    def setUp(self):
+        """
+        Fixtures setup
+        """
+        super(TestBatch, self).setUp()
+
+        app = self.engine.apps["tk-multi-breakdown"]
+        tk_multi_breakdown = app.import_module("tk_multi_breakdown")
+        self.batch = importlib.import_module(tk_multi_breakdown.__name__ + ".batch")
+
+        publish_folder = os.path.join(
+            self.project_root,
+            "sequences",
+            self.seq["code"],
+            self.shot["code"],
+            self.step["short_name"],
+            "publish",
+        )
+        self.publish_path = os.path.join(publish_folder, "bar.v001.ma")
+        for version in [1, 2, 5]:
+            fh = open(os.path.join(publish_folder, "bar.v%03d.ma" % version), "wt")
+            fh.write("hello")
+            fh.close()
+
+        self.scene_path = os.path.join(self.project_root, "scene.ma")
+        fh = open(self.scene_path, "wt")
+        fh.write('file -r -ns "bar" -rfn "barRN" "%s";\n' % self.publish_path)
+        fh.write('setAttr ".ftn" -type "string" "/foo/bar.exr";\n')
+        fh.close()
+
+    def test_find_scene_files(self):
+        """
+        Tests that glob patterns are expanded to existing files
+        """
+        self.assertEqual(
+            self.batch.find_scene_files(
+                [os.path.join(self.project_root, "*.ma"), self.scene_path]
+            ),
+            [self.scene_path],
+        )
+
+    def test_process_scene(self):
+        """
+        Tests the breakdown of a scene file without a DCC
+        """
+        publish_cache = {}
+        version_cache = {}
+        records = self.batch.process_scene(
+            self.tk, self.scene_path, publish_cache, version_cache
+        )
+
+        # only the path matching a template is returned
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record["scene"], self.scene_path)
+        self.assertEqual(record["node"], "barRN")
+        self.assertEqual(record["type"], "reference")
+        self.assertEqual(record["template"], "maya_shot_publish")
+        self.assertEqual(record["version"], 1)
+        self.assertEqual(record["latest_version"], 5)
+        self.assertEqual(record["sg_data"], None)
+        # records can be written as json lines
+        json.dumps(record)
+
+        # the version was cached and is reused
+        self.assertEqual(list(version_cache.values()), [5])
+        records = self.batch.process_scene(
+            self.tk, self.scene_path, publish_cache, version_cache
+        )
+        self.assertEqual(records[0]["latest_version"], 5)
+
+
+class TestSceneParsers(TestApplication):
+    """
+    Tests for the offline scene file parsers
+    """
+
+    def setUp(self):
+        """
+        Fixtures setup
+        """
+        super(TestSceneParsers, self).setUp()
+
+        app = self.engine.apps["tk-multi-breakdown"]
+        tk_multi_breakdown = app.import_module("tk_multi_breakdown")
+        self.scene_parsers = importlib.import_module(
+            tk_multi_breakdown.__name__ + ".scene_parsers"
+        )
+
+    def _write_scene(self, file_name, lines):
+        """
+        Writes a scene file with the given lines and returns its path
+        """
+        scene_path = os.path.join(self.project_root, file_name)
+        fh = open(scene_path, "wt")
+        fh.write("\n".join(lines) + "\n")
+        fh.close()
+        return scene_path
+
+    def test_maya_ascii(self):
+        """
+        Tests that references and file nodes are extracted from .ma files
+        """
+        scene_path = self._write_scene(
+            "scene.ma",
+            [
+                "//Maya ASCII 2020 scene",
+                'file -rdi 1 -ns "a" -rfn "aRN" -typ "mayaAscii" "/proj/a.v001.ma";',
+                'file -rdi 2 -ns "b" -rfn "a:bRN" -typ "mayaAscii" "/proj/b.v001.ma";',
+                'file -r -ns "a" -dr 1 -rfn "aRN" -typ "mayaAscii" "/proj/a.v001.ma";',
+                'file -r -ns "a1" -dr 1 -rfn "aRN1" -typ "mayaAscii" "/proj/a.v001.ma{1}";',
+                'createNode mesh -n "meshShape";',
+                '\tsetAttr -s 4 ".vt[0:3]" 0 0 0 1 0 0',
+                "\t\t 1 1 0 0 1 0;",
+                'createNode file -n "file1";',
+                '\tsetAttr ".ftn" -type "string" "/proj/tex/wood.v002.exr";',
+                'createNode file -n "file2";',
+                'createNode place2dTexture -n "place2dTexture1";',
+            ],
+        )
+
+        self.assertEqual(
+            list(self.scene_parsers.scan_scene_file(scene_path)),
+            [
+                {
+                    "node": "aRN",
+                    "type": "reference",
+                    "path": "/proj/a.v001.ma".replace("/", os.path.sep),
+                },
+                {
+                    "node": "aRN1",
+                    "type": "reference",
+                    "path": "/proj/a.v001.ma".replace("/", os.path.sep),
+                },
+                {
+                    "node": "file1",
+                    "type": "file",
+                    "path": "/proj/tex/wood.v002.exr".replace("/", os.path.sep),
+                },
+                {"node": "file2", "type": "file", "path": ""},
+            ],
+        )
+
+    def test_nuke_script(self):
+        """
+        Tests that nodes, including nodes inside groups, are extracted from .nk files
+        """
+        scene_path = self._write_scene(
+            "scene.nk",
+            [
+                "version 13.2 v4",
+                "Root {",
+                " inputs 0",
+                " name /proj/scene.nk",
+                "}",
+                "Read {",
+                " inputs 0",
+                " file /proj/render.v001.%04d.exr",
+                " name Read1",
+                "}",
+                "Group {",
+                " name Group1",
+                "}",
+                " Camera2 {",
+                '  file "/proj/cam.v003.abc"',
+                "  label {multi",
+                'line "}" label}',
+                "  name Camera1",
+                " }",
+                "end_group",
+                "Write {",
+                " file /proj/write.v001.exr",
+                " name Write1",
+                "}",
+            ],
+        )
+
+        self.assertEqual(
+            list(self.scene_parsers.scan_scene_file(scene_path)),
+            [
+                {
+                    "node": "Read1",
+                    "type": "Read",
+                    "path": "/proj/render.v001.%04d.exr".replace("/", os.path.sep),
+                },
+                {
+                    "node": "Group1.Camera1",
+                    "type": "Camera2",
+                    "path": "/proj/cam.v003.abc".replace("/", os.path.sep),
+                },
+            ],
+        )
+
+    def test_unsupported_scene(self):
+        """
+        Tests that scene files other than .ma and .nk files are rejected
+        """
+        for file_name in ("scene.mb", "scene.hip"):
+            scene_path = self._write_scene(file_name, ["/proj/a.v001.ma"])
+            self.assertRaises(TankError, self.scene_parsers.scan_scene_file, scene_path)
+
+
+class TestDependencyIndex(TestApplication):
+    """
+    Tests for the reverse dependency index
+    """
+
+    def setUp(self):
+        """
+        Fixtures setup
+        """
+        super(TestDependencyIndex, self).setUp()
+
+        self.app = self.engine.apps["tk-multi-breakdown"]
+        tk_multi_breakdown = self.app.import_module("tk_multi_breakdown")
+        self.index = tk_multi_breakdown.breakdown.get_dependency_index(self.app)
+
+        self.asset = {"type": "Asset", "id": 5, "name": "chair"}
+        self.items = [
+            {
+                "node_name": "chairRN",
+                "node_type": "reference",
+                "template": self.tk.templates["maya_asset_publish"],
+                "fields": {"Asset": "chair", "version": 3},
+                "sg_data": {"id": 12, "entity": self.asset},
+            },
+            {
+                "node_name": "file1",
+                "node_type": "file",
+                "template": self.tk.templates["maya_shot_publish"],
+                "fields": {"Shot": "shot_code", "version": 1},
+                "sg_data": None,
+            },
+        ]
+
+    def test_find_dependent_scenes(self):
+        """
+        Tests reverse lookups by publish, entity and template
+        """
+        self.index.upsert_scene("/scene_a.ma", self.items)
+        self.index.upsert_scene("/scene_b.ma", self.items[:1])
+
+        by_publish = self.app.find_dependent_scenes(publish_id=12)
+        self.assertEqual(
+            [r["scene"] for r in by_publish], ["/scene_a.ma", "/scene_b.ma"]
+        )
+        self.assertEqual(by_publish[0]["node_name"], "chairRN")
+        self.assertEqual(by_publish[0]["version"], 3)
+        self.assertEqual(by_publish[0]["entity"], {"type": "Asset", "id": 5})
+
+        by_entity = self.app.find_dependent_scenes(entity=self.asset)
+        self.assertEqual(len(by_entity), 2)
+
+        by_template = self.app.find_dependent_scenes(template_name="maya_*_publish")
+        self.assertEqual(len(by_template), 3)
+        by_template = self.app.find_dependent_scenes(template_name="maya_shot_publish")
+        self.assertEqual([r["node_name"] for r in by_template], ["file1"])
+
+        self.assertRaises(TankError, self.app.find_dependent_scenes)
+
+    def test_upsert_replaces_scene(self):
+        """
+        Tests that indexing a scene again replaces its previous items
+        """
+        self.index.upsert_scene("/scene_a.ma", self.items)
+        self.index.upsert_scene("/scene_a.ma", self.items[1:])
+
+        self.assertEqual(self.app.find_dependent_scenes(publish_id=12), [])
+        self.assertEqual(list(self.index.get_scenes().keys()), ["/scene_a.ma"])
+
+    def test_hook_without_scene_path(self):
+        """
+        Tests that a scene operations hook lacking get_current_scene_path
+        doesn't fail the breakdown
+        """
+        breakdown = self.app.import_module("tk_multi_breakdown").breakdown
+
+        def execute_hook_method(hook, method, **kwargs):
+            raise AttributeError(method)
+
+        self.app.execute_hook_method = execute_hook_method
+        try:
+            self.assertEqual(breakdown.get_current_scene_path(self.app), None)
+            breakdown._update_dependency_index(self.app, None, self.items)
+        finally:
+            del self.app.execute_hook_method
+        self.assertEqual(list(self.index.get_scenes().keys()), [])
+
+
+class TestCacheService(TestApplication):
+    """
+    Tests for the workstation local cache service, run in a thread of the
+    test process
+    """
+
+    def setUp(self):
+        """
+        Fixtures setup
+        """
+        super(TestCacheService, self).setUp()
+        self.app = self.engine.apps["tk-multi-breakdown"]
+        self.tk_multi_breakdown = self.app.import_module("tk_multi_breakdown")
+        self.cache_service = self.tk_multi_breakdown.cache_service
+
+        if not self.cache_service.is_supported():
+            self.skipTest("Unix sockets are not available on this platform.")
+
+        # unix socket paths are limited to about a hundred characters
+        self.folder = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.folder, "cache.sock")
+        self.persist_path = os.path.join(self.folder, "cache.json")
+        self.server = self._start_server()
+        self.client = self.cache_service.CacheClient(self.socket_path)
+
+    def tearDown(self):
+        """
+        Stops the service
+        """
+        self._stop_server()
+        super(TestCacheService, self).tearDown()
+
+    def _start_server(self, **kwargs):
+        server = self.cache_service.CacheServer(
+            self.socket_path, persist_path=self.persist_path, **kwargs
+        )
+        thread = threading.Thread(target=server.serve)
+        thread.daemon = True
+        thread.start()
+        server.thread = thread
+        return server
+
+    def _stop_server(self):
+        if self.server:
+            self.server.stop()
+            self.server.thread.join()
+            self.server = None
+
+    def test_get_put(self):
+        """
+        Tests storing and retrieving values, by namespace
+        """
+        self.assertTrue(self.client.ping())
+        self.assertTrue(self.client.put_many("a", {"x": 1, "y": {"id": 2}}))
+        self.assertEqual(
+            self.client.get_many("a", ["x", "y", "z"]), {"x": 1, "y": {"id": 2}}
+        )
+        self.assertEqual(self.client.get_many("b", ["x"]), {})
+        self.assertEqual(self.client.stats()["entries"], 2)
+
+    def test_concurrent_clients(self):
+        """
+        Tests that the service serves several clients at the same time
+        """
+        clients = [self.cache_service.CacheClient(self.socket_path) for _ in range(8)]
+        errors = []
+
+        def run(index):
+            try:
+                for i in range(50):
+                    key = "%d-%d" % (index, i)
+                    clients[index].put_many("a", {key: i})
+                    self.assertEqual(clients[index].get_many("a", [key]), {key: i})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.client.stats()["entries"], 400)
+
+    def test_lru_and_ttl(self):
+        """
+        Tests that the least recently used and the expired entries are dropped
+        """
+        cache = self.cache_service.LRUCache(max_entries=2)
+        cache.put_many("a", {"x": 1, "y": 2})
+        cache.get_many("a", ["x"])
+        cache.put_many("a", {"z": 3})
+        self.assertEqual(cache.get_many("a", ["x", "y", "z"]), {"x": 1, "z": 3})
+
+        cache.put_many("a", {"x": 1}, ttl=0.01)
+        time.sleep(0.05)
+        self.assertEqual(cache.get_many("a", ["x"]), {})
+
+    def test_persistence(self):
+        """
+        Tests that the cache is reloaded when the service restarts
+        """
+        self.client.put_many("a", {"x": 1})
+        self.client.put_many("a", {"y": 2}, ttl=0.01)
+        self._stop_server()
+        self.assertTrue(os.path.exists(self.persist_path))
+        self.assertFalse(os.path.exists(self.socket_path))
+
+        time.sleep(0.05)
+        self.server = self._start_server()
+        client = self.cache_service.CacheClient(self.socket_path)
+        self.assertEqual(client.get_many("a", ["x", "y"]), {"x": 1})
+
+    def test_fallback(self):
+        """
+        Tests that the breakdown resolves everything in-process when the
+        service goes away
+        """
+        self._stop_server()
+        client = self.cache_service.CacheClient(
+            os.path.join(self.folder, "missing.sock")
+        )
+        self.assertFalse(client.ping())
+        self.assertFalse(client.available)
+        self.assertEqual(client.get_many("a", ["x"]), {})
+        self.assertFalse(client.put_many("a", {"x": 1}))
+
+        # the setting is off in the fixtures
+        self.assertEqual(self.cache_service.get_client(self.app), None)
+
+    def test_socket_ownership(self):
+        """
+        Tests that the socket is in a folder only the user can access, and
+        that clients don't talk to a service run by another user
+        """
+        runtime_folder = os.path.join(self.folder, "runtime")
+        os.makedirs(runtime_folder)
+        xdg_runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+        os.environ["XDG_RUNTIME_DIR"] = runtime_folder
+        try:
+            socket_path = self.cache_service.get_default_socket_path()
+        finally:
+            if xdg_runtime_dir is None:
+                del os.environ["XDG_RUNTIME_DIR"]
+            else:
+                os.environ["XDG_RUNTIME_DIR"] = xdg_runtime_dir
+        self.assertEqual(os.path.dirname(os.path.dirname(socket_path)), runtime_folder)
+        self.assertEqual(os.stat(os.path.dirname(socket_path)).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o077, 0)
+
+        self.assertTrue(self.client.ping())
+        self.cache_service.check_owner(self.socket_path)
+
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            self.assertRaises(IOError, self.cache_service.check_owner, self.socket_path)
+            client = self.cache_service.CacheClient(self.socket_path)
+            self.assertFalse(client.ping())
+        finally:
+            os.getuid = getuid
+
+    def test_publish_lookups(self):
+        """
+        Tests that publishes resolved by another process are used without
+        querying Shotgun
+        """
+        breakdown = self.tk_multi_breakdown.breakdown
+        path = os.path.join(self.project_root, "foo.v001.ma")
+        sg_data = {"type": "PublishedFile", "id": 12, "version_number": 1}
+        self.client.put_many(breakdown._get_publish_namespace(self.tk), {path: sg_data})
+
+        queries = self.tk_multi_breakdown.metrics.sg_queries.value
+        items = [{"path": path}]
+        cache = {}
+        breakdown.fetch_publish_data(self.tk, items, cache, service=self.client)
+        self.assertEqual(items[0]["sg_data"], sg_data)
+        self.assertEqual(cache[path], sg_data)
+        self.assertEqual(self.tk_multi_breakdown.metrics.sg_queries.value, queries)
+
+    def test_version_lookups(self):
+        """
+        Tests that highest versions are shared through the service
+        """
+        versions = self.tk_multi_breakdown.versions
+        publish_folder = os.path.join(
+            self.project_root,
+            "sequences",
+            self.seq["code"],
+            self.shot["code"],
+            self.step["short_name"],
+            "publish",
+        )
+        for version in (3, 4):
+            with open(os.path.join(publish_folder, "foo.v%03d.ma" % version), "wt"):
+                pass
+
+        template = self.tk.templates["maya_shot_publish"]
+        fields = template.get_fields(os.path.join(publish_folder, "foo.v003.ma"))
+        self.assertEqual(
+            versions.get_highest_version(self.tk, template, fields, self.client), 4
+        )
+        self.assertEqual(self.client.stats()["entries"], 1)
+
+        # the shared version is used rather than scanning the disk again
+        with open(os.path.join(publish_folder, "foo.v005.ma"), "wt"):
+            pass
+        self.assertEqual(
+            versions.get_highest_version(self.tk, template, fields, self.client), 4
+        )
+        self.assertEqual(versions.get_highest_version(self.tk, template, fields), 5)
@@ -0,0 +1,300 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import contextlib
+import importlib.util
+import os
+import sys
+import types
+import unittest
+
+
+class MockNodeType(object):
+    def __init__(self, name, category="Sop"):
+        self._name = name
+        self._category = types.SimpleNamespace(name=lambda: category)
+
+    def name(self):
+        return self._name
+
+    def category(self):
+        return self._category
+
+
+class MockParm(object):
+    def __init__(self, node, name, value, locked=False):
+        self._node = node
+        self._name = name
+        self.value = value
+        self.locked = locked
+
+    def node(self):
+        return self._node
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        return "%s/%s" % (self._node.path(), self._name)
+
+    def unexpandedString(self):
+        return self.value
+
+    def eval(self):
+        return self.value
+
+    def isLocked(self):
+        return self.locked
+
+    def keyframes(self):
+        return ()
+
+    def getReferencedParm(self):
+        return self
+
+    def set(self, value):
+        self.value = value
+
+
+class MockNode(object):
+    def __init__(self, path, node_type, category="Sop"):
+        self._path = path
+        self._type = MockNodeType(node_type, category)
+        self.parms = {}
+
+    def path(self):
+        return self._path
+
+    def type(self):
+        return self._type
+
+    def parm(self, name):
+        return self.parms.get(name)
+
+    def add_parm(self, name, value, **kwargs):
+        self.parms[name] = MockParm(self, name, value, **kwargs)
+        return self.parms[name]
+
+
+class MockHoudiniScene(object):
+    """
+    Minimal in-memory houdini scene exposing the subset of the hou module used
+    by the houdini scene operations hook.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        # parms resolved by path, on top of the parms of the nodes
+        self.extra_parms = {}
+        self.undo_groups = []
+        # number of progress updates after which the operation is interrupted
+        self.interrupt_after = None
+
+    def add_node(self, path, node_type, category="Sop"):
+        self.nodes[path] = MockNode(path, node_type, category)
+        return self.nodes[path]
+
+    def build_module(self):
+        """
+        Returns a fake hou module suitable for sys.modules.
+        """
+        scene = self
+        hou = types.ModuleType("hou")
+
+        class OperationInterrupted(Exception):
+            pass
+
+        class InterruptableOperation(object):
+            def __init__(self, name, open_interrupt_dialog=False):
+                self._updates = 0
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                return False
+
+            def updateProgress(self, fraction):
+                self._updates += 1
+                if scene.interrupt_after == self._updates:
+                    raise OperationInterrupted()
+
+        @contextlib.contextmanager
+        def group(name):
+            scene.undo_groups.append(name)
+            yield
+
+        def file_references():
+            return [
+                (parm, parm.value)
+                for node in scene.nodes.values()
+                for parm in node.parms.values()
+            ]
+
+        def parm(path):
+            if path in scene.extra_parms:
+                return scene.extra_parms[path]
+            (node_path, _, name) = path.rpartition("/")
+            node = scene.nodes.get(node_path)
+            return node.parm(name) if node else None
+
+        hou.OperationInterrupted = OperationInterrupted
+        hou.InterruptableOperation = InterruptableOperation
+        hou.undos = types.SimpleNamespace(group=group)
+        hou.updateMode = types.SimpleNamespace(Manual="manual", AutoUpdate="auto")
+        hou.updateModeSetting = lambda: "auto"
+        hou.setUpdateMode = lambda mode: None
+        hou.fileReferences = file_references
+        hou.parm = parm
+        hou.node = scene.nodes.get
+        hou.hipFile = types.SimpleNamespace(path=lambda: "/proj/scene.hip")
+        return hou
+
+
+class MockEngine(object):
+    def __init__(self):
+        self.messages = []
+
+    def log_debug(self, msg):
+        self.messages.append(("debug", msg))
+
+    def log_info(self, msg):
+        self.messages.append(("info", msg))
+
+    def log_warning(self, msg):
+        self.messages.append(("warning", msg))
+
+
+class TestHoudiniSceneOperations(unittest.TestCase):
+    """
+    Tests the houdini scene operations hook against a mocked hou.
+    """
+
+    def setUp(self):
+        self.scene = MockHoudiniScene()
+        self.alembic = self.scene.add_node("/obj/geo1/alembic1", "alembic")
+        self.alembic.add_parm("fileName", "/proj/geo/chair.v001.abc")
+        self.file_sop = self.scene.add_node("/obj/geo1/file1", "file")
+        self.file_sop.add_parm("file", "/proj/geo/table.v002.bgeo")
+        locked = self.scene.add_node("/obj/geo1/file2", "file")
+        locked.add_parm("file", "/proj/geo/lamp.v001.bgeo", locked=True)
+        rop = self.scene.add_node("/out/geometry1", "rop_geometry", "Driver")
+        rop.add_parm("sopoutput", "/proj/cache/out.v001.bgeo")
+
+        hou = self.scene.build_module()
+        saved = sys.modules.get("hou")
+        sys.modules["hou"] = hou
+
+        def restore():
+            if saved is None:
+                del sys.modules["hou"]
+            else:
+                sys.modules["hou"] = saved
+
+        self.addCleanup(restore)
+
+        hook_path = os.path.join(
+            os.path.dirname(__file__), "..", "hooks", "tk-houdini_scene_operations.py"
+        )
+        spec = importlib.util.spec_from_file_location(
+            "test_tk_houdini_scene_operations", hook_path
+        )
+        hook_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(hook_module)
+
+        self.engine = MockEngine()
+        self.hook = hook_module.BreakdownSceneOperations(
+            types.SimpleNamespace(engine=self.engine)
+        )
+
+    def test_scan(self):
+        """
+        Ensures alembic SOPs are addressed by node path and the other file
+        references by parm path, skipping locked parms and outputs.
+        """
+        self.assertEqual(
+            self.hook.scan_scene(),
+            [
+                {
+                    "node": "/obj/geo1/alembic1",
+                    "type": "alembic",
+                    "path": os.path.normpath("/proj/geo/chair.v001.abc"),
+                },
+                {
+                    "node": "/obj/geo1/file1/file",
+                    "type": "file",
+                    "path": os.path.normpath("/proj/geo/table.v002.bgeo"),
+                },
+            ],
+        )
+
+    def test_update(self):
+        """
+        Ensures alembic items update the file of their node, even when their
+        path also resolves as a parm, and the other items their parm.
+        """
+        decoy = MockParm(self.file_sop, "decoy", "/proj/other.v001.abc")
+        self.scene.extra_parms["/obj/geo1/alembic1"] = decoy
+
+        result = self.hook.update(
+            [
+                {
+                    "node": "/obj/geo1/alembic1",
+                    "type": "alembic",
+                    "path": "/proj/geo/chair.v002.abc",
+                },
+                {
+                    "node": "/obj/geo1/file1/file",
+                    "type": "file",
+                    "path": "/proj/geo/table.v003.bgeo",
+                },
+                {
+                    "node": "/obj/geo1/deleted1/file",
+                    "type": "file",
+                    "path": "/proj/geo/table.v003.bgeo",
+                },
+            ]
+        )
+        self.assertIsNone(result)
+        self.assertEqual(
+            self.alembic.parm("fileName").value, "/proj/geo/chair.v002.abc"
+        )
+        self.assertEqual(decoy.value, "/proj/other.v001.abc")
+        self.assertEqual(self.file_sop.parm("file").value, "/proj/geo/table.v003.bgeo")
+        self.assertEqual(self.scene.undo_groups, ["Breakdown update"])
+        self.assertIn(
+            (
+                "warning",
+                "file parm '/obj/geo1/deleted1/file' not found, it was not updated.",
+            ),
+            self.engine.messages,
+        )
+
+    def test_update_interrupted(self):
+        """
+        Ensures an interrupted update reports the items updated so far, so
+        that the app stops the update.
+        """
+        self.hook.UPDATE_BATCH_SIZE = 1
+        self.scene.interrupt_after = 1
+        items = [
+            {
+                "node": "/obj/geo1/alembic1",
+                "type": "alembic",
+                "path": "/proj/geo/chair.v002.abc",
+            },
+            {
+                "node": "/obj/geo1/file1/file",
+                "type": "file",
+                "path": "/proj/geo/table.v003.bgeo",
+            },
+        ]
+        self.assertEqual(self.hook.update(items), items[:1])
+        self.assertEqual(self.file_sop.parm("file").value, "/proj/geo/table.v002.bgeo")
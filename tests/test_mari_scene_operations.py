@@ -0,0 +1,178 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import importlib.util
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+
+class MockGeoVersion(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class MockGeo(object):
+    def __init__(self, name, version_paths):
+        self._name = name
+        # version name -> publish path, in load order
+        self.version_paths = dict(version_paths)
+        self.current = list(self.version_paths)[-1]
+
+    def name(self):
+        return self._name
+
+    def versionNames(self):
+        return list(self.version_paths)
+
+    def currentVersion(self):
+        return MockGeoVersion(self.current)
+
+    def setCurrentVersion(self, name):
+        self.current = name
+
+
+class MockMariEngine(object):
+    """
+    Mari engine exposing the geometry utility methods used by the hook, and
+    counting the version listings.
+    """
+
+    def __init__(self, geos):
+        self.geos = geos
+        self.version_listings = 0
+
+    def list_geometry(self):
+        return [{"geo": geo} for geo in self.geos]
+
+    def list_geometry_versions(self, geo):
+        self.version_listings += 1
+        return [
+            {"geo_version": MockGeoVersion(name), "path": path}
+            for (name, path) in geo.version_paths.items()
+        ]
+
+    def add_geometry_version(self, geo, sg_publish_data, options):
+        name = "v%03d" % sg_publish_data["version_number"]
+        geo.version_paths[name] = sg_publish_data["path"]
+        return MockGeoVersion(name)
+
+
+class TestMariSceneOperations(unittest.TestCase):
+    """
+    Tests the caches of the mari scene operations hook against a mocked mari.
+    """
+
+    def setUp(self):
+        self.geo = MockGeo(
+            "chair",
+            [("v001", "/proj/chair.v001.obj"), ("v002", "/proj/chair.v002.obj")],
+        )
+        self.engine = MockMariEngine([self.geo])
+        self.publishes = {
+            "/proj/chair.v003.obj": {
+                "id": 3,
+                "path": "/proj/chair.v003.obj",
+                "version_number": 3,
+            }
+        }
+        self.queries = []
+
+        def find_publish(tk, paths, fields):
+            self.queries.append(sorted(paths))
+            return dict((p, self.publishes[p]) for p in paths if p in self.publishes)
+
+        project = types.SimpleNamespace(uuid=lambda: "project-uuid")
+        mari = types.ModuleType("mari")
+        mari.projects = types.SimpleNamespace(current=lambda: project)
+        mari.geo = types.SimpleNamespace(
+            find=lambda name: self.geo if name == self.geo.name() else None
+        )
+
+        saved = sys.modules.get("mari")
+        sys.modules["mari"] = mari
+
+        def restore():
+            if saved is None:
+                del sys.modules["mari"]
+            else:
+                sys.modules["mari"] = saved
+
+        self.addCleanup(restore)
+
+        hook_path = os.path.join(
+            os.path.dirname(__file__), "..", "hooks", "tk-mari_scene_operations.py"
+        )
+        spec = importlib.util.spec_from_file_location(
+            "test_tk_mari_scene_operations", hook_path
+        )
+        self.hook_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.hook_module)
+
+        patcher = mock.patch.object(
+            self.hook_module.sgtk.util, "find_publish", find_publish, create=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.hook = self.hook_module.MariSceneOperations(
+            types.SimpleNamespace(engine=self.engine, sgtk=None)
+        )
+
+    def test_version_paths_cached(self):
+        """
+        Ensures the versions of a geo are only listed again when they change.
+        """
+        expected = [{"node": "chair", "type": "geo", "path": "/proj/chair.v002.obj"}]
+        self.assertEqual(self.hook.scan_scene(), expected)
+        self.assertEqual(self.hook.scan_scene(), expected)
+        self.assertEqual(self.engine.version_listings, 1)
+
+        # a version added outside of the breakdown
+        self.geo.version_paths["v004"] = "/proj/chair.v004.obj"
+        self.hook.scan_scene()
+        self.assertEqual(self.engine.version_listings, 2)
+
+    def test_publishes_cached_per_breakdown(self):
+        """
+        Ensures publishes are looked up once per breakdown, and again once
+        the scene is scanned or the cached data expires.
+        """
+        item = {"node": "chair", "type": "geo", "path": "/proj/chair.v003.obj"}
+        self.hook.scan_scene()
+        self.hook.update([item])
+        self.assertEqual(self.geo.current, "v003")
+        self.geo.setCurrentVersion("v002")
+        self.hook.update([item])
+        self.assertEqual(self.geo.current, "v003")
+        self.assertEqual(self.queries, [["/proj/chair.v003.obj"]])
+        # the new version was added to the index rather than listed again
+        self.assertEqual(self.engine.version_listings, 1)
+
+        # a new breakdown sees new publishes
+        self.hook.scan_scene()
+        self.hook.update([item])
+        self.assertEqual(len(self.queries), 2)
+
+        with mock.patch.object(self.hook_module, "PUBLISH_CACHE_TTL", -1):
+            self.hook.update([item])
+        self.assertEqual(len(self.queries), 3)
+
+        # paths without publishes are reported
+        self.assertRaises(
+            self.hook_module.TankError,
+            self.hook.update,
+            [{"node": "chair", "type": "geo", "path": "/proj/chair.v005.obj"}],
+        )
@@ -0,0 +1,211 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import importlib.util
+import os
+import sys
+import time
+import types
+import unittest
+
+# simulated cost of a single python -> maya command round trip
+COMMAND_LATENCY = 0.00002
+
+
+class MockMayaScene(object):
+    """
+    Minimal in-memory maya scene exposing the subset of maya.cmds and
+    maya.api.OpenMaya used by the maya scene operations hook. Every command
+    call pays a fixed latency to mimic the cost of crossing into maya.
+    """
+
+    def __init__(self, num_file_nodes, num_references=10, referenced_every=5):
+        self.references = [
+            ("/proj/assets/char_%03d.v001.ma{%d}" % (i, i), "char_%03dRN" % i)
+            for i in range(num_references)
+        ]
+        self.file_nodes = []
+        for i in range(num_file_nodes):
+            name = "file%d" % i
+            if i % referenced_every == 0:
+                name = "char_000:%s" % name
+            self.file_nodes.append(
+                {
+                    "name": name,
+                    "referenced": i % referenced_every == 0,
+                    "path": "/proj/textures/tex_%05d.v002.exr" % i,
+                }
+            )
+        self._nodes_by_name = dict((n["name"], n) for n in self.file_nodes)
+
+    def _command(self):
+        time.sleep(COMMAND_LATENCY)
+
+    def build_modules(self):
+        """
+        Returns a dictionary of fake modules suitable for sys.modules.
+        """
+        scene = self
+
+        cmds = types.ModuleType("maya.cmds")
+
+        def file(*args, **kwargs):
+            scene._command()
+            return [ref for (ref, _) in scene.references]
+
+        def referenceQuery(target, **kwargs):
+            scene._command()
+            if kwargs.get("isNodeReferenced"):
+                return scene._nodes_by_name[target]["referenced"]
+            ref_nodes = dict(scene.references)
+            if kwargs.get("referenceNode"):
+                return ref_nodes[target]
+            if kwargs.get("withoutCopyNumber"):
+                return target.split("{")[0]
+            return target
+
+        def ls(*args, **kwargs):
+            scene._command()
+            return [n["name"] for n in scene.file_nodes]
+
+        def getAttr(attr):
+            scene._command()
+            return scene._nodes_by_name[attr.split(".")[0]]["path"]
+
+        cmds.file = file
+        cmds.referenceQuery = referenceQuery
+        cmds.ls = ls
+        cmds.getAttr = getAttr
+
+        om2 = types.ModuleType("maya.api.OpenMaya")
+
+        class MFn(object):
+            kFileTexture = 1
+
+        class MPlug(object):
+            def __init__(self, value):
+                self._value = value
+
+            def asString(self):
+                return self._value
+
+        class MFnDependencyNode(object):
+            def setObject(self, node):
+                self._node = node
+
+            @property
+            def isFromReferencedFile(self):
+                return self._node["referenced"]
+
+            def name(self):
+                return self._node["name"]
+
+            def findPlug(self, attr, want_networked):
+                return MPlug(self._node["path"])
+
+        class MItDependencyNodes(object):
+            def __init__(self, fn_type):
+                self._index = 0
+
+            def isDone(self):
+                return self._index >= len(scene.file_nodes)
+
+            def thisNode(self):
+                return scene.file_nodes[self._index]
+
+            def next(self):
+                self._index += 1
+
+        om2.MFn = MFn
+        om2.MFnDependencyNode = MFnDependencyNode
+        om2.MItDependencyNodes = MItDependencyNodes
+
+        maya = types.ModuleType("maya")
+        api = types.ModuleType("maya.api")
+        maya.cmds = cmds
+        maya.api = api
+        api.OpenMaya = om2
+
+        return {
+            "maya": maya,
+            "maya.cmds": cmds,
+            "maya.api": api,
+            "maya.api.OpenMaya": om2,
+        }
+
+
+class TestMayaSceneOperations(unittest.TestCase):
+    """
+    Tests and benchmarks the maya scene operations hook against a mocked maya.
+    """
+
+    def _load_hook(self, scene):
+        """
+        Imports the maya hook with the given mocked scene installed as maya.
+        """
+        modules = scene.build_modules()
+        saved = dict((name, sys.modules.get(name)) for name in modules)
+        sys.modules.update(modules)
+
+        def restore():
+            for (name, module) in saved.items():
+                if module is None:
+                    del sys.modules[name]
+                else:
+                    sys.modules[name] = module
+
+        self.addCleanup(restore)
+
+        hook_path = os.path.join(
+            os.path.dirname(__file__), "..", "hooks", "tk-maya_scene_operations.py"
+        )
+        spec = importlib.util.spec_from_file_location(
+            "test_tk_maya_scene_operations", hook_path
+        )
+        hook_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(hook_module)
+        return hook_module.BreakdownSceneOperations(None)
+
+    def test_batched_scan_matches(self):
+        """
+        Ensures the batched scan returns exactly what the per node scan does.
+        """
+        hook = self._load_hook(MockMayaScene(250))
+
+        per_node = hook._scan_scene_per_node()
+        batched = hook._scan_scene_batched()
+
+        self.assertEqual(per_node, batched)
+        self.assertEqual(hook.scan_scene(), batched)
+        # 10 references + 4 out of 5 file nodes which are not referenced
+        self.assertEqual(len(batched), 10 + 200)
+
+    def test_batched_scan_benchmark(self):
+        """
+        Times both scan modes on a large scene. The batched scan issues a
+        constant number of commands and should be well ahead.
+        """
+        hook = self._load_hook(MockMayaScene(8000))
+
+        start = time.time()
+        per_node = hook._scan_scene_per_node()
+        per_node_time = time.time() - start
+
+        start = time.time()
+        batched = hook._scan_scene_batched()
+        batched_time = time.time() - start
+
+        self.assertEqual(per_node, batched)
+        self.assertLess(
+            batched_time,
+            per_node_time,
+            "maya scan of %d items: per node %.3fs, batched %.3fs"
+            % (len(batched), per_node_time, batched_time),
+        )
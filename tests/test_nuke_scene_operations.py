@@ -0,0 +1,343 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import importlib.util
+import os
+import sys
+import types
+import unittest
+
+
+class MockKnob(object):
+    def __init__(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+    def setValue(self, value):
+        self._value = value
+
+
+class MockNode(object):
+    def __init__(self, name, node_class, path=None):
+        self.name = name
+        self.node_class = node_class
+        self.parent = None
+        self.knobs = {}
+        if path is not None:
+            self.knobs["file"] = MockKnob(path)
+
+    def Class(self):
+        return self.node_class
+
+    def fullName(self):
+        if self.parent is None or self.parent.parent is None:
+            return self.name
+        return "%s.%s" % (self.parent.fullName(), self.name)
+
+    def knob(self, name):
+        return self.knobs.get(name)
+
+
+class MockClip(object):
+    """
+    Clip, which is also its own active item and media source.
+    """
+
+    def __init__(self, name, paths):
+        self._name = name
+        self.paths = paths
+        self.reconnected = []
+
+    def activeItem(self):
+        return self
+
+    def mediaSource(self):
+        return self
+
+    def fileinfos(self):
+        return [types.SimpleNamespace(filename=lambda p=p: p) for p in self.paths]
+
+    def name(self):
+        return self._name
+
+    def reconnectMedia(self, path):
+        self.reconnected.append(path)
+
+
+class MockNukeScript(object):
+    """
+    Minimal in-memory nuke script exposing the subset of the nuke and hiero
+    modules used by the nuke scene operations hook.
+    """
+
+    def __init__(self, clips=None, gui=False):
+        self.gui = gui
+        self.clips = clips or []
+        self.undo_calls = []
+        # number of progress checks before the progress task is cancelled
+        self.cancel_after = None
+        self.progress_checks = 0
+
+        nuke = types.ModuleType("nuke")
+
+        class Group(MockNode):
+            def __init__(self, name, children=()):
+                MockNode.__init__(self, name, "Group")
+                self.children = []
+                for child in children:
+                    self.add(child)
+
+            def add(self, child):
+                child.parent = self
+                self.children.append(child)
+                return child
+
+            def nodes(self):
+                return list(self.children)
+
+        self.Group = Group
+        self.root = Group("Root")
+        self._nuke = nuke
+
+    def find(self, name):
+        """
+        Returns the node with the given full name, or None.
+        """
+
+        def walk(group):
+            for node in group.nodes():
+                yield node
+                if isinstance(node, self.Group):
+                    for child in walk(node):
+                        yield child
+
+        for node in walk(self.root):
+            if node.fullName() == name:
+                return node
+        return None
+
+    def build_modules(self):
+        """
+        Returns a dictionary of fake modules suitable for sys.modules.
+        """
+        script = self
+        nuke = self._nuke
+        nuke.GUI = self.gui
+        nuke.Group = self.Group
+        nuke.root = lambda: script.root
+        nuke.toNode = script.find
+        nuke.updateUI = lambda: None
+
+        class Undo(object):
+            @staticmethod
+            def begin(name):
+                script.undo_calls.append("begin")
+
+            @staticmethod
+            def end():
+                script.undo_calls.append("end")
+
+            @staticmethod
+            def cancel():
+                script.undo_calls.append("cancel")
+
+        class ProgressTask(object):
+            def __init__(self, message):
+                pass
+
+            def isCancelled(self):
+                script.progress_checks += 1
+                return (
+                    script.cancel_after is not None
+                    and script.progress_checks > script.cancel_after
+                )
+
+            def setMessage(self, message):
+                pass
+
+            def setProgress(self, progress):
+                pass
+
+        nuke.Undo = Undo
+        nuke.ProgressTask = ProgressTask
+
+        hiero = types.ModuleType("hiero")
+        core = types.ModuleType("hiero.core")
+        project = types.SimpleNamespace(
+            clipsBin=lambda: types.SimpleNamespace(clips=lambda: script.clips),
+            beginUndo=lambda name: script.undo_calls.append("begin clips"),
+            endUndo=lambda: script.undo_calls.append("end clips"),
+        )
+        core.projects = lambda: [project]
+        hiero.core = core
+
+        return {"nuke": nuke, "hiero": hiero, "hiero.core": core}
+
+
+class MockEngine(object):
+    def __init__(self, studio_enabled=False, hiero_enabled=False):
+        self.studio_enabled = studio_enabled
+        self.hiero_enabled = hiero_enabled
+        self.messages = []
+
+    def log_debug(self, msg):
+        self.messages.append(("debug", msg))
+
+    def log_info(self, msg):
+        self.messages.append(("info", msg))
+
+    def log_warning(self, msg):
+        self.messages.append(("warning", msg))
+
+
+class TestNukeSceneOperations(unittest.TestCase):
+    """
+    Tests the nuke scene operations hook against a mocked nuke.
+    """
+
+    def setUp(self):
+        self.script = MockNukeScript()
+        root = self.script.root
+        root.add(MockNode("Read1", "Read", "/proj/plates/plate.v001.%04d.exr"))
+        root.add(MockNode("Blur1", "Blur"))
+        group = root.add(self.script.Group("Group1"))
+        group.add(MockNode("Read2", "Read", "/proj/plates/plate.v001.%04d.exr"))
+        nested = group.add(self.script.Group("Group2"))
+        nested.add(MockNode("ReadGeo1", "ReadGeo2", "/proj/geo/geo.v003.abc"))
+        root.add(MockNode("Camera1", "Camera2", "/proj/cam/cam.v002.abc"))
+
+    def _load_hook(self, engine=None):
+        """
+        Imports the nuke hook with the mocked script installed as nuke.
+        """
+        modules = self.script.build_modules()
+        saved = dict((name, sys.modules.get(name)) for name in modules)
+        sys.modules.update(modules)
+
+        def restore():
+            for (name, module) in saved.items():
+                if module is None:
+                    del sys.modules[name]
+                else:
+                    sys.modules[name] = module
+
+        self.addCleanup(restore)
+
+        hook_path = os.path.join(
+            os.path.dirname(__file__), "..", "hooks", "tk-nuke_scene_operations.py"
+        )
+        spec = importlib.util.spec_from_file_location(
+            "test_tk_nuke_scene_operations", hook_path
+        )
+        hook_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(hook_module)
+
+        self.engine = engine or MockEngine()
+        return hook_module.BreakdownSceneOperations(
+            types.SimpleNamespace(engine=self.engine)
+        )
+
+    def test_scan_recurses_groups(self):
+        """
+        Ensures nodes inside groups are found, by their full name, and that
+        nodes sharing a path each get an item.
+        """
+        hook = self._load_hook()
+        plate = "/proj/plates/plate.v001.%04d.exr".replace("/", os.path.sep)
+        self.assertEqual(
+            [(i["node"], i["type"], i["path"]) for i in hook.scan_scene()],
+            [
+                ("Read1", "Read", plate),
+                ("Group1.Read2", "Read", plate),
+                (
+                    "Group1.Group2.ReadGeo1",
+                    "ReadGeo2",
+                    "/proj/geo/geo.v003.abc".replace("/", os.path.sep),
+                ),
+                (
+                    "Camera1",
+                    "Camera2",
+                    "/proj/cam/cam.v002.abc".replace("/", os.path.sep),
+                ),
+            ],
+        )
+
+        hook.RECURSE_GROUPS = False
+        self.assertEqual([i["node"] for i in hook.scan_scene()], ["Read1", "Camera1"])
+
+    def test_scan_dedupes_clip_paths(self):
+        """
+        Ensures a clip listing the same file several times yields one item.
+        """
+        clip = MockClip(
+            "clip1", ["/proj/a.v001.exr", "/proj/a.v001.exr", "/proj/b.v001.exr"]
+        )
+        self.script.clips = [clip]
+        hook = self._load_hook(MockEngine(hiero_enabled=True))
+        self.assertEqual(
+            [(i["node"], i["type"], i["path"]) for i in hook.scan_scene()],
+            [
+                (clip, "Clip", "/proj/a.v001.exr".replace("/", os.path.sep)),
+                (clip, "Clip", "/proj/b.v001.exr".replace("/", os.path.sep)),
+            ],
+        )
+
+    def test_update(self):
+        """
+        Ensures nodes are updated in one undo group, including nodes inside
+        groups, and that nodes which no longer exist are skipped.
+        """
+        hook = self._load_hook()
+        result = hook.update(
+            [
+                {
+                    "node": "Group1.Read2",
+                    "type": "Read",
+                    "path": "/proj/plate.v002.exr",
+                },
+                {"node": "Deleted1", "type": "Read", "path": "/proj/plate.v002.exr"},
+                {"node": "Camera1", "type": "Camera2", "path": "/proj/cam.v003.abc"},
+            ]
+        )
+        self.assertEqual(
+            self.script.find("Group1.Read2").knob("file").value(),
+            "/proj/plate.v002.exr",
+        )
+        self.assertEqual(
+            self.script.find("Camera1").knob("file").value(), "/proj/cam.v003.abc"
+        )
+        self.assertEqual(self.script.undo_calls, ["begin", "end"])
+        self.assertIsNone(result)
+        self.assertIn(
+            ("warning", "Node Deleted1 not found, it was not updated."),
+            self.engine.messages,
+        )
+
+    def test_update_cancelled(self):
+        """
+        Ensures cancelling reverts the node changes of the batch, and reports
+        that no items were updated so that the app stops the update.
+        """
+        self.script.gui = True
+        self.script.cancel_after = 1
+        hook = self._load_hook()
+        result = hook.update(
+            [
+                {"node": "Read1", "type": "Read", "path": "/proj/plate.v002.exr"},
+                {"node": "Camera1", "type": "Camera2", "path": "/proj/cam.v003.abc"},
+            ]
+        )
+        self.assertEqual(self.script.undo_calls, ["begin", "cancel"])
+        self.assertEqual(result, [])
+        self.assertEqual(
+            self.script.find("Camera1").knob("file").value(), "/proj/cam/cam.v002.abc"
+        )